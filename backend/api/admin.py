@@ -1,3 +1,351 @@
-from django.contrib import admin
+import datetime
 
-# Register your models here.
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ERROR_FLAG, PAGE_VAR
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
+
+from .duplicates import WARN, get_policy
+from .models import Category, Expense, Organization, PaymentMethod, Receipt, SlowQuery, Team
+from .receipt_status import PENDING
+
+# これより少ない行数の推定値は信頼せず、正確な COUNT(*) を使う
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """絞り込みのないチェンジリストでは、プランナ統計の推定行数を件数として使うページネータ
+
+    PostgreSQLの `pg_class.reltuples` を参照するため、大きなテーブルでも
+    COUNT(*) の全件走査が発生しない。その他のDBや絞り込み時は正確な件数を返す。
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class RelatedSearchFilter(admin.ListFilter):
+    """関連先の名前を入力して絞り込むフィルター
+
+    外部キーの標準のフィルターは関連先の全行（全組織分）を選択肢として読み込むため、
+    入力欄にして、クエリ文字列の `parameter_name` の値を `lookup`
+    （例: "category__name__icontains"）で絞り込む。
+    """
+
+    template = "admin/api/search_filter.html"
+    parameter_name = None
+    lookup = None
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        value = params.pop(self.parameter_name, "")
+        self.value = (value[-1] if isinstance(value, list) else value).strip()
+        if self.value:
+            self.used_parameters[self.parameter_name] = self.value
+
+    @classmethod
+    def create(cls, parameter_name, lookup, title):
+        attrs = {"parameter_name": parameter_name, "lookup": lookup, "title": title}
+        return type(f"{parameter_name}_filter", (cls,), attrs)
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def queryset(self, request, queryset):
+        if self.value:
+            return queryset.filter(**{self.lookup: self.value})
+        return queryset
+
+    def choices(self, changelist):
+        # 他の絞り込み・検索・並び順は保ち、ページ番号は先頭に戻す
+        hidden = [
+            (name, value)
+            for name, value in changelist.params.items()
+            if name not in (self.parameter_name, PAGE_VAR, ERROR_FLAG)
+        ]
+        yield {
+            "parameter_name": self.parameter_name,
+            "value": self.value,
+            "hidden_params": hidden,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+ORGANIZATION_FILTER = RelatedSearchFilter.create(
+    "organization", "organization__name__icontains", "組織"
+)
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """大量データでも一覧が重くならない管理画面の共通設定"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(Organization)
+class OrganizationAdmin(ScalableModelAdmin):
+    list_display = ("name", "id", "created_at")
+    search_fields = ("name",)
+    autocomplete_fields = ("members",)
+
+
+@admin.register(Team)
+class TeamAdmin(ScalableModelAdmin):
+    list_display = ("name", "organization", "created_at")
+    list_select_related = ("organization",)
+    list_filter = (ORGANIZATION_FILTER,)
+    search_fields = ("name",)
+
+
+@admin.register(Category)
+class CategoryAdmin(ScalableModelAdmin):
+    list_display = ("name", "color", "expense_count", "total_amount", "last_used_on")
+    list_filter = (ORGANIZATION_FILTER,)
+    search_fields = ("name",)
+
+
+@admin.register(PaymentMethod)
+class PaymentMethodAdmin(ScalableModelAdmin):
+    list_display = ("name", "code", "is_active", "expense_count", "total_amount", "last_used_on")
+    list_filter = (ORGANIZATION_FILTER, "is_active")
+    search_fields = ("name", "code")
+    actions = ("activate", "deactivate")
+
+    @admin.action(description="選択した支払い方法を有効にする", permissions=["change"])
+    def activate(self, request, queryset):
+        updated = queryset.update(is_active=True)
+        self.message_user(request, f"{updated}件を有効にしました", messages.SUCCESS)
+
+    @admin.action(description="選択した支払い方法を無効にする", permissions=["change"])
+    def deactivate(self, request, queryset):
+        updated = queryset.update(is_active=False)
+        self.message_user(request, f"{updated}件を無効にしました", messages.SUCCESS)
+
+
+class SuspectedDuplicateFilter(admin.SimpleListFilter):
+    """同じ組織でフィンガープリントが他の経費と一致するものに絞り込む"""
+
+    title = "重複の疑い"
+    parameter_name = "duplicate"
+
+    def lookups(self, request, model_admin):
+        return (("yes", "重複の疑いあり"),)
+
+    def queryset(self, request, queryset):
+        if self.value() != "yes":
+            return queryset
+        # 行ごとに (organization, fingerprint) の索引を1回探索する
+        others = Expense.unscoped.filter(
+            organization=OuterRef("organization"), fingerprint=OuterRef("fingerprint")
+        ).exclude(pk=OuterRef("pk"))
+        return queryset.exclude(fingerprint="").filter(Exists(others))
+
+
+class YearFilter(admin.SimpleListFilter):
+    """年で絞り込む（date_hierarchy は全行の年を DISTINCT で求めるため使わない）
+
+    選択肢は最も古い日付と新しい日付の年の範囲で、(-date) の索引の両端を読むだけで求める。
+    """
+
+    title = "年"
+    parameter_name = "year"
+
+    def lookups(self, request, model_admin):
+        dates = model_admin.get_queryset(request).values_list("date", flat=True)
+        first = dates.order_by("date").first()
+        last = dates.order_by("-date").first()
+        if first is None:
+            return ()
+        return [(str(year), f"{year}年") for year in range(last.year, first.year - 1, -1)]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        start, end = date_range(self.value())
+        return queryset.filter(date__gte=start, date__lt=end)
+
+
+class MonthFilter(admin.SimpleListFilter):
+    """年を選んだ後に月で絞り込む"""
+
+    title = "月"
+    parameter_name = "month"
+
+    def lookups(self, request, model_admin):
+        if not request.GET.get(YearFilter.parameter_name):
+            return ()
+        return [(str(month), f"{month}月") for month in range(1, 13)]
+
+    def queryset(self, request, queryset):
+        year = request.GET.get(YearFilter.parameter_name)
+        if self.value() is None or not year:
+            return queryset
+        start, end = date_range(year, self.value())
+        return queryset.filter(date__gte=start, date__lt=end)
+
+
+def date_range(year, month=None):
+    """年（と月）の初日と、その次の期間の初日を返す（索引の範囲検索にする）"""
+    try:
+        year = int(year)
+        if month is None:
+            return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        start = datetime.date(year, int(month), 1)
+    except (TypeError, ValueError) as e:
+        raise IncorrectLookupParameters(e) from e
+    return start, (start + datetime.timedelta(days=31)).replace(day=1)
+
+
+class ExpenseAdminForm(forms.ModelForm):
+    """経費の登録フォーム。EXPENSE_DUPLICATE_POLICY が reject / merge なら重複の疑いがある登録を拒否する
+
+    管理画面では既存の経費にまとめる先を選べないため、merge でも登録せずに既存の経費を示す。
+    編集は GraphQL の updateExpense と同じくポリシーの対象外とする。
+    """
+
+    class Meta:
+        model = Expense
+        fields = "__all__"
+
+    def clean(self):
+        cleaned_data = super().clean()
+        policy = get_policy()
+        if not self.instance._state.adding or policy == WARN or self.errors:
+            return cleaned_data
+        candidate = Expense(
+            date=cleaned_data.get("date"),
+            amount=cleaned_data.get("amount"),
+            payment=cleaned_data.get("payment"),
+            description=cleaned_data.get("description"),
+        )
+        duplicate = candidate.find_duplicates().order_by("created_at").first()
+        if duplicate is not None:
+            raise ValidationError(
+                f"同じ内容の経費が既に登録されています: {duplicate}（重複ポリシー: {policy}）"
+            )
+        return cleaned_data
+
+
+@admin.register(Expense)
+class ExpenseAdmin(ScalableModelAdmin):
+    form = ExpenseAdminForm
+    list_display = ("date", "amount", "category", "payment", "description")
+    list_select_related = ("category", "payment")
+    list_filter = (
+        SuspectedDuplicateFilter,
+        YearFilter,
+        MonthFilter,
+        ORGANIZATION_FILTER,
+        RelatedSearchFilter.create("category", "category__name__icontains", "カテゴリー"),
+        RelatedSearchFilter.create("payment", "payment__name__icontains", "支払い方法"),
+    )
+    autocomplete_fields = ("category", "payment", "team")
+    actions = ("delete_expenses",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        duplicates = obj.find_duplicates().count()
+        if duplicates:
+            self.message_user(
+                request, f"同じ内容の経費が他に{duplicates}件あります（重複の疑い）", messages.WARNING
+            )
+
+    def delete_queryset(self, request, queryset):
+        # delete_selected と delete_expenses の削除は Expense.delete() を経由しないため、
+        # 影響したカテゴリー・支払い方法のカウンターを同じトランザクションで集計し直す
+        with transaction.atomic():
+            affected = queryset.order_by().values("category_id", "payment_id").distinct()
+            category_ids = {row["category_id"] for row in affected}
+            payment_ids = {row["payment_id"] for row in affected} - {None}
+            result = queryset.delete()
+            Category.recount_usage(Category.unscoped.filter(pk__in=category_ids))
+            PaymentMethod.recount_usage(PaymentMethod.unscoped.filter(pk__in=payment_ids))
+        return result
+
+    @admin.action(description="選択した経費を一括削除する（確認画面なし）", permissions=["delete"])
+    def delete_expenses(self, request, queryset):
+        # delete_selected は対象を1件ずつ描画するため、確認画面なしで直接削除する
+        _, deleted = self.delete_queryset(request, queryset)
+        count = deleted.get(Expense._meta.label, 0)
+        self.message_user(request, f"{count}件を削除しました", messages.SUCCESS)
+
+
+@admin.register(Receipt)
+class ReceiptAdmin(ScalableModelAdmin):
+    list_display = (
+        "file_name",
+        "expense",
+        "extraction_status",
+        "extracted_date",
+        "extracted_amount",
+        "amount_mismatch",
+        "date_mismatch",
+        "created_at",
+    )
+    list_select_related = ("expense__category",)
+    list_filter = ("extraction_status", "amount_mismatch", "date_mismatch")
+    raw_id_fields = ("expense",)
+    search_fields = ("file_name",)
+    readonly_fields = (
+        "extraction_status",
+        "extractor_version",
+        "extracted_at",
+        "extraction_error",
+        "extracted_sources",
+        "extracted_date",
+        "extracted_amount",
+        "captured_at",
+        "amount_mismatch",
+        "date_mismatch",
+        "extracted_text",
+    )
+    actions = ("unlink_expense", "extract_metadata")
+
+    @admin.action(description="選択した領収書と経費の紐付けを解除する", permissions=["change"])
+    def unlink_expense(self, request, queryset):
+        updated = queryset.update(expense=None)
+        self.message_user(request, f"{updated}件の紐付けを解除しました", messages.SUCCESS)
+
+    @admin.action(description="選択した領収書のメタデータを抽出し直す", permissions=["change"])
+    def extract_metadata(self, request, queryset):
+        # OCRは1件あたり OCR_TIMEOUT 秒かかることがあり、リクエスト内ではメモリ上限もかけられないため、
+        # ここでは未処理に戻すだけにして、抽出は manage.py extract_receipts のワーカーに任せる
+        queued = queryset.update(extraction_status=PENDING)
+        self.message_user(
+            request,
+            f"{queued}件を再抽出の対象にしました（manage.py extract_receipts で抽出されます）",
+            messages.SUCCESS,
+        )
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(ScalableModelAdmin):
+    list_display = ("statement", "calls", "total_time_ms", "max_time_ms", "resolver", "last_seen")
+    list_filter = ("operation",)
+    search_fields = ("statement", "resolver")
+    readonly_fields = tuple(field.name for field in SlowQuery._meta.fields)
+
+    def has_add_permission(self, request):
+        return False
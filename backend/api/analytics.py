@@ -0,0 +1,470 @@
+"""経費分析エンジン
+
+Expenseの列指向スナップショット（NumPy配列）を保持し、月別推移・移動平均・
+前期比・カテゴリー別パーセンタイルをベクトル演算で計算する。
+スナップショットは組織ごとに作り、`updated_at` と削除記録（ExpenseDeletion）を基準に
+差分更新する。分析クエリの中での差分更新は ANALYTICS_SNAPSHOT_REFRESH_SECONDS ごとに
+1回だけ行い、ディスクへの保存は refresh_analytics コマンドが行う。
+プロセス内には最近使った ANALYTICS_SNAPSHOT_CACHE_TENANTS 組織分だけ保持し、
+読み込み・更新のロックも組織ごとに分けるため、大きな組織の処理が他の組織を待たせない。
+
+分析は更新と並行して別スレッドから呼ばれるため、列は変更しない Columns にまとめ、
+更新は新しい Columns を作ってから1回の代入で差し替える（読み手はロックを取らない）。
+行はIDの16バイト値の順に並べ、IDの検索は二分探索で行う（行ごとのPythonオブジェクトを持たない）。
+"""
+
+import datetime
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Expense, ExpenseDeletion
+from .tenancy import require_tenant, tenant_id
+
+# amount（小数点以下2桁）を整数の最小単位で保持する
+MINOR_UNITS = 100
+NO_CODE = -1
+
+# UUIDの16バイト値（バイト順に比較・整列できる）
+ID_DTYPE = np.dtype("V16")
+
+ROW_FIELDS = ("id", "date", "amount", "category_id", "payment_id", "updated_at")
+RECONCILE_BATCH_SIZE = 1000
+
+# updated_at は行の保存時（コミット前）に付くため、後からコミットされた行は前回の
+# watermark より古い時刻を持ちうる。差分更新ではこの幅だけさかのぼって読み直す
+# （それより遅れたコミットは refresh_analytics --reconcile で取り込む）
+WATERMARK_OVERLAP = datetime.timedelta(minutes=5)
+
+
+def to_minor(amount: Decimal) -> int:
+    return int(amount * MINOR_UNITS)
+
+
+def from_minor(value) -> Decimal:
+    return (Decimal(str(value)) / MINOR_UNITS).quantize(Decimal("0.01"))
+
+
+def id_array(values) -> np.ndarray:
+    """UUIDの並びを ID_DTYPE の配列にする"""
+    return np.array([value.bytes for value in values], dtype=ID_DTYPE)
+
+
+def deletion_retention() -> datetime.timedelta:
+    return datetime.timedelta(days=settings.ANALYTICS_DELETION_RETENTION_DAYS)
+
+
+@dataclass(frozen=True)
+class Columns:
+    """同じ長さの列の組（行iが1件の経費、ids の昇順）。配列は書き込み不可にして共有する"""
+
+    ids: np.ndarray
+    dates: np.ndarray
+    amounts: np.ndarray
+    category_codes: np.ndarray
+    payment_codes: np.ndarray
+
+    def __post_init__(self):
+        for array in self.arrays().values():
+            array.flags.writeable = False
+
+    @classmethod
+    def empty(cls) -> "Columns":
+        return cls(
+            ids=np.empty(0, dtype=ID_DTYPE),
+            dates=np.empty(0, dtype="datetime64[D]"),
+            amounts=np.empty(0, dtype=np.int64),
+            category_codes=np.empty(0, dtype=np.int32),
+            payment_codes=np.empty(0, dtype=np.int32),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def positions(self, ids) -> tuple[np.ndarray, np.ndarray]:
+        """ids の挿入位置と、その位置に同じIDの行があるかどうかを返す"""
+        positions = np.searchsorted(self.ids, ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == ids[found]
+        return positions, found
+
+    def delete(self, positions) -> "Columns":
+        return Columns(
+            **{name: np.delete(array, positions) for name, array in self.arrays().items()}
+        )
+
+
+class ExpenseSnapshot:
+    """Expenseの列指向スナップショット
+
+    列は `columns`（Columns）に保持する。カテゴリー・支払い方法はコード
+    （`categories` / `payments` のインデックス）で保持し、これらのリストは追記だけする。
+    `watermark` は取り込んだ行の最大の updated_at、`synced_at` は最後に削除記録を
+    読んだ時刻。tenant を省略すると現在の組織のスナップショットになる。
+    """
+
+    def __init__(self, tenant=None):
+        self.tenant = tenant_id(tenant) if tenant is not None else require_tenant()
+        self.columns = Columns.empty()
+        self.categories: list[str] = []
+        self.payments: list[str] = []
+        self.watermark: datetime.datetime | None = None
+        self.synced_at: datetime.datetime | None = None
+        self.refreshed_at: float | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns)
+
+    @property
+    def ids(self):
+        return self.columns.ids
+
+    @property
+    def dates(self):
+        return self.columns.dates
+
+    # --- 更新 ---
+
+    def refresh(self, max_age: float | None = None) -> int:
+        """前回の `updated_at`（から WATERMARK_OVERLAP さかのぼった時刻）以降に変更された経費と
+        削除記録を取り込み、追加・変更・削除した件数を返す
+
+        max_age を指定すると、前回の更新からその秒数が経っていなければ何もしない。
+        """
+        with self._lock:
+            if (
+                max_age is not None
+                and self.refreshed_at is not None
+                and time.monotonic() - self.refreshed_at < max_age
+            ):
+                return 0
+
+            started = timezone.now()
+            initial = self.watermark is None and self.synced_at is None
+            queryset = self._expenses().order_by()
+            if self.watermark is not None:
+                queryset = queryset.filter(updated_at__gte=self.watermark - WATERMARK_OVERLAP)
+            rows = list(queryset.values_list(*ROW_FIELDS))
+            changed = 0
+            if rows:
+                changed = self._upsert(rows)
+                latest = max(row[5] for row in rows)
+                self.watermark = latest if self.watermark is None else max(self.watermark, latest)
+
+            if not initial:
+                since = None if self.synced_at is None else self.synced_at - WATERMARK_OVERLAP
+                if since is None or since < started - deletion_retention():
+                    # 削除記録が消えた期間をまたぐ（または記録のない古い保存形式の）ため、全IDで突き合わせる
+                    changed += self._reconcile()
+                else:
+                    deleted = self._deletions().filter(deleted_at__gte=since)
+                    changed += self._remove(id_array(deleted.values_list("expense_id", flat=True)))
+            self.synced_at = started
+            self.refreshed_at = time.monotonic()
+            return changed
+
+    def reconcile(self) -> int:
+        """全IDで突き合わせ、消えた行を除き足りない行を取り込む（O(n)。保守用）"""
+        with self._lock:
+            return self._reconcile()
+
+    def _expenses(self):
+        return Expense.objects.for_tenant(self.tenant)
+
+    def _deletions(self):
+        return ExpenseDeletion.objects.for_tenant(self.tenant).order_by()
+
+    def _code(self, codes: list[str], value) -> int:
+        if value is None:
+            return NO_CODE
+        key = str(value)
+        try:
+            return codes.index(key)
+        except ValueError:
+            codes.append(key)
+            return len(codes) - 1
+
+    def _upsert(self, rows) -> int:
+        ids = id_array(row[0] for row in rows)
+        order = np.argsort(ids, kind="stable")
+        rows = [rows[i] for i in order]
+        values = {
+            "ids": ids[order],
+            "dates": np.array([row[1] for row in rows], dtype="datetime64[D]"),
+            "amounts": np.array([to_minor(row[2]) for row in rows], dtype=np.int64),
+            "category_codes": np.array(
+                [self._code(self.categories, row[3]) for row in rows], dtype=np.int32
+            ),
+            "payment_codes": np.array(
+                [self._code(self.payments, row[4]) for row in rows], dtype=np.int32
+            ),
+        }
+
+        current = self.columns
+        positions, existing = current.positions(values["ids"])
+        new = ~existing
+        target = positions[existing]
+        modified = np.zeros(len(target), dtype=bool)
+        for name in ("dates", "amounts", "category_codes", "payment_codes"):
+            modified |= getattr(current, name)[target] != values[name][existing]
+        changed = int(new.sum() + modified.sum())
+        if not changed:
+            return 0
+
+        # 公開中の列は書き換えず、コピーに反映してから差し替える。
+        # 新しい行はIDの順に並べてあるため、挿入位置に入れれば昇順が保たれる
+        arrays = {}
+        for name, column in current.arrays().items():
+            if name != "ids":
+                column = column.copy()
+                column[target] = values[name][existing]
+            arrays[name] = np.insert(column, positions[new], values[name][new])
+        self.columns = Columns(**arrays)
+        return changed
+
+    def _remove(self, ids) -> int:
+        current = self.columns
+        positions, found = current.positions(ids)
+        positions = np.unique(positions[found])
+        if not len(positions):
+            return 0
+        self.columns = current.delete(positions)
+        return len(positions)
+
+    def _reconcile(self) -> int:
+        live = np.sort(id_array(self._expenses().order_by().values_list("id", flat=True)))
+        removed = self._remove(self.columns.ids[~np.isin(self.columns.ids, live)])
+        _, found = self.columns.positions(live)
+        missing = [uuid.UUID(bytes=value.tobytes()) for value in live[~found]]
+        added = 0
+        for start in range(0, len(missing), RECONCILE_BATCH_SIZE):
+            chunk = missing[start : start + RECONCILE_BATCH_SIZE]
+            added += self._upsert(
+                list(self._expenses().filter(pk__in=chunk).values_list(*ROW_FIELDS))
+            )
+        return removed + added
+
+    # --- 永続化 ---
+
+    def save(self, path: Path):
+        """一時ファイルに書き出してから置き換える（読み込み中のプロセスを壊さない）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            columns = self.columns
+            categories, payments = list(self.categories), list(self.payments)
+            watermark, synced_at = self.watermark, self.synced_at
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                **columns.arrays(),
+                categories=np.array(categories, dtype="U36"),
+                payments=np.array(payments, dtype="U36"),
+                watermark=np.array(watermark.isoformat() if watermark else ""),
+                synced_at=np.array(synced_at.isoformat() if synced_at else ""),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, tenant=None) -> "ExpenseSnapshot":
+        snapshot = cls(tenant)
+        with np.load(path) as data:
+            arrays = {f.name: data[f.name] for f in fields(Columns)}
+            snapshot.categories = [str(v) for v in data["categories"]]
+            snapshot.payments = [str(v) for v in data["payments"]]
+            watermark = str(data["watermark"])
+            synced_at = str(data["synced_at"]) if "synced_at" in data.files else ""
+        if arrays["ids"].dtype != ID_DTYPE:
+            # 以前の保存形式（IDの文字列、追加順）は16バイト値にしてIDの順に並べ直す
+            ids = id_array(uuid.UUID(str(value)) for value in arrays["ids"])
+            order = np.argsort(ids, kind="stable")
+            arrays = {name: array[order] for name, array in {**arrays, "ids": ids}.items()}
+        snapshot.columns = Columns(**arrays)
+        snapshot.watermark = datetime.datetime.fromisoformat(watermark) if watermark else None
+        snapshot.synced_at = datetime.datetime.fromisoformat(synced_at) if synced_at else None
+        return snapshot
+
+    # --- 分析 ---
+    # 各メソッドは最初に columns を1回だけ読み、以降はその組だけを使う
+
+    def _mask(self, columns, start=None, end=None, category_id=None):
+        mask = np.ones(len(columns), dtype=bool)
+        if start is not None:
+            mask &= columns.dates >= np.datetime64(start, "D")
+        if end is not None:
+            mask &= columns.dates <= np.datetime64(end, "D")
+        if category_id is not None:
+            key = str(category_id)
+            code = self.categories.index(key) if key in self.categories else NO_CODE - 1
+            mask &= columns.category_codes == code
+        return mask
+
+    def monthly_totals(self, start: datetime.date, end: datetime.date, category_id=None):
+        """start〜endの月別合計（最小単位）を、経費のない月も0として返す"""
+        columns = self.columns
+        mask = self._mask(columns, start, end, category_id)
+        first = np.datetime64(start, "M")
+        months = np.arange(first, np.datetime64(end, "M") + 1)
+        offsets = (columns.dates[mask].astype("datetime64[M]") - first).astype(np.int64)
+        totals = np.bincount(offsets, weights=columns.amounts[mask], minlength=len(months))
+        return months, np.rint(totals).astype(np.int64)
+
+    def trend(self, start: datetime.date, end: datetime.date, window: int = 3, category_id=None):
+        """月別合計・後方移動平均・前月比の差分を返す"""
+        months, totals = self.monthly_totals(start, end, category_id)
+        cumulative = np.concatenate([[0], np.cumsum(totals)])
+        moving = np.full(len(totals), np.nan)
+        if 0 < window <= len(totals):
+            moving[window - 1 :] = (cumulative[window:] - cumulative[:-window]) / window
+        deltas = np.diff(totals, prepend=totals[:1])
+
+        return [
+            {
+                "period": month.astype(datetime.date),
+                "total": from_minor(total),
+                "moving_average": None if np.isnan(avg) else from_minor(round(avg)),
+                "delta": from_minor(delta) if i > 0 else None,
+            }
+            for i, (month, total, avg, delta) in enumerate(zip(months, totals, moving, deltas))
+        ]
+
+    def category_percentiles(self, percentiles, start=None, end=None):
+        """カテゴリーごとの件数・合計・金額パーセンタイルを返す"""
+        columns = self.columns
+        mask = self._mask(columns, start, end)
+        codes = columns.category_codes[mask]
+        amounts = columns.amounts[mask]
+        order = np.lexsort((amounts, codes))
+        codes, amounts = codes[order], amounts[order]
+        unique, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+
+        results = []
+        for code, begin, count in zip(unique, starts, counts):
+            group = amounts[begin : begin + count]
+            values = np.percentile(group, percentiles) if len(percentiles) else []
+            results.append(
+                {
+                    "category_id": self.categories[code],
+                    "count": int(count),
+                    "total": from_minor(int(group.sum())),
+                    "percentiles": [from_minor(round(v)) for v in values],
+                }
+            )
+        return results
+
+
+def verify_against_orm(snapshot: ExpenseSnapshot) -> list[str]:
+    """スナップショットの集計をORMの集計と突き合わせ、不一致の説明を返す"""
+    mismatches = []
+    if len(snapshot) == 0:
+        return mismatches
+
+    dates = snapshot.columns.dates
+    start = dates.min().astype(datetime.date)
+    end = dates.max().astype(datetime.date)
+    months, totals = snapshot.monthly_totals(start, end)
+    by_month = {month.astype(datetime.date): from_minor(total) for month, total in zip(months, totals)}
+    expenses = Expense.objects.for_tenant(snapshot.tenant)
+    orm_months = (
+        expenses.order_by()
+        .annotate(month=TruncMonth("date"))
+        .values("month")
+        .annotate(total=Sum("amount"))
+    )
+    for row in orm_months:
+        if by_month.get(row["month"], Decimal("0.00")) != row["total"]:
+            mismatches.append(
+                f"{row['month']:%Y-%m}: snapshot={by_month.get(row['month'])} orm={row['total']}"
+            )
+
+    by_category = {row["category_id"]: row for row in snapshot.category_percentiles([])}
+    orm_categories = (
+        expenses.order_by().values("category_id").annotate(count=Count("id"), total=Sum("amount"))
+    )
+    for row in orm_categories:
+        cached = by_category.get(str(row["category_id"]))
+        if cached is None or (cached["count"], cached["total"]) != (row["count"], row["total"]):
+            mismatches.append(f"category {row['category_id']}: snapshot={cached} orm={row}")
+    return mismatches
+
+
+def snapshot_path(tenant) -> Path:
+    """組織ごとのスナップショットの保存先（ANALYTICS_SNAPSHOT_PATH のファイル名に組織IDを付ける）"""
+    path = Path(settings.ANALYTICS_SNAPSHOT_PATH)
+    return path.with_name(f"{path.stem}.{tenant_id(tenant)}{path.suffix}")
+
+
+class _Slot:
+    """1組織分のスナップショットと、その読み込み用のロック"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot: ExpenseSnapshot | None = None
+
+
+_snapshots: "OrderedDict[object, _Slot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def _slot(tenant) -> _Slot:
+    with _snapshots_lock:
+        slot = _snapshots.get(tenant)
+        if slot is None:
+            slot = _snapshots[tenant] = _Slot()
+        _snapshots.move_to_end(tenant)
+        while len(_snapshots) > max(settings.ANALYTICS_SNAPSHOT_CACHE_TENANTS, 1):
+            _snapshots.popitem(last=False)
+        return slot
+
+
+def get_snapshot(tenant=None, refresh=True) -> ExpenseSnapshot:
+    """プロセス内で共有する組織のスナップショットを返す（省略時は現在の組織）
+
+    前回の更新から ANALYTICS_SNAPSHOT_REFRESH_SECONDS 経っていれば差分更新する。
+    保存済みのファイルがなければ、ここで全件から作って保存する。
+    """
+    tenant = tenant_id(tenant) if tenant is not None else require_tenant()
+    path = snapshot_path(tenant)
+    slot = _slot(tenant)
+    with slot.lock:
+        if slot.snapshot is None:
+            if path.exists():
+                slot.snapshot = ExpenseSnapshot.load(path, tenant)
+            else:
+                snapshot = ExpenseSnapshot(tenant)
+                snapshot.refresh()
+                snapshot.save(path)
+                slot.snapshot = snapshot
+        snapshot = slot.snapshot
+    if refresh:
+        snapshot.refresh(max_age=settings.ANALYTICS_SNAPSHOT_REFRESH_SECONDS)
+    return snapshot
+
+
+def reset_snapshot(tenant=None):
+    """プロセス内のスナップショットを破棄する（次回アクセス時にディスクから再読込）
+
+    tenant を省略するとすべての組織の分を破棄する。
+    """
+    with _snapshots_lock:
+        if tenant is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(tenant_id(tenant), None)
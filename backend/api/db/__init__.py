@@ -0,0 +1,6 @@
+"""データベースバックエンドと接続プール
+
+Django 4.2 には接続プールがないため、psycopg2 の接続を使い回すプールと、
+それを使う PostgreSQL バックエンド（`api.db.postgresql`）、WAL などを設定する
+SQLite バックエンド（`api.db.sqlite3`）をここに置く。
+"""
@@ -0,0 +1,299 @@
+"""スレッドセーフな接続プール
+
+WSGIのスレッドワーカーとASGI（sync_to_async のスレッド）のどちらからでも使えるよう、
+貸し出しと返却は threading.Condition で排他する。接続の作成・ヘルスチェック・クローズは
+ロックの外で行い、遅いDBが他のスレッドの貸し出しを止めないようにする。
+
+貸し出し時に一定時間以上使われていなかった接続はヘルスチェックし、失敗したものは捨てて
+作り直す。待ち時間と使用率（saturation）は stats() で取得できる。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("api.db.pool")
+
+
+class PoolTimeout(Exception):
+    """timeout 秒以内に接続を借りられなかった"""
+
+
+class ConnectionPool:
+    """接続を max_size 本まで作り、使い終わったものを再利用するプール
+
+    factory は新しい接続を返す関数、check は接続が使えるかを返す関数、
+    reset は返却された接続を次の利用者のために片付け、再利用できるかを返す関数。
+    """
+
+    def __init__(
+        self,
+        factory,
+        *,
+        check=None,
+        reset=None,
+        close=None,
+        min_size=0,
+        max_size=10,
+        timeout=30.0,
+        max_idle=600.0,
+        check_after=30.0,
+        slow_wait_ms=100.0,
+        name="default",
+    ):
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError("0 <= min_size <= max_size かつ max_size >= 1 である必要があります")
+        self.factory = factory
+        self.check = check or (lambda conn: True)
+        self.reset = reset or (lambda conn: True)
+        self.close_connection = close or (lambda conn: conn.close())
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.slow_wait_ms = slow_wait_ms
+        self.name = name
+
+        self._cond = threading.Condition()
+        # (接続, 返却時刻)。右端が最後に返却された接続で、LIFOで貸し出す
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._counters = dict.fromkeys(
+            (
+                "checkouts",
+                "timeouts",
+                "waits",
+                "connections_created",
+                "connections_discarded",
+                "health_check_failures",
+                "peak_in_use",
+                "peak_waiting",
+            ),
+            0,
+        )
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+
+    def getconn(self):
+        """接続を借りる。空きがなければ timeout 秒まで返却を待つ"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn, returned_at = self._reserve(deadline)
+            if conn is None:
+                try:
+                    conn = self.factory()
+                except BaseException:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self._counters["connections_created"] += 1
+                break
+            idle_for = time.monotonic() - returned_at
+            if idle_for >= self.check_after and not self._healthy(conn):
+                with self._cond:
+                    self._counters["health_check_failures"] += 1
+                self._discard(conn)
+                continue
+            break
+
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            self._counters["peak_in_use"] = max(self._counters["peak_in_use"], self._in_use)
+            self._wait_ms_total += wait_ms
+            self._wait_ms_max = max(self._wait_ms_max, wait_ms)
+        if wait_ms >= self.slow_wait_ms:
+            logger.warning(
+                "pool %s: waited %.1fms for a connection (in use %d/%d)",
+                self.name,
+                wait_ms,
+                self._in_use,
+                self.max_size,
+            )
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """接続を返却する。discard が真か reset に失敗した接続は閉じる"""
+        reusable = not discard and not self._closed and self._reset(conn)
+        expired = []
+        with self._cond:
+            self._in_use -= 1
+            if reusable:
+                now = time.monotonic()
+                self._idle.append((conn, now))
+                # 最小本数を残して、長く使われていない接続（左端）を閉じる
+                while (
+                    len(self._idle) > 1
+                    and self._size - len(expired) > self.min_size
+                    and now - self._idle[0][1] >= self.max_idle
+                ):
+                    expired.append(self._idle.popleft()[0])
+                    self._size -= 1
+                    self._counters["connections_discarded"] += 1
+            else:
+                self._size -= 1
+                self._counters["connections_discarded"] += 1
+            self._cond.notify()
+        if not reusable:
+            self._close_quietly(conn)
+        for stale in expired:
+            self._close_quietly(stale)
+
+    def fill(self):
+        """min_size 本になるまで接続を作っておく"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self.factory()
+            except BaseException:
+                self._release_slot()
+                raise
+            with self._cond:
+                self._counters["connections_created"] += 1
+                self._idle.appendleft((conn, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        """空いている接続を全て閉じ、以後に返却された接続も閉じる"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """プールの状態と累計の計測値"""
+        with self._cond:
+            checkouts = self._counters["checkouts"]
+            return {
+                "name": self.name,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "saturation": self._in_use / self.max_size,
+                **self._counters,
+                "wait_ms_total": round(self._wait_ms_total, 3),
+                "wait_ms_mean": round(self._wait_ms_total / checkouts, 3) if checkouts else 0.0,
+                "wait_ms_max": round(self._wait_ms_max, 3),
+            }
+
+    def _reserve(self, deadline):
+        """空き接続を取り出すか、新しく作る枠を確保する（枠のときは (None, None)）"""
+        with self._cond:
+            if self._closed:
+                raise PoolTimeout(f"pool {self.name} is closed")
+            counted_wait = False
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    self._counters["timeouts"] += 1
+                    logger.error(
+                        "pool %s: no connection available within %.1fs (%d in use)",
+                        self.name,
+                        self.timeout,
+                        self._in_use,
+                    )
+                    raise PoolTimeout(
+                        f"pool {self.name}: no connection available within {self.timeout}s"
+                    )
+                if not counted_wait:
+                    self._counters["waits"] += 1
+                    counted_wait = True
+                self._waiting += 1
+                self._counters["peak_waiting"] = max(self._counters["peak_waiting"], self._waiting)
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._counters["connections_discarded"] += 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    def _healthy(self, conn):
+        try:
+            return bool(self.check(conn))
+        except Exception:
+            logger.warning("pool %s: health check failed", self.name, exc_info=True)
+            return False
+
+    def _reset(self, conn):
+        try:
+            return bool(self.reset(conn))
+        except Exception:
+            logger.warning(
+                "pool %s: failed to reset a returned connection", self.name, exc_info=True
+            )
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            self.close_connection(conn)
+        except Exception:
+            logger.debug("pool %s: error while closing a connection", self.name, exc_info=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(key, create):
+    """key ごとのプールを返す（なければ create() で作る）
+
+    gunicorn の --preload などでフォーク前に作られたプールは子プロセスで使えないため、
+    プロセスが変わったら作り直す。
+    """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = create()
+        return pool
+
+
+def all_pools():
+    with _pools_lock:
+        return list(_pools.values()) if _pools_pid == os.getpid() else []
+
+
+def close_pools(alias=None):
+    """プールを閉じて登録を解除する（alias を指定するとそのDBのプールだけ）"""
+    with _pools_lock:
+        keys = [key for key in _pools if alias is None or key[0] == alias]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
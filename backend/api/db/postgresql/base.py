@@ -0,0 +1,131 @@
+"""接続プールを使う PostgreSQL バックエンド
+
+ENGINE に `api.db.postgresql` を指定し、OPTIONS の "pool" に True か
+ConnectionPool の引数（min_size / max_size / timeout / max_idle / check_after）を渡すと、
+リクエスト終了時に閉じられた接続をプールへ返し、次のリクエストで再利用する。
+"pool" がなければ Django 標準の postgresql バックエンドと同じに動く。
+
+プールは DB のエイリアスと接続パラメータごとに1つで、同じ設定の接続だけを共有するため、
+タイムゾーンなどのセッション状態は返却時に戻さない。未完了のトランザクションはロールバックする。
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from django.utils.asyncio import async_unsafe
+
+from ..pool import ConnectionPool, close_pools, get_pool
+
+# psycopg2 / psycopg の TransactionStatus の値
+TRANSACTION_STATUS_IDLE = 0
+TRANSACTION_STATUS_UNKNOWN = 4
+
+POOL_DEFAULTS = {
+    "min_size": 0,
+    "max_size": 10,
+    "timeout": 30.0,
+    "max_idle": 600.0,
+    "check_after": 30.0,
+}
+
+
+def check_connection(connection):
+    """貸し出し前のヘルスチェック（SELECT 1 が通るか）"""
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+    if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return True
+
+
+def reset_connection(connection):
+    """返却された接続のトランザクションを片付ける。再利用できなければ False"""
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status == TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return connection.info.transaction_status == TRANSACTION_STATUS_IDLE
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # プールに残ったテスト用DBへの接続があると DROP DATABASE できない
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+
+    @property
+    def pool_options(self):
+        """OPTIONS["pool"] を ConnectionPool の引数にしたもの（プールなしなら None）"""
+        options = self.settings_dict["OPTIONS"].get("pool")
+        if not options or self.alias == NO_DB_ALIAS:
+            return None
+        if self.settings_dict["CONN_MAX_AGE"] != 0:
+            raise ImproperlyConfigured(
+                "接続プールを使う場合は CONN_MAX_AGE を 0 にしてください（接続の保持はプールが行います）"
+            )
+        if options is True:
+            options = {}
+        unknown = set(options) - set(POOL_DEFAULTS)
+        if unknown:
+            raise ImproperlyConfigured(f"不明な接続プールの設定です: {', '.join(sorted(unknown))}")
+        return {**POOL_DEFAULTS, **options}
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    def get_pool(self, conn_params):
+        pool_options = self.pool_options
+        if pool_options is None:
+            return None
+        key = (self.alias, repr(sorted(conn_params.items())))
+
+        def create():
+            pool = ConnectionPool(
+                lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                check=check_connection,
+                reset=reset_connection,
+                name=self.alias,
+                **pool_options,
+            )
+            pool.fill()
+            return pool
+
+        return get_pool(key, create)
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.getconn()
+        # プールの接続を作ったのは別のラッパーかもしれないため、分離レベルはここで設定する
+        self.isolation_level = IsolationLevel(
+            self.settings_dict["OPTIONS"].get("isolation_level", IsolationLevel.READ_COMMITTED)
+        )
+        self._pool = pool
+        return connection
+
+    def _close(self):
+        pool, self._pool = self._pool, None
+        if pool is None or self.connection is None:
+            return super()._close()
+        # atomic ブロック内で閉じた場合、このラッパーは接続を参照し続けるので返却せずに捨てる
+        with self.wrap_database_errors:
+            pool.putconn(self.connection, discard=self.in_atomic_block)
@@ -0,0 +1,62 @@
+"""同時アクセス向けに設定した SQLite バックエンド
+
+ENGINE に `api.db.sqlite3` を指定すると、接続ごとに次の PRAGMA を設定する。
+
+- journal_mode=WAL: 書き込み中も読み込みをブロックしない
+- synchronous=NORMAL: WAL では NORMAL でもコミット済みのデータは壊れない
+- busy_timeout: ロック中の書き込みを即エラーにせず待つ
+- mmap_size / cache_size / temp_store: 読み込みをメモリ上で済ませる
+
+OPTIONS の "pragmas" で個別に上書きできる。"transaction_mode" に "IMMEDIATE" を指定すると
+atomic ブロックを BEGIN IMMEDIATE で始め、読み込みから書き込みへのロック昇格で
+busy_timeout を待たずに "database is locked" になるのを防ぐ（Django 5.1 の同名オプションと同じ）。
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+from django.utils.asyncio import async_unsafe
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 128 * 1024 * 1024,
+    "cache_size": -20000,
+    "temp_store": "MEMORY",
+}
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def pragmas(self):
+        return {**DEFAULT_PRAGMAS, **self.settings_dict["OPTIONS"].get("pragmas", {})}
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict["OPTIONS"].get("transaction_mode")
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode は {', '.join(TRANSACTION_MODES)} のいずれかにしてください"
+            )
+        return mode and mode.upper()
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pragmas", None)
+        params.pop("transaction_mode", None)
+        return params
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.transaction_mode
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {mode}")
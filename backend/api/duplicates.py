@@ -0,0 +1,150 @@
+"""重複経費の検出と登録ポリシー
+
+重複の判定は同じ組織の中で (organization, fingerprint) の索引探索だけで行い、
+既存行との総当たり比較はしない。
+
+- warn: 登録し、重複の疑いは `Expense.find_duplicates()` で確認できる
+- reject: 登録せずに DuplicateExpenseError を送出する
+- merge: 登録せずに既存の経費を返す
+
+reject / merge では、確認から登録までを同じフィンガープリントごとに直列化する
+（同時に送信された二重登録が、互いに相手を見ないまま両方登録されないようにする）。
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count
+
+from .models import Category, Expense, PaymentMethod
+from .tenancy import require_tenant
+
+WARN = "warn"
+REJECT = "reject"
+MERGE = "merge"
+POLICIES = (WARN, REJECT, MERGE)
+
+
+class DuplicateExpenseError(ValueError):
+    """reject ポリシーで重複の疑いがある経費を登録しようとした"""
+
+    def __init__(self, duplicates):
+        self.duplicates = list(duplicates)
+        super().__init__(f"重複の疑いがある経費が既に登録されています（{len(self.duplicates)}件）")
+
+
+@dataclass
+class ImportResult:
+    created: list = field(default_factory=list)
+    # (登録しなかった経費, 重複先の経費) の組
+    skipped: list = field(default_factory=list)
+
+
+def get_policy(policy=None):
+    policy = policy or settings.EXPENSE_DUPLICATE_POLICY
+    if policy not in POLICIES:
+        raise ValueError(f"不明な重複ポリシーです: {policy}")
+    return policy
+
+
+def lock_fingerprints(organization_id, fingerprints):
+    """同じ組織・フィンガープリントの経費の登録を、このトランザクションの終わりまで直列化する
+
+    PostgreSQL ではトランザクション単位のアドバイザリロックを、デッドロックしないよう
+    キーの順に取る。SQLite は atomic ブロックを BEGIN IMMEDIATE で始めるため
+    （api/db/sqlite3）書き込みがデータベース単位で直列化されており、何もしない。
+    """
+    connection = connections[router.db_for_write(Expense)]
+    if connection.vendor != "postgresql" or not fingerprints:
+        return
+    keys = sorted({f"{organization_id}:{fingerprint}" for fingerprint in fingerprints})
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(t.key)) "
+            "FROM unnest(%s::text[]) WITH ORDINALITY AS t(key, n) ORDER BY t.n",
+            [keys],
+        )
+
+
+def create_expense(policy=None, **fields):
+    """ポリシーに従って経費を1件登録する。merge で重複があれば既存の経費を返す"""
+    policy = get_policy(policy)
+    expense = Expense(**fields)
+    with transaction.atomic():
+        if policy != WARN:
+            lock_fingerprints(
+                expense.organization_id or require_tenant(), [expense.compute_fingerprint()]
+            )
+            duplicate = expense.find_duplicates().order_by("created_at").first()
+            if duplicate is not None and policy == REJECT:
+                raise DuplicateExpenseError([duplicate])
+            if duplicate is not None:
+                return duplicate
+        expense.save()
+    return expense
+
+
+def import_expenses(expenses, policy=None):
+    """経費をまとめて登録する。重複の確認は全件分を1回の IN 探索で行う
+
+    取り込み対象の中での重複（同じ明細の二重取り込み）も同じポリシーで扱う。
+    """
+    policy = get_policy(policy)
+    for expense in expenses:
+        expense.fingerprint = expense.compute_fingerprint()
+
+    result = ImportResult()
+    with transaction.atomic():
+        if policy != WARN:
+            lock_fingerprints(require_tenant(), [expense.fingerprint for expense in expenses])
+        seen = {}
+        existing = Expense.objects.filter(
+            fingerprint__in={expense.fingerprint for expense in expenses}
+        ).order_by("created_at")
+        for duplicate in existing:
+            seen.setdefault(duplicate.fingerprint, duplicate)
+
+        for expense in expenses:
+            duplicate = seen.get(expense.fingerprint)
+            if duplicate is not None and policy != WARN:
+                result.skipped.append((expense, duplicate))
+                continue
+            seen.setdefault(expense.fingerprint, expense)
+            result.created.append(expense)
+
+        if policy == REJECT and result.skipped:
+            raise DuplicateExpenseError(duplicate for _, duplicate in result.skipped)
+
+        # bulk_create は Expense.save() を通らないため、影響したカウンターは集計し直す
+        Expense.objects.bulk_create(result.created)
+        category_ids = {expense.category_id for expense in result.created}
+        payment_ids = {expense.payment_id for expense in result.created} - {None}
+        Category.recount_usage(Category.objects.filter(pk__in=category_ids))
+        PaymentMethod.recount_usage(PaymentMethod.objects.filter(pk__in=payment_ids))
+    return result
+
+
+def duplicate_groups(limit=100):
+    """同じフィンガープリントを持つ経費のグループを件数の多い順に返す
+
+    フィンガープリントの索引に対する GROUP BY で求めるため、自己結合は発生しない。
+    """
+    groups = list(
+        Expense.objects.exclude(fingerprint="")
+        .order_by()
+        .values("fingerprint")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by("-count", "fingerprint")[:limit]
+    )
+    members = defaultdict(list)
+    expenses = (
+        Expense.objects.filter(fingerprint__in=[group["fingerprint"] for group in groups])
+        .select_related("category", "payment")
+        .order_by("created_at")
+    )
+    for expense in expenses:
+        members[expense.fingerprint].append(expense)
+    return [(group["fingerprint"], group["count"], members[group["fingerprint"]]) for group in groups]
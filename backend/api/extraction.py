@@ -0,0 +1,248 @@
+"""領収書ファイルからのメタデータ抽出
+
+PDFの埋め込みテキスト、画像のEXIF撮影日時、ローカルにインストールされていれば
+tesseract によるOCRテキストを取り出し、テキストから日付と合計金額を推定する。
+api/receipts.py がワーカープロセスで実行するため、Django には依存しない。
+"""
+
+import datetime
+import functools
+import logging
+import re
+import shutil
+import subprocess
+import tempfile
+import unicodedata
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+import pypdf
+from PIL import Image, UnidentifiedImageError
+
+from .receipt_status import DONE, FAILED, UNSUPPORTED
+
+logger = logging.getLogger("api.receipts")
+
+# 抽出処理を変えたら上げる。古い版で抽出済みの領収書はバッチで再処理される
+EXTRACTOR_VERSION = 1
+
+DEFAULT_OPTIONS = {
+    "max_file_mb": 25,
+    "max_pdf_pages": 5,
+    "max_text_chars": 20000,
+    "ocr_languages": "jpn+eng",
+    "ocr_timeout": 60,
+    "tesseract_cmd": "tesseract",
+}
+
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+
+_TOTAL_LINE = re.compile(
+    r"合計|総計|お会計|お買上|ご請求|請求金額|領収金額|お支払金額|total|amount due", re.IGNORECASE
+)
+_NUMBER = r"(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d{1,2}))?"
+_CURRENCY_AMOUNT = re.compile(rf"[¥\\]\s*{_NUMBER}|{_NUMBER}\s*円")
+_BARE_AMOUNT = re.compile(rf"(?<![\d.,:]){_NUMBER}(?![\d,:]|\s*[点個品%])")
+_DATES = (
+    (re.compile(r"(20\d{2})\s*[年/.\-]\s*(\d{1,2})\s*[月/.\-]\s*(\d{1,2})"), 0),
+    (re.compile(r"令和\s*(元|\d{1,2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日"), 2018),
+    (re.compile(r"\bR\s*(\d{1,2})[./](\d{1,2})[./](\d{1,2})\b"), 2018),
+)
+
+
+@dataclass
+class ExtractionResult:
+    status: str
+    text: str = ""
+    captured_at: datetime.datetime | None = None
+    date: datetime.date | None = None
+    amount: Decimal | None = None
+    sources: list = field(default_factory=list)
+    error: str = ""
+
+    @classmethod
+    def failure(cls, error, status=FAILED):
+        return cls(status=status, error=error)
+
+
+def parse_date(text):
+    """テキスト中の最初の日付（西暦・令和）"""
+    text = unicodedata.normalize("NFKC", text)
+    candidates = []
+    for pattern, offset in _DATES:
+        for match in pattern.finditer(text):
+            year, month, day = match.groups()
+            year = 1 if year == "元" else int(year)
+            try:
+                candidates.append(
+                    (match.start(), datetime.date(year + offset, int(month), int(day)))
+                )
+            except ValueError:
+                continue
+    return min(candidates)[1] if candidates else None
+
+
+def _to_decimal(integer, fraction):
+    try:
+        return Decimal(f"{integer.replace(',', '')}.{fraction or '0'}").quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+
+def _amounts(pattern, line):
+    amounts = []
+    for match in pattern.finditer(line):
+        groups = match.groups()
+        # 通貨記号が前にある形と「円」が後ろにある形で、グループの位置が異なる
+        integer, fraction = (groups[0], groups[1]) if groups[0] else (groups[2], groups[3])
+        amount = _to_decimal(integer, fraction)
+        if amount is not None:
+            amounts.append(amount)
+    return amounts
+
+
+def parse_amount(text):
+    """合計金額を推定する
+
+    「合計」「お会計」などの行（金額が次の行にある場合も含む）の金額のうち最大のものを使い、
+    そうした行がなければ通貨記号か「円」の付いた金額のうち最大のものを使う。
+    """
+    lines = [line.strip() for line in unicodedata.normalize("NFKC", text).splitlines()]
+    totals = []
+    for i, line in enumerate(lines):
+        if not _TOTAL_LINE.search(line) or "小計" in line:
+            continue
+        rest = _TOTAL_LINE.split(line, maxsplit=1)[-1]
+        found = _amounts(_CURRENCY_AMOUNT, rest) or _amounts(_BARE_AMOUNT, rest)
+        if not found and i + 1 < len(lines):
+            found = _amounts(_CURRENCY_AMOUNT, lines[i + 1]) or _amounts(_BARE_AMOUNT, lines[i + 1])
+        totals.extend(found)
+    if totals:
+        return max(totals)
+    return max((a for line in lines for a in _amounts(_CURRENCY_AMOUNT, line)), default=None)
+
+
+@functools.cache
+def ocr_engine(command):
+    """tesseract の実行ファイルのパス（インストールされていなければ None）"""
+    return shutil.which(command)
+
+
+def ocr(path, options):
+    engine = ocr_engine(options["tesseract_cmd"])
+    if engine is None:
+        return ""
+    completed = subprocess.run(
+        [engine, str(path), "stdout", "-l", options["ocr_languages"]],
+        capture_output=True,
+        timeout=options["ocr_timeout"],
+        check=True,
+    )
+    return completed.stdout.decode("utf-8", errors="replace")
+
+
+def _exif_datetime(value):
+    try:
+        return datetime.datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _extract_pdf(path, options, result):
+    reader = pypdf.PdfReader(path)
+    pages = reader.pages[: options["max_pdf_pages"]]
+    text = "\n".join(page.extract_text() or "" for page in pages).strip()
+    if text:
+        result.sources.append("pdf_text")
+    elif ocr_engine(options["tesseract_cmd"]):
+        # スキャンしたPDFはページ画像をOCRにかける（各ページで一番大きな画像）
+        texts = []
+        for page in pages:
+            images = sorted(page.images, key=lambda image: len(image.data), reverse=True)
+            if not images:
+                continue
+            with tempfile.NamedTemporaryFile(suffix=Path(images[0].name).suffix) as image_file:
+                image_file.write(images[0].data)
+                image_file.flush()
+                texts.append(ocr(image_file.name, options))
+        text = "\n".join(texts).strip()
+        if text:
+            result.sources.append("ocr")
+    result.text = text
+    created = reader.metadata.creation_date if reader.metadata else None
+    if created is not None:
+        result.captured_at = created
+
+
+def _extract_image(path, options, result):
+    with Image.open(path) as image:
+        # EXIFはヘッダーだけ読めばよく、画素データは展開しない
+        exif = image.getexif()
+        captured_at = _exif_datetime(exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL, ""))
+        captured_at = captured_at or _exif_datetime(exif.get(EXIF_DATETIME, ""))
+    if captured_at is not None:
+        result.captured_at = captured_at
+        result.sources.append("exif")
+    text = ocr(path, options).strip()
+    if text:
+        result.text = text
+        result.sources.append("ocr")
+
+
+def extract(path, options=None):
+    """1ファイルからメタデータを抽出する"""
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    path = Path(path)
+    try:
+        size = path.stat().st_size
+        with path.open("rb") as file:
+            head = file.read(5)
+    except OSError as e:
+        return ExtractionResult.failure(f"ファイルを読めません: {e}")
+    if size > options["max_file_mb"] * 1024 * 1024:
+        return ExtractionResult.failure(
+            f"ファイルが大きすぎます（{size // (1024 * 1024)}MB）", UNSUPPORTED
+        )
+
+    result = ExtractionResult(status=DONE)
+    try:
+        if head == b"%PDF-":
+            _extract_pdf(path, options, result)
+        else:
+            _extract_image(path, options, result)
+    except UnidentifiedImageError:
+        return ExtractionResult.failure("PDFでも画像でもないファイルです", UNSUPPORTED)
+    except subprocess.SubprocessError as e:
+        return ExtractionResult.failure(f"OCRに失敗しました: {e}")
+    except MemoryError:
+        return ExtractionResult.failure("ワーカーのメモリ上限を超えました")
+    except Exception as e:
+        # 壊れたファイルでPDF・画像ライブラリが投げる例外は様々なので、1件の失敗として記録して続ける
+        logger.warning("failed to extract %s", path, exc_info=True)
+        return ExtractionResult.failure(f"{type(e).__name__}: {e}")
+
+    result.text = result.text[: options["max_text_chars"]]
+    result.date = parse_date(result.text)
+    result.amount = parse_amount(result.text)
+    return result
+
+
+def run_task(receipt_id, path, options):
+    """ワーカープロセスで実行するタスク（結果は pickle して親プロセスへ返る）"""
+    return receipt_id, extract(path, options)
+
+
+def limit_memory(megabytes):
+    """ワーカープロセスのアドレス空間を制限する（resource がないOSでは何もしない）"""
+    try:
+        import resource
+    except ImportError:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = megabytes * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
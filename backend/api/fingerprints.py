@@ -0,0 +1,28 @@
+"""経費の重複検出用フィンガープリント
+
+日付・金額・支払い方法・正規化した説明からハッシュを作り、Expenseに保存して索引を張る。
+マイグレーションからも使うため、モデルには依存しない。
+"""
+
+import hashlib
+import re
+import unicodedata
+from decimal import Decimal
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_description(description: str) -> str:
+    """全角・半角、大文字・小文字、空白の違いを吸収する"""
+    text = unicodedata.normalize("NFKC", description or "").casefold()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def expense_fingerprint(date, amount, payment_id, description) -> str:
+    parts = [
+        date.isoformat(),
+        str(Decimal(str(amount)).quantize(Decimal("0.01"))),
+        str(payment_id or ""),
+        normalize_description(description),
+    ]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
@@ -0,0 +1,276 @@
+"""GraphQL APIの負荷試験
+
+api/schema.py の実際のオペレーションを現実的な比率で混ぜて送り、同時実行数を段階的に上げながら
+オペレーションごとのスループット・レイテンシ（p50/p95/p99）・エラー率を計測する。
+スループットが伸びなくなった段階、またはエラー率が上限を超えた段階を飽和点とする。
+"""
+
+import http.client
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+EXPENSE_FIELDS = "id date amount description category { id name } payment { id code }"
+
+OPERATIONS = {
+    "expenses": f"query Expenses {{ expenses {{ {EXPENSE_FIELDS} }} }}",
+    "categories": "query Categories { categories { id name color expenseCount totalAmount } }",
+    "expense": f"query Expense($id: ID!) {{ expense(id: $id) {{ {EXPENSE_FIELDS} }} }}",
+    "createExpense": "mutation CreateExpense($input: ExpenseInput!) "
+    "{ createExpense(input: $input) { id } }",
+    "updateExpense": "mutation UpdateExpense($id: ID!, $input: ExpenseInput!) "
+    "{ updateExpense(id: $id, input: $input) { id } }",
+    "deleteExpense": "mutation DeleteExpense($id: ID!) { deleteExpense(id: $id) }",
+    "createCategory": "mutation CreateCategory($input: CategoryInput!) "
+    "{ createCategory(input: $input) { id } }",
+}
+
+# 画面の読み込みが大半で、登録・編集・削除がそれに続く比率
+DEFAULT_MIX = {
+    "expenses": 30,
+    "categories": 25,
+    "expense": 25,
+    "createExpense": 10,
+    "updateExpense": 7,
+    "deleteExpense": 3,
+}
+
+
+class HttpTransport:
+    """キープアライブの接続を1本だけ持つHTTPクライアント（ワーカーごとに1つ）"""
+
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        connection_class = (
+            http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        )
+        self.path = parts.path or "/"
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+
+    def __call__(self, query, variables=None):
+        body = json.dumps({"query": query, "variables": variables or {}})
+        try:
+            self.connection.request(
+                "POST", self.path, body=body, headers={"Content-Type": "application/json"}
+            )
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            return None
+        if response.status != 200:
+            return None
+        return json.loads(payload)
+
+    def close(self):
+        self.connection.close()
+
+
+class LoadState:
+    """ワーカー間で共有するテストデータ（カテゴリーと既存の経費ID）"""
+
+    def __init__(self, category_ids, expense_ids=()):
+        self.category_ids = list(category_ids)
+        self.expense_ids = list(expense_ids)
+        self._lock = threading.Lock()
+
+    def add(self, expense_id):
+        with self._lock:
+            self.expense_ids.append(expense_id)
+
+    def pick(self, rng):
+        with self._lock:
+            return rng.choice(self.expense_ids) if self.expense_ids else None
+
+    def take(self, rng):
+        with self._lock:
+            if not self.expense_ids:
+                return None
+            index = rng.randrange(len(self.expense_ids))
+            self.expense_ids[index], self.expense_ids[-1] = (
+                self.expense_ids[-1],
+                self.expense_ids[index],
+            )
+            return self.expense_ids.pop()
+
+    def expense_input(self, rng):
+        return {
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "amount": f"{rng.randint(100, 50000)}.00",
+            "categoryId": rng.choice(self.category_ids),
+            "description": f"負荷試験 {uuid.uuid4().hex[:12]}",
+        }
+
+
+def execute(name, send, state, rng):
+    """オペレーションを1回実行し、(実際に実行した名前, 成否) を返す"""
+    variables = {}
+    if name in ("expense", "updateExpense", "deleteExpense"):
+        expense_id = state.take(rng) if name == "deleteExpense" else state.pick(rng)
+        if expense_id is None:
+            name = "createExpense"
+        else:
+            variables["id"] = expense_id
+    if name in ("createExpense", "updateExpense"):
+        variables["input"] = state.expense_input(rng)
+
+    result = send(OPERATIONS[name], variables)
+    ok = result is not None and not result.get("errors")
+    if ok and name == "createExpense":
+        state.add(result["data"]["createExpense"]["id"])
+    return name, ok
+
+
+def seed(send, categories=5, expenses=200):
+    """負荷試験用のカテゴリーと経費を登録する"""
+    run = uuid.uuid4().hex[:8]
+    category_ids = []
+    for i in range(categories):
+        result = send(OPERATIONS["createCategory"], {"input": {"name": f"負荷試験 {run}-{i}"}})
+        if result is None or result.get("errors"):
+            raise RuntimeError(f"カテゴリーの登録に失敗しました: {result}")
+        category_ids.append(result["data"]["createCategory"]["id"])
+
+    state = LoadState(category_ids)
+    rng = random.Random(run)
+    for _ in range(expenses):
+        execute("createExpense", send, state, rng)
+    return state
+
+
+def percentile(sorted_values, q):
+    """最近傍順位法によるパーセンタイル（q は 0〜100）"""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class OperationStats:
+    count: int = 0
+    errors: int = 0
+    latencies: list = field(default_factory=list)
+
+    @property
+    def error_rate(self):
+        return self.errors / self.count if self.count else 0.0
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        return {
+            "count": self.count,
+            "throughput": self.count / duration if duration else 0.0,
+            "error_rate": self.error_rate,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        }
+
+
+@dataclass
+class StepResult:
+    concurrency: int
+    duration: float
+    operations: dict
+
+    @property
+    def total(self):
+        stats = OperationStats()
+        for op in self.operations.values():
+            stats.count += op.count
+            stats.errors += op.errors
+            stats.latencies += op.latencies
+        return stats
+
+    @property
+    def throughput(self):
+        return self.total.count / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self):
+        return self.total.error_rate
+
+
+def run_step(transport_factory, state, concurrency, duration, mix=None, seed=None):
+    """同時実行数 concurrency のワーカーで duration 秒間オペレーションを送り続ける"""
+    mix = mix or DEFAULT_MIX
+    names, weights = zip(*mix.items())
+    operations = defaultdict(OperationStats)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(None if seed is None else f"{seed}-{index}")
+        send = transport_factory()
+        try:
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                name, ok = execute(name, send, state, rng)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    stats = operations[name]
+                    stats.count += 1
+                    stats.errors += 0 if ok else 1
+                    stats.latencies.append(elapsed)
+        finally:
+            close = getattr(send, "close", None)
+            if close:
+                close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return StepResult(concurrency, time.perf_counter() - started, dict(operations))
+
+
+def is_saturated(steps, min_gain=0.1, max_error_rate=0.01):
+    """直前までの最大スループットからの伸びが min_gain 未満、またはエラー率超過なら飽和"""
+    latest = steps[-1]
+    if latest.error_rate > max_error_rate:
+        return True
+    if len(steps) < 2:
+        return False
+    best = max(step.throughput for step in steps[:-1])
+    return latest.throughput < best * (1 + min_gain)
+
+
+def saturation_point(steps, min_gain=0.1, max_error_rate=0.01):
+    """飽和するまでの段階のうち、エラー率が上限内でスループットが最大の段階を返す"""
+    end = next(
+        (i for i in range(1, len(steps) + 1) if is_saturated(steps[:i], min_gain, max_error_rate)),
+        len(steps),
+    )
+    healthy = [step for step in steps[:end] if step.error_rate <= max_error_rate]
+    return max(healthy, key=lambda step: step.throughput, default=None)
+
+
+def ramp(
+    transport_factory,
+    state,
+    levels,
+    duration,
+    mix=None,
+    min_gain=0.1,
+    max_error_rate=0.01,
+    on_step=None,
+):
+    """同時実行数を levels の順に上げ、飽和した段階で打ち切る"""
+    steps = []
+    for concurrency in levels:
+        steps.append(run_step(transport_factory, state, concurrency, duration, mix))
+        if on_step:
+            on_step(steps[-1])
+        if is_saturated(steps, min_gain, max_error_rate):
+            break
+    return steps, saturation_point(steps, min_gain, max_error_rate)
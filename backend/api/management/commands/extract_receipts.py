@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.extraction import ocr_engine
+from api.receipts import process_receipts, receipts_to_process, recheck_mismatches
+
+
+class Command(BaseCommand):
+    help = "領収書ファイルからテキスト・日付・金額を抽出し、経費との不一致を記録する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="その年の経費の領収書だけを処理する")
+        parser.add_argument(
+            "--force", action="store_true", help="現在の版で抽出済みの領収書も処理し直す"
+        )
+        parser.add_argument(
+            "--workers", type=int, help="ワーカープロセス数（0でこのプロセス内で実行）"
+        )
+        parser.add_argument("--batch-size", type=int, help="まとめて保存する件数")
+        parser.add_argument(
+            "--recheck",
+            action="store_true",
+            help="抽出し直さずに、抽出済みの結果と現在の経費を突き合わせ直す",
+        )
+
+    def handle(self, *args, **options):
+        if options["recheck"]:
+            receipts = receipts_to_process(year=options["year"], force=True)
+            flagged = recheck_mismatches(receipts)
+            self.stdout.write(self.style.SUCCESS(f"突き合わせ直しました（不一致 {flagged}件）"))
+            return
+
+        if ocr_engine(settings.RECEIPT_EXTRACTION["TESSERACT_CMD"]) is None:
+            self.stdout.write(
+                self.style.WARNING("OCRエンジン（tesseract）がないため、画像のOCRは行いません")
+            )
+        summary = process_receipts(
+            receipts_to_process(year=options["year"], force=options["force"]),
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            on_batch=self._write_progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{summary.processed}件を{summary.elapsed:.1f}秒で処理しました"
+                f"（{summary.rate:.1f}件/秒）: 抽出 {summary.done}件, 失敗 {summary.failed}件, "
+                f"対象外 {summary.unsupported}件, 不一致 {summary.mismatched}件"
+            )
+        )
+
+    def _write_progress(self, summary, total):
+        self.stdout.write(f"  {summary.processed}/{total}件（{summary.rate:.1f}件/秒）")
@@ -0,0 +1,91 @@
+import csv
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.duplicates import POLICIES, DuplicateExpenseError, import_expenses
+from api.models import Category, Expense, Organization, PaymentMethod
+from api.tenancy import DEFAULT_ORGANIZATION_ID, tenant_context
+
+COLUMNS = ("date", "amount", "category", "payment", "description")
+
+
+class Command(BaseCommand):
+    help = "CSVの経費を重複ポリシーに従ってまとめて登録する（列: date,amount,category,payment,description）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="取り込むCSVファイル（1行目は列名、UTF-8）")
+        parser.add_argument(
+            "--organization",
+            default=str(DEFAULT_ORGANIZATION_ID),
+            help="登録先の組織ID（省略時は既定の組織）",
+        )
+        parser.add_argument(
+            "--policy",
+            choices=POLICIES,
+            help="重複の扱い（省略時は EXPENSE_DUPLICATE_POLICY）",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="まとめて登録する件数")
+
+    def handle(self, *args, **options):
+        organization = Organization.objects.filter(pk=options["organization"]).first()
+        if organization is None:
+            raise CommandError(f"組織 {options['organization']} が見つかりません")
+
+        created = skipped = 0
+        with (
+            tenant_context(organization),
+            open(options["path"], newline="", encoding="utf-8-sig") as file,
+        ):
+            reader = csv.DictReader(file)
+            missing = set(COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"CSVに列がありません: {', '.join(sorted(missing))}")
+            categories = {category.name: category for category in Category.objects.all()}
+            payments = {payment.code: payment for payment in PaymentMethod.objects.all()}
+
+            batch = []
+            for line, row in enumerate(reader, start=2):
+                batch.append(self._expense(line, row, categories, payments))
+                if len(batch) >= options["batch_size"]:
+                    created, skipped = self._import(batch, options["policy"], created, skipped)
+                    batch = []
+            if batch:
+                created, skipped = self._import(batch, options["policy"], created, skipped)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{organization.name}: {created}件を登録しました（重複のため登録しなかった経費 {skipped}件）"
+            )
+        )
+
+    def _expense(self, line, row, categories, payments):
+        category = categories.get(row["category"])
+        if category is None:
+            raise CommandError(f"{line}行目: カテゴリー {row['category']} がありません")
+        payment = None
+        if row["payment"]:
+            payment = payments.get(row["payment"])
+            if payment is None:
+                raise CommandError(f"{line}行目: 支払い方法 {row['payment']} がありません")
+        try:
+            date = datetime.date.fromisoformat(row["date"])
+            amount = Decimal(row["amount"])
+        except (ValueError, InvalidOperation) as error:
+            raise CommandError(f"{line}行目: 日付・金額を読み取れません（{error}）") from error
+        return Expense(
+            date=date,
+            amount=amount,
+            category=category,
+            payment=payment,
+            description=row["description"],
+        )
+
+    def _import(self, batch, policy, created, skipped):
+        # バッチごとにコミットするため、前のバッチで登録した経費も次のバッチの重複確認に含まれる
+        try:
+            result = import_expenses(batch, policy)
+        except DuplicateExpenseError as error:
+            raise CommandError(f"{error}（{created}件は登録済みです）") from error
+        return created + len(result.created), skipped + len(result.skipped)
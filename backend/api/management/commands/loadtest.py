@@ -0,0 +1,217 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import DEFAULT_MIX, OPERATIONS, HttpTransport, ramp, seed
+
+SERVERS = {
+    "wsgi": (
+        "gunicorn",
+        [
+            "config.wsgi:application",
+            "--bind",
+            "{host}:{port}",
+            "--workers",
+            "{workers}",
+            "--threads",
+            "{threads}",
+        ],
+    ),
+    "asgi": (
+        "uvicorn",
+        [
+            "config.asgi:application",
+            "--host",
+            "{host}",
+            "--port",
+            "{port}",
+            "--workers",
+            "{workers}",
+        ],
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = "GraphQL APIに実際のオペレーションを混ぜて送り、同時実行数を上げながら飽和点を探す"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--server",
+            choices=["wsgi", "asgi"],
+            default="wsgi",
+            help="起動するサーバー（wsgi: gunicorn / asgi: uvicorn）",
+        )
+        parser.add_argument(
+            "--url", help="起動済みのサーバーのGraphQLエンドポイント（指定時は起動しない）"
+        )
+        parser.add_argument(
+            "--allow-writes",
+            action="store_true",
+            help="--url のサーバーのデータベースに負荷試験用の経費・カテゴリーを登録することを許可する",
+        )
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--workers", type=int, default=2, help="サーバーのワーカープロセス数")
+        parser.add_argument("--threads", type=int, default=4, help="WSGIワーカーあたりのスレッド数")
+        parser.add_argument(
+            "--levels", default="1,2,4,8,16,32,64", help="同時実行数の段階（カンマ区切り）"
+        )
+        parser.add_argument("--duration", type=float, default=10.0, help="段階ごとの計測秒数")
+        parser.add_argument(
+            "--mix",
+            default=",".join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()),
+            help="オペレーションの比率（例: expenses=30,createExpense=10）",
+        )
+        parser.add_argument(
+            "--seed-expenses", type=int, default=200, help="事前に登録する経費の件数"
+        )
+        parser.add_argument(
+            "--min-gain", type=float, default=0.1, help="飽和とみなすスループットの伸び率"
+        )
+        parser.add_argument("--max-error-rate", type=float, default=0.01, help="許容するエラー率")
+        parser.add_argument("--report", help="結果をJSONで書き出すファイル")
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options["levels"].split(",")]
+        mix = self._parse_mix(options["mix"])
+
+        url = options["url"]
+        if url is not None and not options["allow_writes"]:
+            raise CommandError(
+                "負荷試験は対象のデータベースに経費・カテゴリーを登録・削除します。"
+                "起動済みのサーバーに対して実行するには --allow-writes を指定してください"
+            )
+
+        server = None
+        database = None
+        try:
+            if url is None:
+                # 起動するサーバーは使い捨てのSQLiteデータベースに向け、プロジェクトのデータを汚さない
+                url = f"http://{options['host']}:{options['port']}/graphql/"
+                database = tempfile.TemporaryDirectory(prefix="keihi-loadtest-")
+                env = self._database_env(Path(database.name) / "db.sqlite3")
+                self._migrate(env)
+                server = self._start_server(options, env)
+            self._wait_until_ready(url, server)
+            state = seed(HttpTransport(url), expenses=options["seed_expenses"])
+            self.stdout.write(
+                f"{url} に対して計測します（{options['duration']}秒 × 最大{len(levels)}段階）"
+            )
+            steps, saturation = ramp(
+                lambda: HttpTransport(url),
+                state,
+                levels,
+                options["duration"],
+                mix=mix,
+                min_gain=options["min_gain"],
+                max_error_rate=options["max_error_rate"],
+                on_step=self._write_step,
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            if database is not None:
+                database.cleanup()
+
+        if saturation is None:
+            self.stdout.write(self.style.ERROR("全ての段階でエラー率が上限を超えました"))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"飽和点: 同時実行数 {saturation.concurrency} で "
+                    f"{saturation.throughput:.1f} req/s（エラー率 {saturation.error_rate:.2%}）"
+                )
+            )
+        if options["report"]:
+            self._write_report(Path(options["report"]), options, steps, saturation)
+
+    def _parse_mix(self, value):
+        mix = {}
+        for item in value.split(","):
+            name, _, weight = item.partition("=")
+            if name not in DEFAULT_MIX:
+                raise CommandError(f"不明なオペレーションです: {name}（{', '.join(DEFAULT_MIX)}）")
+            mix[name] = float(weight)
+        return mix
+
+    def _database_env(self, path):
+        return {**os.environ, "DB_ENGINE": "api.db.sqlite3", "DB_NAME": str(path)}
+
+    def _migrate(self, env):
+        result = subprocess.run(
+            [sys.executable, "manage.py", "migrate", "--verbosity", "0"],
+            cwd=settings.BASE_DIR,
+            env=env,
+            check=False,
+        )
+        if result.returncode != 0:
+            raise CommandError("負荷試験用のデータベースを作成できませんでした")
+
+    def _start_server(self, options, env):
+        module, arguments = SERVERS[options["server"]]
+        if importlib.util.find_spec(module) is None:
+            raise CommandError(f"{module} がインストールされていません（pip install {module}）")
+        command = [sys.executable, "-m", module] + [arg.format(**options) for arg in arguments]
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def _wait_until_ready(self, url, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise CommandError("サーバーが起動に失敗しました")
+            transport = HttpTransport(url, timeout=2)
+            result = transport("{ hello }")
+            transport.close()
+            if result is not None:
+                return
+            time.sleep(0.2)
+        raise CommandError(f"{timeout}秒以内に {url} が応答しませんでした")
+
+    def _write_step(self, step):
+        self.stdout.write(
+            f"\n同時実行数 {step.concurrency}: {step.throughput:.1f} req/s, "
+            f"エラー率 {step.error_rate:.2%}"
+        )
+        self.stdout.write(
+            f"  {'operation':<15}{'count':>8}{'req/s':>9}{'err':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+        )
+        for name in OPERATIONS:
+            if name not in step.operations:
+                continue
+            summary = step.operations[name].summary(step.duration)
+            self.stdout.write(
+                f"  {name:<15}{summary['count']:>8}{summary['throughput']:>9.1f}"
+                f"{summary['error_rate']:>8.1%}"
+                f"{summary['p50'] * 1000:>7.1f}ms{summary['p95'] * 1000:>7.1f}ms"
+                f"{summary['p99'] * 1000:>7.1f}ms"
+            )
+
+    def _write_report(self, path, options, steps, saturation):
+        report = {
+            "server": options["url"] or options["server"],
+            "steps": [
+                {
+                    "concurrency": step.concurrency,
+                    "throughput": step.throughput,
+                    "error_rate": step.error_rate,
+                    "operations": {
+                        name: stats.summary(step.duration)
+                        for name, stats in step.operations.items()
+                    },
+                }
+                for step in steps
+            ],
+            "saturation": saturation.concurrency if saturation else None,
+        }
+        path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        self.stdout.write(f"結果を {path} に書き出しました")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Category, PaymentMethod
+
+
+class Command(BaseCommand):
+    help = "カテゴリー・支払い方法の利用状況カウンターとExpenseの集計のずれを全組織について検出・修復する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="ずれているカウンターを修復する")
+
+    def handle(self, *args, **options):
+        total = 0
+        for model in (Category, PaymentMethod):
+            drifted = list(model.drifted())
+            total += len(drifted)
+            for row in drifted:
+                self.stdout.write(
+                    f"{model._meta.verbose_name} {row}: "
+                    f"件数 {row.expense_count} -> {row.actual_count}, "
+                    f"合計 {row.total_amount} -> {row.actual_total}, "
+                    f"最終利用日 {row.last_used_on} -> {row.actual_last_used_on}"
+                )
+            if drifted and options["fix"]:
+                with transaction.atomic():
+                    model.recount_usage(model.unscoped.filter(pk__in=[row.pk for row in drifted]))
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS("ずれはありません"))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"{total}件のカウンターを修復しました"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{total}件のずれがあります（--fix で修復）"))
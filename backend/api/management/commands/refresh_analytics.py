@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.analytics import (
+    ExpenseSnapshot,
+    deletion_retention,
+    get_snapshot,
+    reset_snapshot,
+    snapshot_path,
+    verify_against_orm,
+)
+from api.models import ExpenseDeletion, Organization
+
+
+class Command(BaseCommand):
+    help = "経費分析用の列指向スナップショットを組織ごとに差分更新して保存する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true", help="既存のスナップショットを破棄して作り直す"
+        )
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            help="全IDで突き合わせ、さかのぼる幅より遅れてコミットされた行も取り込む",
+        )
+        parser.add_argument(
+            "--verify", action="store_true", help="更新後の集計をORMの集計と突き合わせる"
+        )
+        parser.add_argument(
+            "--organization", help="この組織IDのスナップショットだけを更新する（省略時は全組織）"
+        )
+
+    def handle(self, *args, **options):
+        organizations = Organization.objects.order_by("pk")
+        if options["organization"]:
+            organizations = organizations.filter(pk=options["organization"])
+            if not organizations.exists():
+                raise CommandError(f"組織 {options['organization']} が見つかりません")
+
+        mismatched = 0
+        for organization in organizations:
+            tenant = organization.pk
+            if options["rebuild"]:
+                ExpenseSnapshot(tenant).save(snapshot_path(tenant))
+                reset_snapshot(tenant)
+
+            snapshot = get_snapshot(tenant, refresh=False)
+            snapshot.refresh()
+            if options["reconcile"]:
+                snapshot.reconcile()
+            snapshot.save(snapshot_path(tenant))
+            self.stdout.write(
+                f"{organization.name}: スナップショット {len(snapshot)}件 ({snapshot_path(tenant)})"
+            )
+
+            if options["verify"]:
+                mismatches = verify_against_orm(snapshot)
+                for mismatch in mismatches:
+                    self.stderr.write(f"{organization.name}: {mismatch}")
+                mismatched += len(mismatches)
+
+        # 保持期間を過ぎた削除記録を消す（それより古いスナップショットは次の更新で全件を突き合わせる）
+        expired = ExpenseDeletion.unscoped.filter(
+            deleted_at__lt=timezone.now() - deletion_retention()
+        )
+        deleted, _ = expired.delete()
+        if deleted:
+            self.stdout.write(f"保持期間を過ぎた削除記録 {deleted}件を削除しました")
+
+        if options["verify"]:
+            if mismatched:
+                raise CommandError(f"ORMとの不一致が{mismatched}件あります")
+            self.stdout.write(self.style.SUCCESS("ORMの集計と一致しました"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from api.models import SlowQuery
+
+ORDERINGS = {
+    "total": F("total_time_ms").desc(),
+    "max": F("max_time_ms").desc(),
+    "mean": (F("total_time_ms") / F("calls")).desc(),
+    "calls": F("calls").desc(),
+}
+
+
+class Command(BaseCommand):
+    help = "記録されたスロークエリを合計時間などの順に表示する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20, help="表示する件数")
+        parser.add_argument(
+            "--order-by",
+            choices=list(ORDERINGS),
+            default="total",
+            help="並び順（デフォルト: 合計時間）",
+        )
+        parser.add_argument("--explain", action="store_true", help="取得済みの実行計画も表示する")
+        parser.add_argument("--reset", action="store_true", help="記録を全て削除する")
+
+    def handle(self, *args, **options):
+        if options["reset"]:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"{deleted}件の記録を削除しました"))
+            return
+
+        queries = SlowQuery.objects.order_by(ORDERINGS[options["order_by"]])[: options["limit"]]
+        if not queries:
+            self.stdout.write("スロークエリは記録されていません")
+            return
+
+        for rank, query in enumerate(queries, start=1):
+            self.stdout.write(
+                self.style.WARNING(
+                    f"#{rank} 合計 {query.total_time_ms:.1f}ms / {query.calls}回 "
+                    f"(平均 {query.mean_time_ms:.1f}ms, 最大 {query.max_time_ms:.1f}ms)"
+                )
+            )
+            if query.operation or query.resolver:
+                self.stdout.write(f"  発行元: {query.operation or '-'} / {query.resolver or '-'}")
+            self.stdout.write(f"  {query.statement}")
+            if options["explain"] and query.explain:
+                for line in query.explain.splitlines():
+                    self.stdout.write(f"    {line}")
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_remove_expense_payment_method_paymentmethod_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['updated_at'], name='api_expense_updated_f8a632_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:50
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_usage_counters(apps, schema_editor):
+    Expense = apps.get_model('api', 'Expense')
+    for model_name, field in (('Category', 'category'), ('PaymentMethod', 'payment')):
+        model = apps.get_model('api', model_name)
+        grouped = Expense.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        model.objects.update(
+            expense_count=Coalesce(Subquery(grouped.annotate(value=Count('pk')).values('value')), 0),
+            total_amount=Coalesce(
+                Subquery(grouped.annotate(value=Sum('amount')).values('value')),
+                Decimal('0'),
+                output_field=models.DecimalField(max_digits=14, decimal_places=2),
+            ),
+            last_used_on=Subquery(grouped.annotate(value=Max('date')).values('value')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_expense_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='expense_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='経費件数'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='last_used_on',
+            field=models.DateField(
+                blank=True, editable=False, null=True, verbose_name='最終利用日'
+            ),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='total_amount',
+            field=models.DecimalField(
+                decimal_places=2,
+                default=Decimal('0'),
+                editable=False,
+                max_digits=14,
+                verbose_name='合計金額',
+            ),
+        ),
+        migrations.AddField(
+            model_name='paymentmethod',
+            name='expense_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='経費件数'),
+        ),
+        migrations.AddField(
+            model_name='paymentmethod',
+            name='last_used_on',
+            field=models.DateField(
+                blank=True, editable=False, null=True, verbose_name='最終利用日'
+            ),
+        ),
+        migrations.AddField(
+            model_name='paymentmethod',
+            name='total_amount',
+            field=models.DecimalField(
+                decimal_places=2,
+                default=Decimal('0'),
+                editable=False,
+                max_digits=14,
+                verbose_name='合計金額',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['category', '-date'], name='api_expense_categor_8733dc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['payment', '-date'], name='api_expense_payment_2f2dd5_idx'),
+        ),
+        migrations.RunPython(backfill_usage_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:52
+
+from django.db import migrations, models
+
+from api.fingerprints import expense_fingerprint
+
+
+def backfill_fingerprints(apps, schema_editor):
+    Expense = apps.get_model('api', 'Expense')
+    batch = []
+    for expense in Expense.objects.only('date', 'amount', 'payment_id', 'description').iterator():
+        expense.fingerprint = expense_fingerprint(
+            expense.date, expense.amount, expense.payment_id, expense.description
+        )
+        batch.append(expense)
+        if len(batch) >= 1000:
+            Expense.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    Expense.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_usage_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='fingerprint',
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=64,
+                verbose_name='重複検出用フィンガープリント',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['fingerprint'], name='api_expense_fingerp_ac3870_idx'),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:57
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_expense_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                (
+                    'id',
+                    models.UUIDField(
+                        default=uuid.uuid4, editable=False, primary_key=True, serialize=False
+                    ),
+                ),
+                (
+                    'fingerprint',
+                    models.CharField(max_length=40, unique=True, verbose_name='フィンガープリント'),
+                ),
+                ('statement', models.TextField(verbose_name='正規化したSQL')),
+                ('sample_sql', models.TextField(verbose_name='直近のSQL')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='回数')),
+                ('total_time_ms', models.FloatField(default=0, verbose_name='合計時間(ms)')),
+                ('max_time_ms', models.FloatField(default=0, verbose_name='最大時間(ms)')),
+                (
+                    'operation',
+                    models.CharField(
+                        blank=True, max_length=200, verbose_name='GraphQLオペレーション'
+                    ),
+                ),
+                (
+                    'resolver',
+                    models.CharField(blank=True, max_length=200, verbose_name='リゾルバー'),
+                ),
+                ('explain', models.TextField(blank=True, verbose_name='実行計画')),
+                (
+                    'first_seen',
+                    models.DateTimeField(auto_now_add=True, verbose_name='初回検出日時'),
+                ),
+                ('last_seen', models.DateTimeField(verbose_name='最終検出日時')),
+            ],
+            options={
+                'verbose_name': 'スロークエリ',
+                'verbose_name_plural': 'スロークエリ',
+                'ordering': ['-total_time_ms'],
+                'indexes': [
+                    models.Index(fields=['-total_time_ms'], name='api_slowque_total_t_d702cf_idx')
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_slow_query"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="receipt",
+            name="amount_mismatch",
+            field=models.BooleanField(default=False, editable=False, verbose_name="金額の不一致"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="captured_at",
+            field=models.DateTimeField(editable=False, null=True, verbose_name="撮影・作成日時"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="date_mismatch",
+            field=models.BooleanField(default=False, editable=False, verbose_name="日付の不一致"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extracted_amount",
+            field=models.DecimalField(
+                decimal_places=2,
+                editable=False,
+                max_digits=10,
+                null=True,
+                verbose_name="読み取った金額",
+            ),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extracted_at",
+            field=models.DateTimeField(editable=False, null=True, verbose_name="抽出日時"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extracted_date",
+            field=models.DateField(editable=False, null=True, verbose_name="読み取った日付"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extracted_sources",
+            field=models.CharField(
+                blank=True, editable=False, max_length=100, verbose_name="抽出元"
+            ),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extracted_text",
+            field=models.TextField(blank=True, editable=False, verbose_name="抽出テキスト"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extraction_error",
+            field=models.TextField(blank=True, editable=False, verbose_name="抽出エラー"),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extraction_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "未処理"),
+                    ("done", "抽出済み"),
+                    ("failed", "失敗"),
+                    ("unsupported", "対象外"),
+                ],
+                default="pending",
+                editable=False,
+                max_length=20,
+                verbose_name="抽出状態",
+            ),
+        ),
+        migrations.AddField(
+            model_name="receipt",
+            name="extractor_version",
+            field=models.PositiveSmallIntegerField(
+                default=0, editable=False, verbose_name="抽出処理の版"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="receipt",
+            index=models.Index(
+                fields=["extraction_status", "extractor_version"],
+                name="api_receipt_extract_48bde1_idx",
+            ),
+        ),
+    ]
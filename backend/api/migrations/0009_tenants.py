@@ -0,0 +1,228 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+import uuid
+
+# 組織の導入前のデータを移す既定の組織（api.tenancy.DEFAULT_ORGANIZATION_ID）
+DEFAULT_ORGANIZATION_ID = uuid.UUID("00000000-0000-0000-0000-000000000001")
+
+
+def create_default_organization(apps, schema_editor):
+    Organization = apps.get_model("api", "Organization")
+    Organization.objects.get_or_create(pk=DEFAULT_ORGANIZATION_ID, defaults={"name": "既定の組織"})
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_receipt_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Organization",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4, editable=False, primary_key=True, serialize=False
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, verbose_name="組織名")),
+                ("description", models.TextField(blank=True, verbose_name="説明")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="作成日時")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="更新日時")),
+            ],
+            options={
+                "verbose_name": "組織",
+                "verbose_name_plural": "組織",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.RunPython(create_default_organization, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name="Team",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4, editable=False, primary_key=True, serialize=False
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, verbose_name="チーム名")),
+                ("description", models.TextField(blank=True, verbose_name="説明")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="作成日時")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="更新日時")),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        db_index=False,
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="api.organization",
+                        verbose_name="組織",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "チーム",
+                "verbose_name_plural": "チーム",
+                "ordering": ["name"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("organization", "name"), name="uniq_team_name_per_org"
+                    ),
+                ],
+            },
+            managers=[
+                ("unscoped", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="organization",
+            field=models.ForeignKey(
+                default=DEFAULT_ORGANIZATION_ID,
+                db_index=False,
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="api.organization",
+                verbose_name="組織",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="paymentmethod",
+            name="organization",
+            field=models.ForeignKey(
+                default=DEFAULT_ORGANIZATION_ID,
+                db_index=False,
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="api.organization",
+                verbose_name="組織",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="organization",
+            field=models.ForeignKey(
+                default=DEFAULT_ORGANIZATION_ID,
+                db_index=False,
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="api.organization",
+                verbose_name="組織",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="team",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="expenses",
+                to="api.team",
+                verbose_name="チーム",
+            ),
+        ),
+        migrations.AlterModelManagers(
+            name="category",
+            managers=[
+                ("unscoped", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name="expense",
+            managers=[
+                ("unscoped", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name="paymentmethod",
+            managers=[
+                ("unscoped", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="category",
+            name="name",
+            field=models.CharField(max_length=100, verbose_name="カテゴリー名"),
+        ),
+        migrations.AlterField(
+            model_name="paymentmethod",
+            name="code",
+            field=models.CharField(max_length=20, verbose_name="コード"),
+        ),
+        migrations.AddConstraint(
+            model_name="category",
+            constraint=models.UniqueConstraint(
+                fields=("organization", "name"), name="uniq_category_name_per_org"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="paymentmethod",
+            constraint=models.UniqueConstraint(
+                fields=("organization", "code"), name="uniq_payment_code_per_org"
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="expense",
+            name="api_expense_updated_f8a632_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="expense",
+            name="api_expense_fingerp_ac3870_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="paymentmethod",
+            name="api_payment_name_729235_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="paymentmethod",
+            name="api_payment_is_acti_4629ce_idx",
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["organization", "-date"], name="api_expense_organiz_8d3a93_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["organization", "updated_at"], name="api_expense_organiz_eee422_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["organization", "fingerprint"], name="api_expense_organiz_b12071_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(fields=["team", "-date"], name="api_expense_team_id_d17d3c_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="paymentmethod",
+            index=models.Index(
+                fields=["organization", "name"], name="api_payment_organiz_04c768_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentmethod",
+            index=models.Index(
+                fields=["organization", "is_active"], name="api_payment_organiz_449144_idx"
+            ),
+        ),
+    ]
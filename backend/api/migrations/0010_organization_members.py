@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("api", "0009_tenants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="organization",
+            name="members",
+            field=models.ManyToManyField(
+                blank=True,
+                related_name="organizations",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="メンバー",
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0010_organization_members"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="expense",
+            name="api_expense_categor_abfaf9_idx",
+        ),
+        migrations.AlterField(
+            model_name="expense",
+            name="category",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="expenses",
+                to="api.category",
+                verbose_name="カテゴリー",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="expense",
+            name="payment",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="expenses",
+                to="api.paymentmethod",
+                verbose_name="支払い方法",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0011_expense_covered_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExpenseDeletion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("expense_id", models.UUIDField(verbose_name="経費ID")),
+                ("deleted_at", models.DateTimeField(auto_now_add=True, verbose_name="削除日時")),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        db_index=False,
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="api.organization",
+                        verbose_name="組織",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "経費の削除記録",
+                "verbose_name_plural": "経費の削除記録",
+                "indexes": [
+                    models.Index(
+                        fields=["organization", "deleted_at"], name="api_expense_organiz_de3248_idx"
+                    )
+                ],
+            },
+            managers=[
+                ("unscoped", django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
@@ -1,53 +1,243 @@
 import uuid
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
+from .fingerprints import expense_fingerprint
+from .receipt_status import DONE, FAILED, PENDING, UNSUPPORTED
+from .tenancy import TenantManager, require_tenant
 
-class Category(models.Model):
+
+class Organization(models.Model):
+    """組織モデル（テナント）"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=100, verbose_name="組織名")
+    description = models.TextField(blank=True, verbose_name="説明")
+    # X-Organization-ID ヘッダーでこの組織を指定できるユーザー
+    members = models.ManyToManyField(
+        settings.AUTH_USER_MODEL, related_name="organizations", blank=True, verbose_name="メンバー"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "組織"
+        verbose_name_plural = "組織"
+        ordering = ["name"]
+
+    def __str__(self):
+        return self.name
+
+
+class TenantModel(models.Model):
+    """組織に属するモデル
+
+    `objects` は現在の組織（api/tenancy.py）で絞り込んだ行だけを返す。
+    組織をまたぐ保守処理・管理画面・関連の参照には `unscoped` を使う。
+    """
+
+    # 各モデルの索引・一意制約はすべて organization を先頭にしているため、外部キー単独の索引は作らない
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name="+",
+        editable=False,
+        db_index=False,
+        verbose_name="組織",
+    )
+
+    # 最初に定義したマネージャーがデフォルトマネージャーになる。管理画面やシリアライズなど
+    # Django内部の処理は組織をまたいで動くため、デフォルトは絞り込みのないものにする
+    unscoped = models.Manager()
+    objects = TenantManager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.organization_id is None:
+            self.organization_id = require_tenant()
+        super().save(*args, **kwargs)
+
+
+class Team(TenantModel):
+    """チームモデル"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=100, verbose_name="チーム名")
+    description = models.TextField(blank=True, verbose_name="説明")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "チーム"
+        verbose_name_plural = "チーム"
+        ordering = ["name"]
+        constraints = [
+            models.UniqueConstraint(fields=["organization", "name"], name="uniq_team_name_per_org"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class UsageCounters(models.Model):
+    """経費の利用状況カウンター
+
+    Expenseの書き込みと同じトランザクション内でF式により更新する。
+    """
+
+    expense_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="経費件数"
+    )
+    total_amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal("0"),
+        editable=False,
+        verbose_name="合計金額",
+    )
+    last_used_on = models.DateField(null=True, blank=True, editable=False, verbose_name="最終利用日")
+
+    # このモデルを参照するExpense側の外部キー名
+    usage_field = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def _last_used_subquery(cls):
+        expenses = Expense.unscoped.filter(**{cls.usage_field: OuterRef("pk")})
+        return Subquery(expenses.order_by("-date").values("date")[:1])
+
+    @classmethod
+    def _actual_usage(cls):
+        expenses = Expense.unscoped.filter(**{cls.usage_field: OuterRef("pk")}).order_by()
+        grouped = expenses.values(cls.usage_field)
+        return {
+            "actual_count": Coalesce(
+                Subquery(grouped.annotate(value=Count("pk")).values("value")), 0
+            ),
+            "actual_total": Coalesce(
+                Subquery(grouped.annotate(value=Sum("amount")).values("value")),
+                Decimal("0"),
+                output_field=models.DecimalField(max_digits=14, decimal_places=2),
+            ),
+            "actual_last_used_on": cls._last_used_subquery(),
+        }
+
+    @classmethod
+    def record_usage(cls, pk, count, amount, used_on=None, recompute=False):
+        """件数・合計金額を増減し、最終利用日を更新する
+
+        追加だけなら used_on との大きい方を F式で取る（同時の追加で後の日付を失わない）。
+        減らす・移動する場合は recompute=True で Expense から取り直す。
+        """
+        if recompute:
+            last_used_on = cls._last_used_subquery()
+        elif used_on is not None:
+            used_on = Value(used_on, output_field=models.DateField())
+            last_used_on = Greatest(Coalesce(F("last_used_on"), used_on), used_on)
+        else:
+            last_used_on = F("last_used_on")
+        cls.unscoped.filter(pk=pk).update(
+            expense_count=F("expense_count") + count,
+            total_amount=F("total_amount") + amount,
+            last_used_on=last_used_on,
+        )
+
+    @classmethod
+    def drifted(cls):
+        """カウンターが実際のExpenseの集計と一致しない行を返す（全組織）"""
+        in_sync = (
+            Q(expense_count=F("actual_count"))
+            & Q(total_amount=F("actual_total"))
+            & (
+                Q(last_used_on=F("actual_last_used_on"))
+                | Q(last_used_on__isnull=True, actual_last_used_on__isnull=True)
+            )
+        )
+        return cls.unscoped.annotate(**cls._actual_usage()).exclude(in_sync)
+
+    @classmethod
+    def recount_usage(cls, queryset=None):
+        """Expenseから集計し直したカウンターを1回のUPDATEで書き戻す"""
+        queryset = cls.unscoped.all() if queryset is None else queryset
+        usage = cls._actual_usage()
+        return queryset.update(
+            expense_count=usage["actual_count"],
+            total_amount=usage["actual_total"],
+            last_used_on=usage["actual_last_used_on"],
+        )
+
+
+class Category(TenantModel, UsageCounters):
     """経費カテゴリーモデル"""
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=100, unique=True, verbose_name="カテゴリー名")
+    name = models.CharField(max_length=100, verbose_name="カテゴリー名")
     description = models.TextField(blank=True, verbose_name="説明")
     color = models.CharField(max_length=7, default="#3B82F6", verbose_name="カラーコード")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
+    usage_field = "category"
+
     class Meta:
         verbose_name = "カテゴリー"
         verbose_name_plural = "カテゴリー"
         ordering = ["name"]
+        constraints = [
+            # 組織内での一意性。索引は (organization, name) の順で一覧の並び順にも使える
+            models.UniqueConstraint(
+                fields=["organization", "name"], name="uniq_category_name_per_org"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class PaymentMethod(models.Model):
+class PaymentMethod(TenantModel, UsageCounters):
     """支払い方法モデル"""
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=50, verbose_name="支払い方法名")
-    code = models.CharField(max_length=20, unique=True, verbose_name="コード")
+    code = models.CharField(max_length=20, verbose_name="コード")
     icon = models.CharField(max_length=50, blank=True, verbose_name="アイコン")
     is_active = models.BooleanField(default=True, verbose_name="有効")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
+    usage_field = "payment"
+
     class Meta:
         verbose_name = "支払い方法"
         verbose_name_plural = "支払い方法"
         ordering = ["code"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["organization", "code"], name="uniq_payment_code_per_org"
+            ),
+        ]
         indexes = [
-            models.Index(fields=["name"]),
-            models.Index(fields=["is_active"]),
+            models.Index(fields=["organization", "name"]),
+            models.Index(fields=["organization", "is_active"]),
         ]
 
     def __str__(self):
         return self.name
 
 
-class Expense(models.Model):
+class Expense(TenantModel):
     """経費モデル"""
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -58,18 +248,36 @@ class Expense(models.Model):
         validators=[MinValueValidator(Decimal("0.01"))],
         verbose_name="金額",
     )
+    # 外部キーは Meta.indexes の (payment, -date) などが先頭の列として兼ねるため、単独の索引は作らない
     payment = models.ForeignKey(
         PaymentMethod,
         on_delete=models.PROTECT,
         related_name="expenses",
         null=True,
         blank=True,
+        db_index=False,
         verbose_name="支払い方法",
     )
     category = models.ForeignKey(
-        Category, on_delete=models.PROTECT, related_name="expenses", verbose_name="カテゴリー"
+        Category,
+        on_delete=models.PROTECT,
+        related_name="expenses",
+        db_index=False,
+        verbose_name="カテゴリー",
+    )
+    team = models.ForeignKey(
+        Team,
+        on_delete=models.PROTECT,
+        related_name="expenses",
+        null=True,
+        blank=True,
+        db_index=False,
+        verbose_name="チーム",
     )
     description = models.TextField(verbose_name="説明")
+    fingerprint = models.CharField(
+        max_length=64, blank=True, editable=False, verbose_name="重複検出用フィンガープリント"
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
@@ -77,14 +285,122 @@ class Expense(models.Model):
         verbose_name = "経費"
         verbose_name_plural = "経費"
         ordering = ["-date", "-created_at"]
+        # アプリケーションの問い合わせは必ず組織で絞り込むため、組織を先頭にした索引を使う
+        # （カテゴリー・支払い方法・チームは1つの組織に属するので、それらが先頭の索引も組織内で閉じる）。
+        # (-date) だけは、組織をまたいで日付順に並べる管理画面の一覧と年・月の絞り込みのために残す
         indexes = [
             models.Index(fields=["-date"]),
-            models.Index(fields=["category"]),
+            models.Index(fields=["organization", "-date"]),
+            models.Index(fields=["organization", "updated_at"]),
+            models.Index(fields=["organization", "fingerprint"]),
+            models.Index(fields=["team", "-date"]),
+            models.Index(fields=["category", "-date"]),
+            models.Index(fields=["payment", "-date"]),
         ]
 
     def __str__(self):
         return f"{self.date} - {self.category.name} - ¥{self.amount}"
 
+    def compute_fingerprint(self):
+        return expense_fingerprint(self.date, self.amount, self.payment_id, self.description)
+
+    def find_duplicates(self):
+        """同じ組織で同じフィンガープリントを持つ他の経費（索引の1回の探索で取得）"""
+        fingerprint = self.fingerprint or self.compute_fingerprint()
+        expenses = Expense.objects.for_tenant(self.organization_id or require_tenant())
+        return expenses.filter(fingerprint=fingerprint).exclude(pk=self.pk)
+
+    def clean(self):
+        # 管理画面などでは他の組織のカテゴリー等も選べるため、同じ組織のものか確かめる
+        super().clean()
+        organization_id = self.organization_id or require_tenant()
+        for field in ("category", "payment", "team"):
+            related = getattr(self, field) if getattr(self, f"{field}_id") else None
+            if related is not None and related.organization_id != organization_id:
+                raise ValidationError({field: "別の組織のものは選べません"})
+
+    def _usage(self, sign):
+        amount = Decimal(str(self.amount)) * sign
+        return [
+            (Category, self.category_id, sign, amount, self.date),
+            (PaymentMethod, self.payment_id, sign, amount, self.date),
+        ]
+
+    @staticmethod
+    def _record_usage(entries):
+        # 同じ行への増減はまとめて1回のUPDATEにする（カテゴリー移動がない更新など）
+        # 減らす行を含む場合だけ最終利用日を取り直し、追加だけなら日付の大きい方を取る
+        deltas = {}
+        for model, pk, count, amount, used_on in entries:
+            if pk is None:
+                continue
+            total_count, total_amount, latest, recompute = deltas.get(
+                (model, pk), (0, Decimal("0"), None, False)
+            )
+            if count < 0:
+                recompute = True
+            elif latest is None or used_on > latest:
+                latest = used_on
+            deltas[(model, pk)] = (total_count + count, total_amount + amount, latest, recompute)
+        for (model, pk), (count, amount, latest, recompute) in deltas.items():
+            model.record_usage(pk, count, amount, used_on=latest, recompute=recompute)
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.compute_fingerprint()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "fingerprint"}
+        with transaction.atomic():
+            entries = []
+            if not self._state.adding:
+                previous = Expense.unscoped.select_for_update().filter(pk=self.pk).first()
+                if previous is not None:
+                    entries += previous._usage(-1)
+            super().save(*args, **kwargs)
+            self._record_usage(entries + self._usage(1))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # save() と同じく、手元の古い値ではなくロックした現在の行の分だけ減らす
+            previous = Expense.unscoped.select_for_update().filter(pk=self.pk).first()
+            result = super().delete(*args, **kwargs)
+            if previous is not None:
+                self._record_usage(previous._usage(-1))
+        return result
+
+
+class ExpenseDeletion(TenantModel):
+    """削除された経費の記録
+
+    分析スナップショット（api/analytics.py）は削除を updated_at で検出できないため、
+    この記録から差分で取り除く。refresh_analytics が保持期間を過ぎたものを消す。
+    """
+
+    expense_id = models.UUIDField(verbose_name="経費ID")
+    deleted_at = models.DateTimeField(auto_now_add=True, verbose_name="削除日時")
+
+    class Meta:
+        verbose_name = "経費の削除記録"
+        verbose_name_plural = "経費の削除記録"
+        indexes = [
+            models.Index(fields=["organization", "deleted_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.expense_id} ({self.deleted_at})"
+
+
+@receiver(post_delete, sender=Expense)
+def record_expense_deletion(sender, instance, origin=None, **kwargs):
+    # QuerySet.delete() や管理画面の一括削除も含め、削除した経費ごとに記録する。
+    # 組織ごと削除する場合は記録も同じ組織と一緒に消えるため残さない
+    origin_model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    if origin_model is Organization:
+        return
+    ExpenseDeletion.unscoped.create(
+        organization_id=instance.organization_id, expense_id=instance.pk
+    )
+
 
 class Receipt(models.Model):
     """領収書モデル"""
@@ -106,10 +422,135 @@ class Receipt(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
+    # api/receipts.py の抽出パイプラインが書き込むメタデータ
+    EXTRACTION_STATUS_CHOICES = [
+        (PENDING, "未処理"),
+        (DONE, "抽出済み"),
+        (FAILED, "失敗"),
+        (UNSUPPORTED, "対象外"),
+    ]
+    # EXIFの撮影日時は購入後に撮ることがあるため、経費の日付からこの日数後までは一致とみなす
+    CAPTURE_GRACE_DAYS = 7
+
+    extraction_status = models.CharField(
+        max_length=20,
+        choices=EXTRACTION_STATUS_CHOICES,
+        default=PENDING,
+        editable=False,
+        verbose_name="抽出状態",
+    )
+    extractor_version = models.PositiveSmallIntegerField(
+        default=0, editable=False, verbose_name="抽出処理の版"
+    )
+    extracted_at = models.DateTimeField(null=True, editable=False, verbose_name="抽出日時")
+    extraction_error = models.TextField(blank=True, editable=False, verbose_name="抽出エラー")
+    extracted_text = models.TextField(blank=True, editable=False, verbose_name="抽出テキスト")
+    extracted_sources = models.CharField(
+        max_length=100, blank=True, editable=False, verbose_name="抽出元"
+    )
+    extracted_date = models.DateField(null=True, editable=False, verbose_name="読み取った日付")
+    extracted_amount = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, editable=False, verbose_name="読み取った金額"
+    )
+    captured_at = models.DateTimeField(null=True, editable=False, verbose_name="撮影・作成日時")
+    amount_mismatch = models.BooleanField(default=False, editable=False, verbose_name="金額の不一致")
+    date_mismatch = models.BooleanField(default=False, editable=False, verbose_name="日付の不一致")
+
     class Meta:
         verbose_name = "領収書"
         verbose_name_plural = "領収書"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["extraction_status", "extractor_version"]),
+        ]
 
     def __str__(self):
         return self.file_name
+
+    def check_against_expense(self):
+        """読み取った金額・日付を紐付いた経費と比べ、不一致フラグを設定する"""
+        expense = self.expense
+        self.amount_mismatch = bool(
+            expense and self.extracted_amount is not None and self.extracted_amount != expense.amount
+        )
+        if expense is None:
+            self.date_mismatch = False
+        elif self.extracted_date is not None:
+            self.date_mismatch = self.extracted_date != expense.date
+        elif self.captured_at is not None:
+            captured_on = timezone.localdate(self.captured_at)
+            days_after = (captured_on - expense.date).days
+            self.date_mismatch = not 0 <= days_after <= self.CAPTURE_GRACE_DAYS
+        else:
+            self.date_mismatch = False
+        return self.amount_mismatch or self.date_mismatch
+
+
+class SlowQuery(models.Model):
+    """スロークエリの集計（正規化したSQLのフィンガープリントごとに1行）"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    fingerprint = models.CharField(max_length=40, unique=True, verbose_name="フィンガープリント")
+    statement = models.TextField(verbose_name="正規化したSQL")
+    sample_sql = models.TextField(verbose_name="直近のSQL")
+    calls = models.PositiveIntegerField(default=0, verbose_name="回数")
+    total_time_ms = models.FloatField(default=0, verbose_name="合計時間(ms)")
+    max_time_ms = models.FloatField(default=0, verbose_name="最大時間(ms)")
+    operation = models.CharField(max_length=200, blank=True, verbose_name="GraphQLオペレーション")
+    resolver = models.CharField(max_length=200, blank=True, verbose_name="リゾルバー")
+    explain = models.TextField(blank=True, verbose_name="実行計画")
+    first_seen = models.DateTimeField(auto_now_add=True, verbose_name="初回検出日時")
+    last_seen = models.DateTimeField(verbose_name="最終検出日時")
+
+    class Meta:
+        verbose_name = "スロークエリ"
+        verbose_name_plural = "スロークエリ"
+        ordering = ["-total_time_ms"]
+        indexes = [
+            models.Index(fields=["-total_time_ms"]),
+        ]
+
+    def __str__(self):
+        return self.statement[:80]
+
+    @property
+    def mean_time_ms(self):
+        return self.total_time_ms / self.calls if self.calls else 0.0
+
+    @classmethod
+    def record(
+        cls, fingerprint, statement, sample_sql, elapsed_ms, operation, resolver, plan, using=None
+    ):
+        """フィンガープリントごとの集計行をF式で更新し、なければ作成する"""
+        now = timezone.now()
+        updates = {
+            "calls": F("calls") + 1,
+            "total_time_ms": F("total_time_ms") + elapsed_ms,
+            "max_time_ms": Greatest(F("max_time_ms"), elapsed_ms),
+            "sample_sql": sample_sql,
+            "operation": operation,
+            "resolver": resolver,
+            "last_seen": now,
+        }
+        if plan:
+            updates["explain"] = plan
+        queryset = cls.objects.using(using).filter(fingerprint=fingerprint)
+        if queryset.update(**updates):
+            return
+        try:
+            with transaction.atomic(using=using):
+                cls.objects.using(using).create(
+                    fingerprint=fingerprint,
+                    statement=statement,
+                    sample_sql=sample_sql,
+                    calls=1,
+                    total_time_ms=elapsed_ms,
+                    max_time_ms=elapsed_ms,
+                    operation=operation,
+                    resolver=resolver,
+                    explain=plan,
+                    last_seen=now,
+                )
+        except IntegrityError:
+            # 同時に作成された場合は更新し直す
+            queryset.update(**updates)
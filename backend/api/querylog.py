@@ -0,0 +1,175 @@
+"""スロークエリログ
+
+`connection.execute_wrapper` で全SQLの実行時間を計り、しきい値を超えたものを
+正規化したフィンガープリントごとに SlowQuery へ集計する。発行元のGraphQLオペレーションと
+リゾルバーを記録し、一定の割合で EXPLAIN（設定により ANALYZE）を取得する。
+計測のコストは time.perf_counter() の呼び出しだけで、しきい値未満のクエリには何もしない。
+
+記録はリクエストの処理中にはためておき、レスポンスを返す前にアプリケーションの
+トランザクションの外で書き込む（集計行のロックをリクエストのトランザクションが
+持ち続けたり、ロールバックで記録が消えたりしないように）。
+"""
+
+import hashlib
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, NotSupportedError, connections, transaction
+from graphql import OperationDefinitionNode
+
+from .models import SlowQuery
+
+logger = logging.getLogger("api.slow_queries")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_state = threading.local()
+
+
+def normalize_sql(sql: str) -> str:
+    """リテラルとパラメータ数の違いを取り除き、同じ形のSQLを同じ文字列にする"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = _PLACEHOLDER_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def sql_fingerprint(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()
+
+
+def graphql_origin():
+    """呼び出し元のスタックからGraphQLのオペレーション名とフィールドを探す
+
+    遅延評価のQuerySetでも値の完成処理中は `info` がスタック上に残るため、
+    リゾルバーが返した後に発行されたクエリも発行元のフィールドに紐付けられる。
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        info = frame.f_locals.get("info")
+        # strawberryはGraphQLResolveInfoと同じ属性を持つ独自の型を渡すため、属性で判定する
+        operation = getattr(info, "operation", None)
+        if isinstance(operation, OperationDefinitionNode) and hasattr(info, "parent_type"):
+            name = operation.name.value if operation.name else operation.operation.value
+            return name, f"{info.parent_type.name}.{info.field_name}"
+        frame = frame.f_back
+    return "", ""
+
+
+def explain(connection, sql, params):
+    """同じパラメータでEXPLAINを実行し、実行計画を文字列で返す"""
+    options = {"analyze": True} if settings.SLOW_QUERY_LOG["EXPLAIN_ANALYZE"] else {}
+    try:
+        prefix = connection.ops.explain_query_prefix(**options)
+    except (NotSupportedError, ValueError):
+        # SQLiteなど ANALYZE に対応しないDBは ValueError（Unknown options）を送出する
+        prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {sql}", params)
+        rows = cursor.fetchall()
+    if connection.vendor == "sqlite":
+        return "\n".join(str(row[-1]) for row in rows)
+    return "\n".join(" ".join(str(value) for value in row) for row in rows)
+
+
+class SlowQueryRecorder:
+    """`connection.execute_wrapper` に渡すラッパー（リクエストごとに作る）
+
+    遅いクエリは `pending` にためておき、`flush()` でまとめて書き込む。
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_state, "recording", False):
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        config = settings.SLOW_QUERY_LOG
+        if elapsed_ms >= config["THRESHOLD_MS"]:
+            _state.recording = True
+            try:
+                self.record(context["connection"], sql, params, many, elapsed_ms, config)
+            except Exception:
+                # 記録の失敗でアプリケーションのクエリを失敗させない
+                logger.exception("failed to record slow query")
+            finally:
+                _state.recording = False
+        return result
+
+    def record(self, connection, sql, params, many, elapsed_ms, config):
+        """ログに出し、実行計画を取得して書き込み待ちに加える（DBには書かない）"""
+        operation, resolver = graphql_origin()
+        logger.warning(
+            "slow query %.1fms operation=%s resolver=%s sql=%s",
+            elapsed_ms,
+            operation or "-",
+            resolver or "-",
+            sql,
+        )
+
+        plan = ""
+        is_select = sql.lstrip()[:6].upper() == "SELECT"
+        if is_select and not many and random.random() < config["EXPLAIN_SAMPLE_RATE"]:
+            try:
+                with transaction.atomic(using=connection.alias):
+                    plan = explain(connection, sql, params)
+            except DatabaseError:
+                logger.exception("EXPLAIN failed for slow query")
+
+        self.pending.append(
+            {
+                "fingerprint": sql_fingerprint(sql),
+                "statement": normalize_sql(sql),
+                "sample_sql": sql,
+                "elapsed_ms": elapsed_ms,
+                "operation": operation,
+                "resolver": resolver,
+                "plan": plan,
+                "using": connection.alias,
+            }
+        )
+
+    def flush(self):
+        """ためた記録を書き込む（アプリケーションのトランザクションが終わった後に呼ぶ）"""
+        pending, self.pending = self.pending, []
+        for entry in pending:
+            try:
+                with transaction.atomic(using=entry["using"]):
+                    SlowQuery.record(**entry)
+            except Exception:
+                logger.exception("failed to record slow query")
+
+
+class SlowQueryMiddleware:
+    """リクエスト処理中の全DB接続にスロークエリの計測を仕掛けるミドルウェア"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SLOW_QUERY_LOG["ENABLED"]:
+            return self.get_response(request)
+        recorder = SlowQueryRecorder()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                return self.get_response(request)
+        finally:
+            # ラッパーを外してから書くため、記録自体のクエリは計測しない
+            recorder.flush()
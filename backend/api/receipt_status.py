@@ -0,0 +1,9 @@
+"""領収書の抽出状態
+
+models.py と、Django に依存しない extraction.py の両方から使うため、どちらにも依存しない。
+"""
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+UNSUPPORTED = "unsupported"
@@ -0,0 +1,239 @@
+"""領収書メタデータの抽出パイプライン
+
+api/extraction.py の抽出処理をプロセスプールで並列に実行し、結果を Receipt に保存して
+紐付いた経費との金額・日付の不一致を記録する。
+
+- ワーカーは spawn で起動し（Djangoや親の接続を引き継がない）、アドレス空間の上限を設定する。
+  MAX_TASKS_PER_WORKER 件ごとに作り直すため、PDFライブラリのメモリの断片化も溜まらない
+- 未完了のタスクはワーカー数の数倍までに抑え、親プロセスのメモリも件数によらず一定にする
+- 結果は BATCH_SIZE 件ごとに bulk_update でまとめて書き込む
+- ワーカーが異常終了した場合は、その時点で未完了のタスクを失敗として記録し、
+  プールを作り直して続ける（失敗した領収書は次回のバッチで再処理される）
+"""
+
+import logging
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .extraction import EXTRACTOR_VERSION, ExtractionResult, limit_memory, run_task
+from .models import Receipt
+from .receipt_status import DONE, UNSUPPORTED
+
+logger = logging.getLogger("api.receipts")
+
+# ワーカー1つあたりに先行して投入するタスク数
+IN_FLIGHT_PER_WORKER = 4
+
+STORED_FIELDS = [
+    "extraction_status",
+    "extractor_version",
+    "extracted_at",
+    "extraction_error",
+    "extracted_text",
+    "extracted_sources",
+    "extracted_date",
+    "extracted_amount",
+    "captured_at",
+    "amount_mismatch",
+    "date_mismatch",
+]
+
+
+@dataclass
+class ExtractionSummary:
+    processed: int = 0
+    done: int = 0
+    failed: int = 0
+    unsupported: int = 0
+    mismatched: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+def resolve_path(file_path):
+    """Receipt.file_path の実体（相対パスは RECEIPT_EXTRACTION["ROOT"] から）"""
+    path = Path(file_path)
+    return path if path.is_absolute() else Path(settings.RECEIPT_EXTRACTION["ROOT"]) / path
+
+
+def extraction_options():
+    """ワーカーへ渡す抽出の設定（pickle できる値だけ）"""
+    config = settings.RECEIPT_EXTRACTION
+    return {
+        "max_file_mb": config["MAX_FILE_MB"],
+        "max_pdf_pages": config["MAX_PDF_PAGES"],
+        "ocr_languages": config["OCR_LANGUAGES"],
+        "ocr_timeout": config["OCR_TIMEOUT"],
+        "tesseract_cmd": config["TESSERACT_CMD"],
+    }
+
+
+def receipts_to_process(year=None, force=False):
+    """抽出対象の領収書
+
+    year を指定すると、その年の経費に紐付いた領収書（紐付けがなければ登録日がその年のもの）。
+    force でなければ、現在の版で抽出済み・対象外のものは除く。
+    """
+    receipts = Receipt.objects.all()
+    if year is not None:
+        receipts = receipts.filter(
+            Q(expense__date__year=year) | Q(expense__isnull=True, created_at__year=year)
+        )
+    if not force:
+        receipts = receipts.exclude(
+            extraction_status__in=[DONE, UNSUPPORTED], extractor_version=EXTRACTOR_VERSION
+        )
+    return receipts
+
+
+def _executor(workers, config):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=limit_memory,
+        initargs=(config["WORKER_MEMORY_MB"],),
+        max_tasks_per_child=config["MAX_TASKS_PER_WORKER"],
+    )
+
+
+def _run_in_pool(tasks, workers, options):
+    """タスクをプロセスプールで実行し、終わった順に (receipt_id, 結果) を返す"""
+    config = settings.RECEIPT_EXTRACTION
+    tasks = iter(tasks)
+    task = next(tasks, None)
+    while task is not None:
+        pending = {}
+        with _executor(workers, config) as executor:
+            try:
+                while task is not None or pending:
+                    while task is not None and len(pending) < workers * IN_FLIGHT_PER_WORKER:
+                        pending[executor.submit(run_task, *task, options)] = task[0]
+                        task = next(tasks, None)
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    # 同じ done に異常終了の前に完了した結果が混ざっていることがあるため、
+                    # 先にそれらを返してから、残り（pending）を失敗として扱う
+                    broken = None
+                    for future in done:
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool as error:
+                            broken = error
+                            continue
+                        del pending[future]
+                        yield result
+                    if broken is not None:
+                        raise broken
+            except BrokenProcessPool:
+                logger.error("receipt extraction worker died; restarting the pool")
+                for receipt_id in pending.values():
+                    yield receipt_id, ExtractionResult.failure("ワーカープロセスが異常終了しました")
+
+
+def _run_inline(tasks, options):
+    for task in tasks:
+        yield run_task(*task, options)
+
+
+def _tasks(receipt_ids, batch_size):
+    for start in range(0, len(receipt_ids), batch_size):
+        chunk = receipt_ids[start : start + batch_size]
+        rows = Receipt.objects.filter(pk__in=chunk).values_list("pk", "file_path")
+        for pk, file_path in rows:
+            yield pk, str(resolve_path(file_path))
+
+
+def _aware(value):
+    if value is None or not settings.USE_TZ or timezone.is_aware(value):
+        return value
+    return timezone.make_aware(value)
+
+
+def _store(results, summary):
+    receipts = Receipt.objects.select_related("expense").in_bulk([pk for pk, _ in results])
+    now = timezone.now()
+    updated = []
+    for pk, result in results:
+        receipt = receipts.get(pk)
+        if receipt is None:
+            continue
+        receipt.extraction_status = result.status
+        receipt.extractor_version = EXTRACTOR_VERSION
+        receipt.extracted_at = now
+        receipt.extraction_error = result.error
+        receipt.extracted_text = result.text
+        receipt.extracted_sources = ",".join(result.sources)
+        receipt.extracted_date = result.date
+        receipt.extracted_amount = result.amount
+        receipt.captured_at = _aware(result.captured_at)
+        mismatched = receipt.check_against_expense()
+        updated.append(receipt)
+
+        summary.processed += 1
+        summary.mismatched += mismatched
+        if result.status == DONE:
+            summary.done += 1
+        elif result.status == UNSUPPORTED:
+            summary.unsupported += 1
+        else:
+            summary.failed += 1
+    with transaction.atomic():
+        Receipt.objects.bulk_update(updated, STORED_FIELDS)
+
+
+def process_receipts(receipts, workers=None, batch_size=None, on_batch=None):
+    """領収書のメタデータを抽出して保存する
+
+    workers が 0 のときはプロセスプールを使わずに呼び出し元のプロセスで実行する
+    （管理画面からの少数の再抽出とテスト用）。
+    """
+    config = settings.RECEIPT_EXTRACTION
+    workers = config["WORKERS"] if workers is None else workers
+    batch_size = batch_size or config["BATCH_SIZE"]
+    options = extraction_options()
+    summary = ExtractionSummary()
+    started = time.perf_counter()
+
+    # 書き込みながら読み進めるとカーソルが不安定になるため、対象のIDだけ先に確定させる
+    receipt_ids = list(receipts.order_by("pk").values_list("pk", flat=True))
+    tasks = _tasks(receipt_ids, batch_size)
+    results = _run_inline(tasks, options) if workers == 0 else _run_in_pool(tasks, workers, options)
+
+    batch = []
+    for item in results:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            _store(batch, summary)
+            batch = []
+            summary.elapsed = time.perf_counter() - started
+            if on_batch:
+                on_batch(summary, len(receipt_ids))
+    if batch:
+        _store(batch, summary)
+    summary.elapsed = time.perf_counter() - started
+    return summary
+
+
+def recheck_mismatches(receipts, batch_size=1000):
+    """抽出し直さずに、現在の経費の金額・日付と突き合わせ直す（経費を編集した後など）"""
+    flagged = 0
+    receipts = receipts.filter(extraction_status=DONE).select_related("expense")
+    receipt_ids = list(receipts.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(receipt_ids), batch_size):
+        chunk = list(receipts.filter(pk__in=receipt_ids[start : start + batch_size]))
+        for receipt in chunk:
+            flagged += receipt.check_against_expense()
+        with transaction.atomic():
+            Receipt.objects.bulk_update(chunk, ["amount_mismatch", "date_mismatch"])
+    return flagged
@@ -3,7 +3,19 @@ import strawberry_django
 from typing import List, Optional
 from decimal import Decimal
 import datetime
-from .models import Category as CategoryModel, Expense as ExpenseModel
+import enum
+import uuid
+from django.conf import settings
+from strawberry.schema.config import StrawberryConfig
+from .duplicates import MERGE, REJECT, WARN, duplicate_groups
+from .duplicates import create_expense as create_checked_expense
+from .analytics import get_snapshot
+from .models import (
+    Category as CategoryModel,
+    Expense as ExpenseModel,
+    PaymentMethod as PaymentMethodModel,
+    Team as TeamModel,
+)
 
 
 @strawberry_django.type(CategoryModel)
@@ -12,6 +24,32 @@ class Category:
     name: str
     description: str
     color: str
+    expense_count: int
+    total_amount: Decimal
+    last_used_on: Optional[datetime.date]
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+
+@strawberry_django.type(PaymentMethodModel)
+class PaymentMethod:
+    id: strawberry.ID
+    name: str
+    code: str
+    icon: str
+    is_active: bool
+    expense_count: int
+    total_amount: Decimal
+    last_used_on: Optional[datetime.date]
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+
+@strawberry_django.type(TeamModel)
+class Team:
+    id: strawberry.ID
+    name: str
+    description: str
     created_at: datetime.datetime
     updated_at: datetime.datetime
 
@@ -23,10 +61,47 @@ class Expense:
     amount: Decimal
     category: Category
     description: str
-    payment_method: str
+    payment: Optional[PaymentMethod]
+    team: Optional[Team]
     created_at: datetime.datetime
     updated_at: datetime.datetime
 
+    @strawberry.field
+    def duplicates(self, info: strawberry.Info) -> List["Expense"]:
+        # 一覧の各経費で問い合わせないよう、フィンガープリントごとにまとめて引いたものを使う
+        fingerprint = self.fingerprint or self.compute_fingerprint()
+        return [expense for expense in load_duplicates(info, fingerprint) if expense.pk != self.pk]
+
+
+@strawberry.enum
+class DuplicatePolicy(enum.Enum):
+    WARN = WARN
+    REJECT = REJECT
+    MERGE = MERGE
+
+
+@strawberry.type
+class DuplicateGroup:
+    fingerprint: str
+    count: int
+    expenses: List[Expense]
+
+
+@strawberry.type
+class TrendPoint:
+    period: datetime.date
+    total: Decimal
+    moving_average: Optional[Decimal]
+    delta: Optional[Decimal]
+
+
+@strawberry.type
+class CategoryPercentiles:
+    category: Category
+    count: int
+    total: Decimal
+    percentiles: List[Decimal]
+
 
 @strawberry.input
 class CategoryInput:
@@ -41,7 +116,60 @@ class ExpenseInput:
     amount: Decimal
     category_id: strawberry.ID
     description: str
-    payment_method: str
+    payment_id: Optional[strawberry.ID] = None
+    team_id: Optional[strawberry.ID] = None
+
+
+# duplicates フィールドで1回に引くフィンガープリントの数（IN句の長さの上限）
+DUPLICATE_BATCH_SIZE = 500
+
+
+def expect_duplicates(info: strawberry.Info, expenses: list) -> list:
+    """一覧の経費のフィンガープリントを登録し、最初の duplicates でまとめて引けるようにする"""
+    pending = info.context.loader("duplicate_fingerprints")
+    for expense in expenses:
+        pending[expense.fingerprint or expense.compute_fingerprint()] = None
+    return expenses
+
+
+def load_duplicates(info: strawberry.Info, fingerprint: str) -> list:
+    """フィンガープリントが同じ経費（自分を含む）をリクエストスコープのキャッシュから返す
+
+    キャッシュにない場合は、登録済みの未取得のフィンガープリントも合わせて問い合わせる。
+    """
+    cache = info.context.loader("duplicates")
+    if fingerprint not in cache:
+        pending = info.context.loader("duplicate_fingerprints")
+        keys = [key for key in {fingerprint: None, **pending} if key not in cache]
+        pending.clear()
+        for start in range(0, len(keys), DUPLICATE_BATCH_SIZE):
+            batch = keys[start : start + DUPLICATE_BATCH_SIZE]
+            for key in batch:
+                cache[key] = []
+            expenses = ExpenseModel.objects.filter(fingerprint__in=batch).select_related(
+                "category", "payment"
+            )
+            for expense in expenses:
+                cache[expense.fingerprint].append(expense)
+    return cache[fingerprint]
+
+
+def forget_expense_caches(info: strawberry.Info):
+    """経費を書き込んだ後、同じバッチの後続のオペレーションが古い重複や
+    カテゴリーの利用状況カウンターを返さないようにする"""
+    info.context.loader("duplicates").clear()
+    info.context.loader("category").clear()
+
+
+def related_fields(input: ExpenseInput) -> dict:
+    """入力のIDを現在の組織のカテゴリー・支払い方法・チームとして引く（他の組織のIDは存在しない扱い）"""
+    return {
+        "category": CategoryModel.objects.get(pk=input.category_id),
+        "payment": (
+            PaymentMethodModel.objects.get(pk=input.payment_id) if input.payment_id else None
+        ),
+        "team": TeamModel.objects.get(pk=input.team_id) if input.team_id else None,
+    }
 
 
 @strawberry.type
@@ -55,23 +183,72 @@ class Query:
         return CategoryModel.objects.all()
 
     @strawberry.field
-    def category(self, id: strawberry.ID) -> Optional[Category]:
-        try:
-            return CategoryModel.objects.get(pk=id)
-        except CategoryModel.DoesNotExist:
-            return None
+    def category(self, info: strawberry.Info, id: strawberry.ID) -> Optional[Category]:
+        # バッチ内の同じIDへの問い合わせはリクエストスコープのキャッシュで1回にまとめる
+        cache = info.context.loader("category")
+        if id not in cache:
+            cache[id] = CategoryModel.objects.filter(pk=id).first()
+        return cache[id]
+
+    @strawberry.field
+    def payment_methods(self) -> List[PaymentMethod]:
+        return PaymentMethodModel.objects.all()
+
+    @strawberry.field
+    def teams(self) -> List[Team]:
+        return TeamModel.objects.all()
 
     @strawberry.field
-    def expenses(self) -> List[Expense]:
-        return ExpenseModel.objects.select_related("category").all()
+    def expenses(self, info: strawberry.Info) -> List[Expense]:
+        expenses = ExpenseModel.objects.select_related("category", "payment", "team").all()
+        return expect_duplicates(info, list(expenses))
 
     @strawberry.field
     def expense(self, id: strawberry.ID) -> Optional[Expense]:
         try:
-            return ExpenseModel.objects.select_related("category").get(pk=id)
+            return ExpenseModel.objects.select_related("category", "payment", "team").get(pk=id)
         except ExpenseModel.DoesNotExist:
             return None
 
+    @strawberry.field
+    def expense_trend(
+        self,
+        start: datetime.date,
+        end: datetime.date,
+        window: int = 3,
+        category_id: Optional[strawberry.ID] = None,
+    ) -> List[TrendPoint]:
+        points = get_snapshot().trend(start, end, window=window, category_id=category_id)
+        return [TrendPoint(**point) for point in points]
+
+    @strawberry.field
+    def category_percentiles(
+        self,
+        percentiles: List[float],
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+    ) -> List[CategoryPercentiles]:
+        rows = get_snapshot().category_percentiles(percentiles, start=start, end=end)
+        categories = CategoryModel.objects.in_bulk([row["category_id"] for row in rows])
+        return [
+            CategoryPercentiles(
+                category=categories[uuid.UUID(row.pop("category_id"))], **row
+            )
+            for row in rows
+        ]
+
+    @strawberry.field
+    def duplicates(self, info: strawberry.Info, limit: int = 100) -> List[DuplicateGroup]:
+        groups = duplicate_groups(limit)
+        # グループの経費は重複のすべてなので、各経費の duplicates はそのまま使える
+        cache = info.context.loader("duplicates")
+        for fingerprint, _, expenses in groups:
+            cache[fingerprint] = expenses
+        return [
+            DuplicateGroup(fingerprint=fingerprint, count=count, expenses=expenses)
+            for fingerprint, count, expenses in groups
+        ]
+
 
 @strawberry.type
 class Mutation:
@@ -83,36 +260,52 @@ class Mutation:
         return category
 
     @strawberry.mutation
-    def create_expense(self, input: ExpenseInput) -> Expense:
-        category = CategoryModel.objects.get(pk=input.category_id)
-        expense = ExpenseModel.objects.create(
+    def create_expense(
+        self,
+        info: strawberry.Info,
+        input: ExpenseInput,
+        duplicate_policy: Optional[DuplicatePolicy] = None,
+    ) -> Expense:
+        expense = create_checked_expense(
+            policy=duplicate_policy.value if duplicate_policy else None,
             date=input.date,
             amount=input.amount,
-            category=category,
             description=input.description,
-            payment_method=input.payment_method,
+            **related_fields(input),
         )
+        forget_expense_caches(info)
         return expense
 
     @strawberry.mutation
-    def update_expense(self, id: strawberry.ID, input: ExpenseInput) -> Expense:
+    def update_expense(
+        self, info: strawberry.Info, id: strawberry.ID, input: ExpenseInput
+    ) -> Expense:
         expense = ExpenseModel.objects.get(pk=id)
         expense.date = input.date
         expense.amount = input.amount
-        expense.category = CategoryModel.objects.get(pk=input.category_id)
         expense.description = input.description
-        expense.payment_method = input.payment_method
+        for name, value in related_fields(input).items():
+            setattr(expense, name, value)
+        # カテゴリー・支払い方法の移動を含め、利用状況カウンターは save() 内で同じトランザクションで更新される
         expense.save()
+        forget_expense_caches(info)
         return expense
 
     @strawberry.mutation
-    def delete_expense(self, id: strawberry.ID) -> bool:
+    def delete_expense(self, info: strawberry.Info, id: strawberry.ID) -> bool:
         try:
             expense = ExpenseModel.objects.get(pk=id)
             expense.delete()
+            forget_expense_caches(info)
             return True
         except ExpenseModel.DoesNotExist:
             return False
 
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    config=StrawberryConfig(
+        batching_config={"max_operations": settings.GRAPHQL_BATCH_MAX_OPERATIONS}
+    ),
+)
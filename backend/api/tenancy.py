@@ -0,0 +1,158 @@
+"""組織（テナント）ごとのデータの分離
+
+経費・カテゴリー・支払い方法は組織に属し、すべての問い合わせは組織で絞り込んでから行う。
+
+- 現在の組織はリクエストごとに TenantMiddleware が contextvars に設定する
+  （ASGIでも sync_to_async 先のスレッドへ引き継がれる）
+- 各モデルの `objects`（TenantManager）は現在の組織で絞り込んだQuerySetだけを返し、
+  組織が設定されていなければ TenantRequired を送出する。組織をまたぐ保守処理は
+  明示的に `unscoped` マネージャーを使う
+- 組織ごとの索引はすべて organization を先頭の列にしているため、絞り込みは
+  その組織の行だけを探索する
+"""
+
+import contextlib
+import contextvars
+import uuid
+
+from django.conf import settings
+from django.db import models
+from django.http import HttpResponseBadRequest, HttpResponseForbidden
+
+# マイグレーションで作成する既定の組織（組織の導入前のデータはここに属する）
+DEFAULT_ORGANIZATION_ID = uuid.UUID("00000000-0000-0000-0000-000000000001")
+
+TENANT_HEADER = "HTTP_X_ORGANIZATION_ID"
+
+_current_tenant: contextvars.ContextVar[uuid.UUID | None] = contextvars.ContextVar(
+    "keihi_tenant", default=None
+)
+
+
+class TenantRequired(RuntimeError):
+    """組織が設定されていない状態で組織ごとのデータを問い合わせた"""
+
+
+class TenantMismatch(ValueError):
+    """別の組織の行を書き込もうとした"""
+
+
+def tenant_id(tenant):
+    """組織・組織ID（文字列/UUID）をUUIDにそろえる"""
+    if tenant is None or isinstance(tenant, uuid.UUID):
+        return tenant
+    if isinstance(tenant, models.Model):
+        return tenant.pk
+    return uuid.UUID(str(tenant))
+
+
+def get_current_tenant():
+    return _current_tenant.get()
+
+
+def require_tenant():
+    tenant = _current_tenant.get()
+    if tenant is None:
+        raise TenantRequired(
+            "組織が設定されていません（tenant_context() の中で実行するか unscoped を使ってください）"
+        )
+    return tenant
+
+
+@contextlib.contextmanager
+def tenant_context(tenant):
+    """ブロック内の現在の組織を設定する"""
+    token = _current_tenant.set(tenant_id(tenant))
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def tenant_cache_key(tenant, *parts):
+    """組織ごとに名前空間を分けたキャッシュキー"""
+    return (tenant_id(tenant), *parts)
+
+
+class TenantQuerySet(models.QuerySet):
+    """1つの組織に絞り込んだQuerySet（作成する行にも組織を設定する）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tenant = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._tenant = self._tenant
+        return clone
+
+    def _assign_tenant(self, obj):
+        if self._tenant is None:
+            return
+        if obj.organization_id is None:
+            obj.organization_id = self._tenant
+        elif obj.organization_id != self._tenant:
+            raise TenantMismatch(f"{obj!r} は別の組織の行です")
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        self._assign_tenant(obj)
+        self._for_write = True
+        obj.save(force_insert=True, using=self.db)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            self._assign_tenant(obj)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class TenantManager(models.Manager.from_queryset(TenantQuerySet)):
+    """現在の組織で絞り込んだQuerySetだけを返すマネージャー"""
+
+    def get_queryset(self):
+        return self.for_tenant(require_tenant())
+
+    def for_tenant(self, tenant):
+        """指定した組織で絞り込む（現在の組織とは無関係に使うバッチ処理など）"""
+        tenant = tenant_id(tenant)
+        if tenant is None:
+            raise TenantRequired("組織が指定されていません")
+        queryset = super().get_queryset().filter(organization_id=tenant)
+        queryset._tenant = tenant
+        return queryset
+
+
+class TenantMiddleware:
+    """リクエストの組織を決めて、レスポンスを返すまで現在の組織として設定する
+
+    `X-Organization-ID` ヘッダーはクライアントが自由に送れるため、TRUST_TENANT_HEADER が
+    有効な場合に限って使い、さらにログイン中のユーザーがその組織のメンバーであることを
+    確かめる（不正なIDは400、メンバーでなければ403）。それ以外は DEFAULT_ORGANIZATION_ID
+    設定の組織を使う。既定の組織は問い合わせずに設定する。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from .models import Organization
+
+        header = request.META.get(TENANT_HEADER)
+        if header and settings.TRUST_TENANT_HEADER:
+            try:
+                tenant = tenant_id(header)
+            except ValueError:
+                return HttpResponseBadRequest("X-Organization-ID が不正です")
+            user = request.user
+            if not (
+                user.is_authenticated
+                and Organization.objects.filter(pk=tenant, members=user).exists()
+            ):
+                return HttpResponseForbidden("この組織のデータにはアクセスできません")
+        else:
+            tenant = tenant_id(settings.DEFAULT_ORGANIZATION_ID or None)
+        request.tenant_id = tenant
+        with tenant_context(tenant):
+            return self.get_response(request)
@@ -0,0 +1,14 @@
+"""
+pytest configuration and fixtures for api tests
+"""
+
+import pytest
+
+from api.tenancy import DEFAULT_ORGANIZATION_ID, tenant_context
+
+
+@pytest.fixture(autouse=True)
+def tenant():
+    """テストは既定の組織（マイグレーションで作成）の中で実行する"""
+    with tenant_context(DEFAULT_ORGANIZATION_ID):
+        yield DEFAULT_ORGANIZATION_ID
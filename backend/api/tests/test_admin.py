@@ -0,0 +1,216 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.admin import EstimatedCountPaginator
+from api.models import Category, Expense, PaymentMethod, Receipt
+
+
+@pytest.fixture
+def category():
+    return Category.objects.create(name="交通費")
+
+
+@pytest.fixture
+def payment():
+    return PaymentMethod.objects.create(name="現金", code="cash")
+
+
+def create_expenses(category, payment, count):
+    return Expense.objects.bulk_create(
+        Expense(
+            date=date(2024, 12, 1 + i % 28),
+            amount=Decimal("100.00"),
+            category=category,
+            payment=payment,
+            description=f"経費{i}",
+        )
+        for i in range(count)
+    )
+
+
+@pytest.mark.django_db
+class TestExpenseAdmin:
+    def test_changelist_queries_do_not_grow_with_rows(self, admin_client, category, payment):
+        """チェンジリストのクエリ数が行数に比例しないことをテスト"""
+        url = reverse("admin:api_expense_changelist")
+        create_expenses(category, payment, 5)
+        with CaptureQueriesContext(connection) as few:
+            assert admin_client.get(url).status_code == 200
+
+        create_expenses(category, payment, 30)
+        with CaptureQueriesContext(connection) as many:
+            assert admin_client.get(url).status_code == 200
+
+        assert len(many) == len(few)
+
+    def test_changelist_does_not_load_related_tables(self, admin_client, category, payment):
+        """チェンジリストが全行の年のDISTINCTや関連先の全行の読み込みをしないことをテスト"""
+        create_expenses(category, payment, 3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = admin_client.get(reverse("admin:api_expense_changelist"))
+
+        assert response.status_code == 200
+        for query in ctx.captured_queries:
+            assert "DISTINCT" not in query["sql"]
+            for table in ("api_category", "api_paymentmethod", "api_organization"):
+                assert f'FROM "{table}"' not in query["sql"]
+
+    def test_changelist_filters(self, admin_client, category, payment):
+        """年・月と関連先の名前で絞り込めることをテスト"""
+        create_expenses(category, payment, 3)
+        other = Category.objects.create(name="会議費")
+        Expense.objects.create(
+            date=date(2023, 12, 1), amount=Decimal("10.00"), category=other, description="お茶"
+        )
+        url = reverse("admin:api_expense_changelist")
+
+        def result_count(**params):
+            response = admin_client.get(url, params)
+            assert response.status_code == 200
+            return response.context["cl"].result_count
+
+        assert result_count(year="2024") == 3
+        assert result_count(year="2024", month="12") == 3
+        assert result_count(year="2023", month="11") == 0
+        assert result_count(category="会議") == 1
+        assert result_count(payment="現金") == 3
+        assert admin_client.get(url, {"year": "x"}).status_code == 302
+
+    def test_delete_expenses_action(self, admin_client, category, payment):
+        """一括削除アクションで選択した経費が削除されることをテスト"""
+        expenses = create_expenses(category, payment, 3)
+        Receipt.objects.create(
+            expense=expenses[0], file_name="r.jpg", file_path="./r", file_size=10
+        )
+
+        response = admin_client.post(
+            reverse("admin:api_expense_changelist"),
+            {"action": "delete_expenses", "_selected_action": [str(e.id) for e in expenses[:2]]},
+        )
+
+        assert response.status_code == 302
+        assert Expense.objects.count() == 1
+        assert Receipt.objects.count() == 0
+        assert not Category.drifted().exists()
+        assert not PaymentMethod.drifted().exists()
+
+    def test_delete_selected_recounts_usage(self, admin_client, category, payment):
+        """標準の「選択した経費の削除」でもカウンターが集計し直されることをテスト"""
+        expense = Expense.objects.create(
+            date=date(2024, 12, 1),
+            amount=Decimal("10.00"),
+            category=category,
+            payment=payment,
+            description="電車代",
+        )
+
+        response = admin_client.post(
+            reverse("admin:api_expense_changelist"),
+            {"action": "delete_selected", "_selected_action": [str(expense.id)], "post": "yes"},
+        )
+
+        assert response.status_code == 302
+        assert not Expense.objects.exists()
+        category.refresh_from_db()
+        assert (category.expense_count, category.total_amount) == (0, Decimal("0.00"))
+        assert not PaymentMethod.drifted().exists()
+
+    def test_actions_require_the_model_permission(
+        self, client, django_user_model, category, payment
+    ):
+        """閲覧権限だけのスタッフは一括削除アクションを実行できないことをテスト"""
+        viewer = django_user_model.objects.create_user(username="viewer", is_staff=True)
+        viewer.user_permissions.add(Permission.objects.get(codename="view_expense"))
+        client.force_login(viewer)
+        expenses = create_expenses(category, payment, 2)
+
+        response = client.post(
+            reverse("admin:api_expense_changelist"),
+            {"action": "delete_expenses", "_selected_action": [str(e.id) for e in expenses]},
+        )
+
+        assert response.status_code == 200
+        assert Expense.objects.count() == 2
+
+    def test_admin_duplicate_filter(self, admin_client, category, payment):
+        """管理画面の重複フィルターが表示できることをテスト"""
+        expenses = create_expenses(category, payment, 2)
+        for expense in expenses:
+            expense.description = "同じ内容"
+            expense.date = date(2024, 12, 1)
+            expense.save()
+
+        response = admin_client.get(reverse("admin:api_expense_changelist"), {"duplicate": "yes"})
+
+        assert response.status_code == 200
+        assert response.context["cl"].result_count == 2
+
+    @pytest.mark.parametrize("policy", ["reject", "merge"])
+    def test_add_follows_duplicate_policy(self, admin_client, settings, category, payment, policy):
+        """reject / merge では重複の疑いがある経費を管理画面から登録できないことをテスト"""
+        settings.EXPENSE_DUPLICATE_POLICY = policy
+        existing = Expense.objects.create(
+            date=date(2024, 12, 1),
+            amount=Decimal("100.00"),
+            category=category,
+            payment=payment,
+            description="経費",
+        )
+        data = {
+            "date": existing.date.isoformat(),
+            "amount": "100",
+            "category": str(category.pk),
+            "payment": str(payment.pk),
+            "description": existing.description,
+        }
+
+        response = admin_client.post(reverse("admin:api_expense_add"), data)
+
+        assert response.status_code == 200
+        assert "同じ内容の経費が既に登録されています" in str(
+            response.context["adminform"].form.errors
+        )
+        assert Expense.objects.count() == 1
+
+        settings.EXPENSE_DUPLICATE_POLICY = "warn"
+        response = admin_client.post(reverse("admin:api_expense_add"), data)
+
+        assert response.status_code == 302
+        assert Expense.objects.count() == 2
+
+    def test_autocomplete_pages_load(self, admin_client):
+        """オートコンプリート用の参照先管理画面が表示できることをテスト"""
+        for name in ("category", "paymentmethod", "receipt"):
+            response = admin_client.get(reverse(f"admin:api_{name}_changelist"))
+            assert response.status_code == 200
+
+
+@pytest.mark.django_db
+class TestPaymentMethodAdmin:
+    def test_deactivate_action(self, admin_client, payment):
+        """無効化アクションがUPDATEで反映されることをテスト"""
+        admin_client.post(
+            reverse("admin:api_paymentmethod_changelist"),
+            {"action": "deactivate", "_selected_action": [str(payment.id)]},
+        )
+
+        payment.refresh_from_db()
+        assert payment.is_active is False
+
+
+@pytest.mark.django_db
+class TestEstimatedCountPaginator:
+    def test_falls_back_to_exact_count(self, category, payment):
+        """PostgreSQL以外では正確な件数を返すことをテスト"""
+        create_expenses(category, payment, 3)
+        paginator = EstimatedCountPaginator(Expense.objects.all(), 2)
+
+        assert paginator.count == 3
+        assert paginator.num_pages == 2
@@ -0,0 +1,265 @@
+import json
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.analytics import ExpenseSnapshot, get_snapshot, reset_snapshot, verify_against_orm
+from api.models import Category, Expense, ExpenseDeletion
+
+
+@pytest.fixture(autouse=True)
+def snapshot_path(settings, tmp_path):
+    settings.ANALYTICS_SNAPSHOT_PATH = tmp_path / "expense_snapshot.npz"
+    reset_snapshot()
+    yield settings.ANALYTICS_SNAPSHOT_PATH
+    reset_snapshot()
+
+
+@pytest.fixture
+def expenses():
+    transport = Category.objects.create(name="交通費")
+    meeting = Category.objects.create(name="会議費")
+    rows = [
+        (date(2024, 1, 5), "1000.00", transport),
+        (date(2024, 1, 20), "500.50", meeting),
+        (date(2024, 2, 3), "2000.00", transport),
+        (date(2024, 4, 10), "300.00", transport),
+        (date(2024, 4, 11), "1200.00", meeting),
+    ]
+    for day, amount, category in rows:
+        Expense.objects.create(
+            date=day, amount=Decimal(amount), category=category, description="テスト"
+        )
+    return transport, meeting
+
+
+@pytest.mark.django_db
+class TestExpenseSnapshot:
+    def test_trend_matches_orm(self, expenses):
+        """月別合計がORMの集計と一致し、経費のない月が0になることをテスト"""
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+
+        points = snapshot.trend(date(2024, 1, 1), date(2024, 4, 30), window=2)
+
+        assert [p["period"] for p in points] == [
+            date(2024, 1, 1),
+            date(2024, 2, 1),
+            date(2024, 3, 1),
+            date(2024, 4, 1),
+        ]
+        orm_january = Expense.objects.filter(date__month=1).aggregate(total=Sum("amount"))
+        assert points[0]["total"] == orm_january["total"]
+        assert [p["total"] for p in points[1:]] == [
+            Decimal("2000.00"),
+            Decimal("0.00"),
+            Decimal("1500.00"),
+        ]
+        assert points[0]["moving_average"] is None
+        assert points[1]["moving_average"] == Decimal("1750.25")
+        assert points[0]["delta"] is None
+        assert points[2]["delta"] == Decimal("-2000.00")
+
+    def test_category_percentiles(self, expenses):
+        """カテゴリー別の件数・合計・パーセンタイルをテスト"""
+        transport, _ = expenses
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+
+        rows = {row["category_id"]: row for row in snapshot.category_percentiles([0, 50, 100])}
+
+        row = rows[str(transport.id)]
+        assert row["count"] == 3
+        assert row["total"] == Decimal("3300.00")
+        assert row["percentiles"] == [Decimal("300.00"), Decimal("1000.00"), Decimal("2000.00")]
+
+    def test_incremental_refresh(self, expenses):
+        """更新・削除・追加が差分更新で反映されることをテスト"""
+        transport, _ = expenses
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+
+        expense = Expense.objects.filter(date=date(2024, 2, 3)).get()
+        expense.amount = Decimal("2500.00")
+        expense.save()
+        Expense.objects.filter(date=date(2024, 4, 10)).delete()
+        Expense.objects.create(
+            date=date(2024, 3, 1), amount=Decimal("100.00"), category=transport, description="追加"
+        )
+        snapshot.refresh()
+
+        assert len(snapshot) == Expense.objects.count()
+        assert verify_against_orm(snapshot) == []
+
+    def test_late_commits_are_not_skipped(self, expenses):
+        """さかのぼる幅内の遅いコミットは差分更新で、それより古いものは突き合わせで取り込むことをテスト"""
+        transport, _ = expenses
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+        late = Expense.objects.create(
+            date=date(2024, 3, 1), amount=Decimal("100.00"), category=transport, description="遅延"
+        )
+        changed = Expense.objects.filter(date=date(2024, 2, 3)).get()
+        changed.amount = Decimal("2500.00")
+        changed.save()
+        # コミットが遅れた行: 保存時刻は前回の watermark より前
+        Expense.objects.filter(pk=late.pk).update(
+            updated_at=snapshot.watermark - timedelta(hours=1)
+        )
+        Expense.objects.filter(pk=changed.pk).update(
+            updated_at=snapshot.watermark - timedelta(seconds=1)
+        )
+
+        assert snapshot.refresh() == 1
+        assert snapshot.reconcile() == 1
+        assert len(snapshot) == Expense.objects.count()
+        assert verify_against_orm(snapshot) == []
+        assert snapshot.refresh() == 0
+
+    def test_deletions_are_read_from_the_log(self, expenses, settings):
+        """削除は削除記録から取り除き、記録の保持期間を過ぎたら全件で突き合わせることをテスト"""
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+        Expense.objects.filter(date=date(2024, 4, 10)).delete()
+
+        with CaptureQueriesContext(connection) as ctx:
+            assert snapshot.refresh() == 1
+        assert not [q for q in ctx.captured_queries if "COUNT(" in q["sql"]]
+        assert len(snapshot) == Expense.objects.count() == 4
+
+        Expense.objects.filter(date=date(2024, 4, 11)).delete()
+        ExpenseDeletion.objects.all().delete()
+        snapshot.synced_at -= timedelta(days=settings.ANALYTICS_DELETION_RETENTION_DAYS + 1)
+        assert snapshot.refresh() == 1
+        assert verify_against_orm(snapshot) == []
+
+    def test_reads_refresh_at_most_once_per_interval(self, expenses, settings):
+        """分析クエリごとには更新せず、間隔が過ぎてから差分更新することをテスト"""
+        settings.ANALYTICS_SNAPSHOT_REFRESH_SECONDS = 3600
+        snapshot = get_snapshot()
+        Expense.objects.filter(date=date(2024, 4, 10)).delete()
+
+        with CaptureQueriesContext(connection) as ctx:
+            assert get_snapshot() is snapshot
+        assert ctx.captured_queries == []
+        assert len(snapshot) == 5
+
+        settings.ANALYTICS_SNAPSHOT_REFRESH_SECONDS = 0
+        assert len(get_snapshot()) == 4
+
+    def test_ids_are_stored_as_sorted_bytes(self, expenses):
+        """IDは16バイト値で昇順に持つことをテスト"""
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+
+        assert snapshot.ids.dtype.itemsize == 16
+        assert (snapshot.ids == np.sort(snapshot.ids)).all()
+        assert {uuid.UUID(bytes=value.tobytes()) for value in snapshot.ids} == set(
+            Expense.objects.values_list("id", flat=True)
+        )
+
+    def test_refresh_publishes_new_columns(self, expenses):
+        """更新は公開中の列を書き換えず、新しい列の組に差し替えることをテスト"""
+        transport, _ = expenses
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+        before = snapshot.columns
+        amounts = before.amounts.copy()
+        changed = Expense.objects.filter(date=date(2024, 2, 3)).get()
+        changed.amount = Decimal("2500.00")
+        changed.save()
+        Expense.objects.create(
+            date=date(2024, 3, 1), amount=Decimal("100.00"), category=transport, description="追加"
+        )
+
+        assert snapshot.refresh() == 2
+        assert snapshot.columns is not before
+        assert (before.amounts == amounts).all()
+        assert len(before) == len(before.dates) == len(before.category_codes) == 5
+        assert len(snapshot.columns) == 6
+        with pytest.raises(ValueError):
+            snapshot.columns.amounts[0] = 0
+
+    def test_save_and_load(self, expenses, snapshot_path):
+        """ディスクに保存したスナップショットを読み込めることをテスト"""
+        snapshot = ExpenseSnapshot()
+        snapshot.refresh()
+        snapshot.save(snapshot_path)
+
+        loaded = ExpenseSnapshot.load(snapshot_path)
+
+        assert len(loaded) == len(snapshot)
+        assert loaded.watermark == snapshot.watermark
+        assert loaded.refresh() >= 0
+        assert verify_against_orm(loaded) == []
+
+    def test_refresh_command_saves_and_prunes_deletions(self, expenses, snapshot_path, settings):
+        """コマンドが更新したスナップショットを保存し、保持期間を過ぎた削除記録を消すことをテスト"""
+        Expense.objects.filter(date=date(2024, 4, 10)).delete()
+        expired = timezone.now() - timedelta(days=settings.ANALYTICS_DELETION_RETENTION_DAYS + 1)
+        ExpenseDeletion.objects.update(deleted_at=expired)
+        Expense.objects.filter(date=date(2024, 4, 11)).delete()
+        out = StringIO()
+
+        call_command("refresh_analytics", "--reconcile", "--verify", stdout=out)
+
+        assert "削除記録 1件を削除しました" in out.getvalue()
+        assert ExpenseDeletion.objects.count() == 1
+        reset_snapshot()
+        assert len(get_snapshot(refresh=False)) == Expense.objects.count() == 3
+
+
+@pytest.mark.django_db
+class TestAnalyticsQueries:
+    def test_expense_trend_query(self, expenses):
+        """expenseTrendクエリをテスト"""
+        query = """
+            query {
+                expenseTrend(start: "2024-01-01", end: "2024-02-29", window: 1) {
+                    period total movingAverage delta
+                }
+            }
+        """
+        response = Client().post(
+            "/graphql/", data=json.dumps({"query": query}), content_type="application/json"
+        )
+
+        data = response.json()["data"]["expenseTrend"]
+        assert data[0] == {
+            "period": "2024-01-01",
+            "total": "1500.50",
+            "movingAverage": "1500.50",
+            "delta": None,
+        }
+        assert data[1]["delta"] == "499.50"
+
+    def test_category_percentiles_query(self, expenses):
+        """categoryPercentilesクエリをテスト"""
+        query = """
+            query {
+                categoryPercentiles(percentiles: [50]) {
+                    category { name } count total percentiles
+                }
+            }
+        """
+        response = Client().post(
+            "/graphql/", data=json.dumps({"query": query}), content_type="application/json"
+        )
+
+        data = {row["category"]["name"]: row for row in response.json()["data"]["categoryPercentiles"]}
+        assert data["会議費"] == {
+            "category": {"name": "会議費"},
+            "count": 2,
+            "total": "1700.50",
+            "percentiles": ["850.25"],
+        }
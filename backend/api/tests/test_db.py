@@ -0,0 +1,198 @@
+import threading
+import time
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from django.test import Client
+
+from api.db import pool as pool_module
+from api.db.pool import ConnectionPool, PoolTimeout
+from api.db.postgresql.base import DatabaseWrapper as PostgresWrapper
+from api.db.postgresql.base import reset_connection
+from api.db.sqlite3.base import DatabaseWrapper as SqliteWrapper
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def factory():
+        created.append(FakeConnection(len(created)))
+        return created[-1]
+
+    return ConnectionPool(factory, **kwargs), created
+
+
+class TestConnectionPool:
+    def test_reuses_returned_connections(self):
+        """返却した接続が次の貸し出しで再利用されることをテスト"""
+        pool, created = make_pool(max_size=2)
+
+        first = pool.getconn()
+        pool.putconn(first)
+        second = pool.getconn()
+
+        assert second is first
+        assert len(created) == 1
+        assert pool.stats()["checkouts"] == 2
+
+    def test_waits_for_a_connection_and_times_out(self):
+        """上限に達したら返却を待ち、期限を過ぎたらPoolTimeoutになることをテスト"""
+        pool, _ = make_pool(max_size=1, timeout=0.05)
+        conn = pool.getconn()
+
+        with pytest.raises(PoolTimeout):
+            pool.getconn()
+
+        threading.Timer(0.02, pool.putconn, args=(conn,)).start()
+        pool.timeout = 2
+        assert pool.getconn() is conn
+        stats = pool.stats()
+        assert stats["timeouts"] == 1
+        assert stats["waits"] == 2
+        assert stats["wait_ms_max"] >= 10
+        assert stats["saturation"] == 1.0
+
+    def test_health_check_discards_broken_connections(self):
+        """ヘルスチェックに失敗した接続は捨てて作り直すことをテスト"""
+        pool, created = make_pool(max_size=1, check=lambda conn: not conn.closed, check_after=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.closed = 1
+
+        replacement = pool.getconn()
+
+        assert replacement is not conn
+        assert len(created) == 2
+        assert pool.stats()["health_check_failures"] == 1
+
+    def test_failed_reset_closes_connection(self):
+        """返却時の片付けに失敗した接続は閉じて枠を空けることをテスト"""
+        pool, _ = make_pool(max_size=1, reset=lambda conn: False)
+        conn = pool.getconn()
+
+        pool.putconn(conn)
+
+        assert conn.closed
+        assert pool.stats()["size"] == 0
+
+    def test_threads_never_exceed_max_size(self):
+        """多数のスレッドから使っても接続数が上限を超えないことをテスト"""
+        pool, created = make_pool(max_size=3, timeout=5)
+
+        def work():
+            for _ in range(20):
+                conn = pool.getconn()
+                time.sleep(0.001)
+                pool.putconn(conn)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = pool.stats()
+        assert len(created) <= 3
+        assert stats["peak_in_use"] <= 3
+        assert stats["checkouts"] == 160
+        assert stats["in_use"] == 0
+
+    def test_pools_are_recreated_after_fork(self, monkeypatch):
+        """フォーク後の子プロセスでは親のプールを使わないことをテスト"""
+        monkeypatch.setattr(pool_module, "_pools", {})
+        parent = pool_module.get_pool(("default", ""), lambda: make_pool()[0])
+        monkeypatch.setattr(pool_module, "_pools_pid", -1)
+
+        child = pool_module.get_pool(("default", ""), lambda: make_pool()[0])
+
+        assert child is not parent
+
+
+class FakeInfo:
+    def __init__(self, status):
+        self.transaction_status = status
+
+
+class FakePgConnection(FakeConnection):
+    def __init__(self, status):
+        super().__init__(0)
+        self.info = FakeInfo(status)
+
+    def rollback(self):
+        self.info.transaction_status = 0
+
+
+class TestPostgresBackend:
+    def test_reset_rolls_back_open_transactions(self):
+        """返却時に未完了のトランザクションをロールバックすることをテスト"""
+        conn = FakePgConnection(status=2)
+
+        assert reset_connection(conn)
+        assert conn.info.transaction_status == 0
+        assert not reset_connection(FakePgConnection(status=4))
+
+    def test_pool_requires_conn_max_age_zero(self):
+        """接続プールとCONN_MAX_AGEの併用を設定エラーにすることをテスト"""
+        settings_dict = {
+            "ENGINE": "api.db.postgresql",
+            "NAME": "keihi",
+            "USER": "",
+            "PASSWORD": "",
+            "HOST": "",
+            "PORT": "",
+            "CONN_MAX_AGE": 60,
+            "OPTIONS": {"pool": {"max_size": 4}},
+        }
+        wrapper = PostgresWrapper(settings_dict, alias="pooled")
+
+        with pytest.raises(ImproperlyConfigured):
+            _ = wrapper.pool_options
+        settings_dict["CONN_MAX_AGE"] = 0
+        assert wrapper.pool_options["max_size"] == 4
+        assert "pool" not in wrapper.get_connection_params()
+
+
+class TestSqliteBackend:
+    def test_pragmas_are_applied(self, tmp_path):
+        """WAL・busy_timeout・mmapが接続ごとに設定されることをテスト"""
+        wrapper = SqliteWrapper(
+            {
+                "ENGINE": "api.db.sqlite3",
+                "NAME": str(tmp_path / "tuned.sqlite3"),
+                "OPTIONS": {"pragmas": {"busy_timeout": 1234}, "transaction_mode": "immediate"},
+            },
+            alias="tuned",
+        )
+        try:
+            conn = wrapper.get_new_connection(wrapper.get_connection_params())
+            pragmas = {
+                name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name in ("journal_mode", "busy_timeout", "synchronous")
+            }
+
+            assert pragmas == {"journal_mode": "wal", "busy_timeout": 1234, "synchronous": 1}
+            assert wrapper.transaction_mode == "IMMEDIATE"
+            conn.close()
+        finally:
+            wrapper.close()
+
+
+def test_db_metrics_view(settings):
+    """接続プールの計測値をJSONで返し、本番では匿名ユーザーに見せないことをテスト"""
+    settings.DEBUG = False
+    assert Client().get("/metrics/db/").status_code == 404
+
+    settings.DEBUG = True
+    response = Client().get("/metrics/db/")
+
+    assert response.status_code == 200
+    assert response.json()["databases"]["default"]["vendor"] == "sqlite"
@@ -0,0 +1,250 @@
+import json
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api import duplicates
+from api.duplicates import (
+    MERGE,
+    REJECT,
+    WARN,
+    DuplicateExpenseError,
+    create_expense,
+    duplicate_groups,
+    import_expenses,
+)
+from api.fingerprints import expense_fingerprint, normalize_description
+from api.models import Category, Expense, PaymentMethod
+
+
+@pytest.fixture
+def category():
+    return Category.objects.create(name="交通費")
+
+
+def expense_fields(category, description="新宿駅 電車代"):
+    return {
+        "date": date(2024, 12, 7),
+        "amount": Decimal("1500.00"),
+        "category": category,
+        "description": description,
+    }
+
+
+class TestFingerprint:
+    def test_normalize_description(self):
+        """全角・大文字・空白の違いが吸収されることをテスト"""
+        assert normalize_description("  ＪＲ　新宿駅\n電車代 ") == "jr 新宿駅 電車代"
+
+    def test_fingerprint_ignores_amount_formatting(self):
+        """金額の表記の違いで指紋が変わらないことをテスト"""
+        day = date(2024, 12, 7)
+        assert expense_fingerprint(day, "1500", None, "a") == expense_fingerprint(
+            day, Decimal("1500.00"), None, "A"
+        )
+        assert expense_fingerprint(day, "1500", None, "a") != expense_fingerprint(
+            day, "1501", None, "a"
+        )
+
+
+@pytest.mark.django_db
+class TestDuplicatePolicy:
+    def test_warn_creates_and_links_duplicates(self, category):
+        """warnでは登録され、重複の疑いを参照できることをテスト"""
+        first = create_expense(WARN, **expense_fields(category))
+        second = create_expense(WARN, **expense_fields(category, "新宿駅　電車代"))
+
+        assert first.pk != second.pk
+        assert list(second.find_duplicates()) == [first]
+
+    def test_reject_raises(self, category):
+        """rejectでは重複の登録が拒否されることをテスト"""
+        create_expense(REJECT, **expense_fields(category))
+
+        with pytest.raises(DuplicateExpenseError):
+            create_expense(REJECT, **expense_fields(category))
+        assert Expense.objects.count() == 1
+
+    def test_merge_returns_existing(self, category):
+        """mergeでは既存の経費が返されることをテスト"""
+        first = create_expense(MERGE, **expense_fields(category))
+        second = create_expense(MERGE, **expense_fields(category))
+
+        assert second.pk == first.pk
+        assert Expense.objects.count() == 1
+
+    def test_check_is_serialized_inside_the_transaction(self, category, monkeypatch):
+        """reject・mergeでは重複の確認より前に、同じトランザクション内でフィンガープリントをロックすることをテスト"""
+        locked = []
+
+        def record_lock(organization_id, fingerprints):
+            locked.append((organization_id, list(fingerprints), connection.in_atomic_block))
+
+        monkeypatch.setattr(duplicates, "lock_fingerprints", record_lock)
+        expense = create_expense(MERGE, **expense_fields(category))
+        create_expense(WARN, **expense_fields(category))
+        import_expenses([Expense(**expense_fields(category, "バス代"))], REJECT)
+
+        assert locked == [
+            (category.organization_id, [expense.fingerprint], True),
+            (
+                category.organization_id,
+                [expense_fingerprint(date(2024, 12, 7), Decimal("1500.00"), None, "バス代")],
+                True,
+            ),
+        ]
+
+    def test_import_skips_existing_and_in_batch_duplicates(self, category):
+        """一括取り込みで既存・取り込み内の重複が除外されることをテスト"""
+        existing = create_expense(WARN, **expense_fields(category))
+        rows = [
+            Expense(**expense_fields(category)),
+            Expense(**expense_fields(category, "バス代")),
+            Expense(**expense_fields(category, "バス代")),
+        ]
+
+        result = import_expenses(rows, MERGE)
+
+        assert len(result.created) == 1
+        assert [duplicate for _, duplicate in result.skipped] == [existing, rows[1]]
+        assert Expense.objects.count() == 2
+        assert not Category.drifted().exists()
+
+    def test_import_command(self, category, tmp_path):
+        """CSVの取り込みコマンドが重複ポリシーに従ってバッチごとに登録することをテスト"""
+        PaymentMethod.objects.create(name="現金", code="cash")
+        create_expense(WARN, **expense_fields(category))
+        path = tmp_path / "expenses.csv"
+        path.write_text(
+            "date,amount,category,payment,description\n"
+            "2024-12-07,1500,交通費,,新宿駅 電車代\n"
+            "2024-12-07,1500,交通費,cash,バス代\n"
+            "2024-12-07,1500,交通費,cash,バス代\n",
+            encoding="utf-8",
+        )
+        out = StringIO()
+
+        call_command(
+            "import_expenses", str(path), "--policy", "merge", "--batch-size", "1", stdout=out
+        )
+
+        assert "1件を登録しました（重複のため登録しなかった経費 2件）" in out.getvalue()
+        assert Expense.objects.filter(payment__code="cash").count() == 1
+        assert not Category.drifted().exists()
+        with pytest.raises(CommandError, match="重複の疑い"):
+            call_command("import_expenses", str(path), "--policy", "reject", stdout=out)
+
+    def test_duplicate_groups(self, category):
+        """重複グループが件数の多い順に返ることをテスト"""
+        for _ in range(3):
+            create_expense(WARN, **expense_fields(category))
+        for _ in range(2):
+            create_expense(WARN, **expense_fields(category, "バス代"))
+        create_expense(WARN, **expense_fields(category, "タクシー代"))
+
+        groups = duplicate_groups()
+
+        assert [count for _, count, _ in groups] == [3, 2]
+        assert all(len(expenses) == count for _, count, expenses in groups)
+
+
+@pytest.mark.django_db
+class TestDuplicateGraphQL:
+    def test_reject_policy_returns_error(self, category):
+        """createExpenseでrejectを指定すると重複がエラーになることをテスト"""
+        create_expense(WARN, **expense_fields(category))
+        query = """
+            mutation($input: ExpenseInput!) {
+                createExpense(input: $input, duplicatePolicy: REJECT) { id }
+            }
+        """
+        variables = {
+            "input": {
+                "date": "2024-12-07",
+                "amount": "1500.00",
+                "categoryId": str(category.id),
+                "description": "新宿駅 電車代",
+            }
+        }
+
+        response = Client().post(
+            "/graphql/",
+            data=json.dumps({"query": query, "variables": variables}),
+            content_type="application/json",
+        )
+
+        assert "重複" in response.json()["errors"][0]["message"]
+
+    def test_duplicates_query(self, category):
+        """duplicatesクエリで重複グループが取得できることをテスト"""
+        create_expense(WARN, **expense_fields(category))
+        create_expense(WARN, **expense_fields(category))
+        query = "{ duplicates { count expenses { description duplicates { id } } } }"
+
+        response = Client().post(
+            "/graphql/", data=json.dumps({"query": query}), content_type="application/json"
+        )
+
+        groups = response.json()["data"]["duplicates"]
+        assert groups[0]["count"] == 2
+        assert len(groups[0]["expenses"][0]["duplicates"]) == 1
+
+    def test_expense_duplicates_are_batched(self, category):
+        """経費一覧の duplicates がフィンガープリントごとの1回の問い合わせにまとまることをテスト"""
+        for description in ("電車代", "バス代", "タクシー代"):
+            create_expense(WARN, **expense_fields(category, description))
+            create_expense(WARN, **expense_fields(category, description))
+        create_expense(WARN, **expense_fields(category, "新幹線"))
+        query = "{ expenses { description duplicates { description } } }"
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = Client().post(
+                "/graphql/", data=json.dumps({"query": query}), content_type="application/json"
+            )
+
+        expenses = response.json()["data"]["expenses"]
+        assert len(expenses) == 7
+        for expense in expenses:
+            expected = [] if expense["description"] == "新幹線" else [expense["description"]]
+            assert [d["description"] for d in expense["duplicates"]] == expected
+        lookups = [q for q in ctx.captured_queries if '"fingerprint" IN' in q["sql"]]
+        assert len(lookups) == 1
+
+    def test_duplicates_are_reloaded_after_writes_in_a_batch(self, category):
+        """バッチ内で経費を登録した後のオペレーションには新しい重複が含まれることをテスト"""
+        first = create_expense(WARN, **expense_fields(category))
+        query = {
+            "query": "query($id: ID!) { expense(id: $id) { duplicates { id } } }",
+            "variables": {"id": str(first.id)},
+        }
+        mutation = {
+            "query": """
+                mutation($input: ExpenseInput!) {
+                    createExpense(input: $input, duplicatePolicy: WARN) { id }
+                }
+            """,
+            "variables": {
+                "input": {
+                    "date": "2024-12-07",
+                    "amount": "1500.00",
+                    "categoryId": str(category.id),
+                    "description": "新宿駅 電車代",
+                }
+            },
+        }
+
+        response = Client().post(
+            "/graphql/", data=json.dumps([query, mutation, query]), content_type="application/json"
+        )
+
+        before, created, after = response.json()
+        assert before["data"]["expense"]["duplicates"] == []
+        assert after["data"]["expense"]["duplicates"] == [
+            {"id": created["data"]["createExpense"]["id"]}
+        ]
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Category
+
+
+def post_graphql(client, payload):
+    return client.post("/graphql/", data=json.dumps(payload), content_type="application/json")
+
+
+@pytest.mark.django_db
+class TestGraphQLBatch:
+    def test_batch_returns_array_of_results(self):
+        """オペレーションの配列を送ると結果の配列が返ることをテスト"""
+        Category.objects.create(name="交通費")
+        response = post_graphql(
+            Client(),
+            [
+                {"query": "{ hello }"},
+                {"query": "{ categories { name } }"},
+            ],
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert isinstance(body, list)
+        assert body[0]["data"] == {"hello": "Hello from Keihi GraphQL API"}
+        assert body[1]["data"] == {"categories": [{"name": "交通費"}]}
+
+    def test_batch_reports_errors_per_operation(self):
+        """1つのオペレーションのエラーが他の結果に影響しないことをテスト"""
+        response = post_graphql(
+            Client(),
+            [
+                {"query": "{ unknownField }"},
+                {"query": "{ hello }"},
+            ],
+        )
+
+        body = response.json()
+        assert "errors" in body[0]
+        assert body[1]["data"] == {"hello": "Hello from Keihi GraphQL API"}
+        assert "errors" not in body[1]
+
+    def test_batch_shares_request_cache(self):
+        """バッチ内の同じカテゴリー取得がリクエストスコープでキャッシュされることをテスト"""
+        category = Category.objects.create(name="会議費")
+        query = {
+            "query": "query($id: ID!) { category(id: $id) { name } }",
+            "variables": {"id": str(category.id)},
+        }
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = post_graphql(Client(), [query, query, query])
+
+        body = response.json()
+        assert [r["data"]["category"]["name"] for r in body] == ["会議費"] * 3
+        assert len([q for q in ctx.captured_queries if "api_category" in q["sql"]]) == 1
+
+    def test_expense_writes_clear_the_category_cache(self):
+        """バッチ内で経費を登録した後のカテゴリー取得には新しいカウンターが返ることをテスト"""
+        category = Category.objects.create(name="会議費")
+        query = {
+            "query": "query($id: ID!) { category(id: $id) { expenseCount } }",
+            "variables": {"id": str(category.id)},
+        }
+        mutation = {
+            "query": """
+                mutation($input: ExpenseInput!) { createExpense(input: $input) { id } }
+            """,
+            "variables": {
+                "input": {
+                    "date": "2024-12-07",
+                    "amount": "10.00",
+                    "categoryId": str(category.id),
+                    "description": "お茶代",
+                }
+            },
+        }
+
+        body = post_graphql(Client(), [query, mutation, query]).json()
+
+        assert body[0]["data"]["category"] == {"expenseCount": 0}
+        assert body[2]["data"]["category"] == {"expenseCount": 1}
+
+    def test_batch_too_many_operations(self):
+        """上限を超えるバッチが拒否されることをテスト"""
+        payload = [{"query": "{ hello }"}] * 11
+        response = post_graphql(Client(), payload)
+
+        assert response.status_code == 400
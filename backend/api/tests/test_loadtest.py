@@ -0,0 +1,105 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.test import Client
+
+from api.loadtest import (
+    OperationStats,
+    StepResult,
+    execute,
+    percentile,
+    saturation_point,
+    seed,
+)
+from api.management.commands import loadtest
+from api.models import Expense
+
+
+def make_step(concurrency, count, errors=0, duration=1.0):
+    return StepResult(
+        concurrency, duration, {"expenses": OperationStats(count=count, errors=errors)}
+    )
+
+
+def client_transport():
+    client = Client()
+
+    def send(query, variables=None):
+        response = client.post(
+            "/graphql/",
+            data=json.dumps({"query": query, "variables": variables or {}}),
+            content_type="application/json",
+        )
+        return response.json() if response.status_code == 200 else None
+
+    return send
+
+
+class TestStatistics:
+    def test_percentile(self):
+        """最近傍順位法のパーセンタイルをテスト"""
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 99) == 99
+        assert percentile([], 50) == 0.0
+
+    def test_saturation_point_stops_when_throughput_flattens(self):
+        """スループットの伸びが止まった直前の段階を飽和点とすることをテスト"""
+        steps = [make_step(1, 100), make_step(2, 190), make_step(4, 200), make_step(8, 205)]
+
+        assert saturation_point(steps).concurrency == 4
+
+    def test_saturation_point_ignores_failing_steps(self):
+        """エラー率が上限を超えた段階は飽和点にしないことをテスト"""
+        steps = [make_step(1, 100), make_step(2, 300, errors=30)]
+
+        assert saturation_point(steps).concurrency == 1
+
+
+@pytest.mark.django_db
+class TestOperations:
+    def test_seed_and_execute_mix(self):
+        """実際のスキーマに対して全オペレーションが成功することをテスト"""
+        send = client_transport()
+        state = seed(send, categories=2, expenses=3)
+        rng = random.Random(0)
+
+        results = [
+            execute(name, send, state, rng)
+            for name in ("expenses", "categories", "expense", "updateExpense", "deleteExpense")
+        ]
+
+        assert all(ok for _, ok in results), results
+        assert Expense.objects.count() == 2
+        assert len(state.expense_ids) == 2
+
+
+class TestCommand:
+    def test_url_requires_allow_writes(self):
+        """起動済みのサーバーへの書き込みは --allow-writes なしでは拒否されることをテスト"""
+        with pytest.raises(CommandError, match="--allow-writes"):
+            call_command("loadtest", url="http://127.0.0.1:1/graphql/")
+
+    def test_started_server_uses_temporary_database(self, monkeypatch):
+        """起動するサーバーが一時的なSQLiteデータベースを使い、終了後に削除されることをテスト"""
+        envs = []
+
+        def start_server(command, options, env):
+            envs.append(env)
+            raise CommandError("停止")
+
+        monkeypatch.setattr(loadtest.Command, "_migrate", lambda command, env: envs.append(env))
+        monkeypatch.setattr(loadtest.Command, "_start_server", start_server)
+
+        with pytest.raises(CommandError, match="停止"):
+            call_command("loadtest")
+
+        migrate_env, server_env = envs
+        assert migrate_env is server_env
+        assert server_env["DB_ENGINE"] == "api.db.sqlite3"
+        assert "keihi-loadtest-" in server_env["DB_NAME"]
+        assert not Path(server_env["DB_NAME"]).parent.exists()
@@ -1,6 +1,8 @@
 import pytest
 from decimal import Decimal
 from datetime import date
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from api.models import Category, Expense, Receipt, PaymentMethod
 
 
@@ -253,3 +255,104 @@ class TestPaymentMethodModel:
 
         with pytest.raises(Exception):  # ProtectedError
             payment_method.delete()
+
+
+@pytest.mark.django_db
+class TestUsageCounters:
+    def test_counters_follow_expense_writes(self):
+        """作成・更新（カテゴリー移動）・削除でカウンターが更新されることをテスト"""
+        transport = Category.objects.create(name="交通費")
+        meeting = Category.objects.create(name="会議費")
+        cash = PaymentMethod.objects.create(name="現金", code="cash")
+
+        expense = Expense.objects.create(
+            date=date(2024, 12, 7),
+            amount=Decimal("1500.00"),
+            category=transport,
+            payment=cash,
+            description="電車代",
+        )
+        Expense.objects.create(
+            date=date(2024, 12, 1),
+            amount=Decimal("500.00"),
+            category=transport,
+            description="バス代",
+        )
+        transport.refresh_from_db()
+        cash.refresh_from_db()
+        assert (transport.expense_count, transport.total_amount) == (2, Decimal("2000.00"))
+        assert transport.last_used_on == date(2024, 12, 7)
+        assert (cash.expense_count, cash.total_amount) == (1, Decimal("1500.00"))
+
+        expense.category = meeting
+        expense.amount = Decimal("1800.00")
+        expense.save()
+        transport.refresh_from_db()
+        meeting.refresh_from_db()
+        assert (transport.expense_count, transport.total_amount) == (1, Decimal("500.00"))
+        assert transport.last_used_on == date(2024, 12, 1)
+        assert (meeting.expense_count, meeting.total_amount) == (1, Decimal("1800.00"))
+
+        expense.delete()
+        meeting.refresh_from_db()
+        cash.refresh_from_db()
+        assert (meeting.expense_count, meeting.total_amount) == (0, Decimal("0.00"))
+        assert meeting.last_used_on is None
+        assert cash.expense_count == 0
+
+    def test_additions_keep_the_latest_date_without_a_subquery(self):
+        """追加では最終利用日を取り直さず、既存の日付との大きい方を残すことをテスト"""
+        category = Category.objects.create(name="交通費")
+        for day in (7, 3):
+            with CaptureQueriesContext(connection) as ctx:
+                Expense.objects.create(
+                    date=date(2024, 12, day),
+                    amount=Decimal("100.00"),
+                    category=category,
+                    description="電車代",
+                )
+            update = next(q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE"))
+            assert "SELECT" not in update
+
+        category.refresh_from_db()
+        assert category.last_used_on == date(2024, 12, 7)
+        assert (category.expense_count, category.total_amount) == (2, Decimal("200.00"))
+        assert not Category.drifted().exists()
+
+    def test_delete_uses_the_current_row(self):
+        """古いインスタンスから削除しても、DBの現在の行の分だけカウンターを減らすことをテスト"""
+        category = Category.objects.create(name="交通費")
+        stale = Expense.objects.create(
+            date=date(2024, 12, 7),
+            amount=Decimal("1500.00"),
+            category=category,
+            description="電車代",
+        )
+        current = Expense.objects.get(pk=stale.pk)
+        current.amount = Decimal("1800.00")
+        current.save()
+
+        stale.delete()
+        current.delete()
+
+        category.refresh_from_db()
+        assert (category.expense_count, category.total_amount) == (0, Decimal("0.00"))
+
+    def test_drift_detection_and_recount(self):
+        """カウンターのずれを検出し、集計し直せることをテスト"""
+        category = Category.objects.create(name="交通費")
+        Expense.objects.create(
+            date=date(2024, 12, 7),
+            amount=Decimal("1500.00"),
+            category=category,
+            description="電車代",
+        )
+        Category.objects.update(expense_count=5, total_amount=Decimal("0"))
+
+        assert list(Category.drifted()) == [category]
+
+        Category.recount_usage()
+
+        category.refresh_from_db()
+        assert (category.expense_count, category.total_amount) == (1, Decimal("1500.00"))
+        assert not Category.drifted().exists()
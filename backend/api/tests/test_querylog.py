@@ -0,0 +1,146 @@
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client
+
+from api.models import Category, SlowQuery
+from api.querylog import SlowQueryRecorder, normalize_sql, sql_fingerprint
+
+
+@pytest.fixture
+def log_every_query(settings):
+    settings.SLOW_QUERY_LOG = {
+        "ENABLED": True,
+        "THRESHOLD_MS": 0,
+        "EXPLAIN_SAMPLE_RATE": 1.0,
+        "EXPLAIN_ANALYZE": False,
+    }
+
+
+class TestNormalizeSql:
+    def test_literals_and_in_lists_are_collapsed(self):
+        """リテラルとINリストの長さの違いが同じフィンガープリントになることをテスト"""
+        a = "SELECT * FROM api_expense WHERE amount > 100 AND id IN (%s, %s, %s)"
+        b = "SELECT *  FROM api_expense\nWHERE amount > 2500 AND id IN (%s)"
+
+        assert normalize_sql(a) == "SELECT * FROM api_expense WHERE amount > ? AND id IN (...)"
+        assert sql_fingerprint(a) == sql_fingerprint(b)
+
+    def test_string_literals(self):
+        """文字列リテラルが置き換えられることをテスト"""
+        assert normalize_sql("SELECT 1 WHERE name = 'it''s'") == "SELECT ? WHERE name = ?"
+
+
+@pytest.mark.django_db
+class TestSlowQueryLog:
+    def test_records_graphql_origin_and_plan(self, log_every_query):
+        """GraphQLのオペレーション名・リゾルバー・実行計画が記録されることをテスト"""
+        Category.objects.create(name="交通費")
+
+        Client().post(
+            "/graphql/",
+            data=json.dumps({"query": "query CategoryList { categories { name } }"}),
+            content_type="application/json",
+        )
+
+        recorded = SlowQuery.objects.get(statement__contains='FROM "api_category"')
+        assert recorded.operation == "CategoryList"
+        assert recorded.resolver == "Query.categories"
+        assert recorded.calls == 1
+        assert recorded.explain
+
+    def test_explain_analyze_falls_back_when_unsupported(self, log_every_query, settings):
+        """ANALYZE に対応しないDBでも通常のEXPLAINで記録し、クエリは失敗しないことをテスト"""
+        settings.SLOW_QUERY_LOG = {**settings.SLOW_QUERY_LOG, "EXPLAIN_ANALYZE": True}
+        Category.objects.create(name="交通費")
+
+        response = Client().post(
+            "/graphql/",
+            data=json.dumps({"query": "{ categories { name } }"}),
+            content_type="application/json",
+        )
+
+        assert response.json() == {"data": {"categories": [{"name": "交通費"}]}}
+        assert SlowQuery.objects.get(resolver="Query.categories").explain
+
+    def test_recorder_errors_do_not_fail_queries(self, log_every_query, monkeypatch):
+        """記録中の予期しない例外がアプリケーションのクエリに伝わらないことをテスト"""
+        Category.objects.create(name="交通費")
+
+        def broken(*args, **kwargs):
+            raise RuntimeError("recorder bug")
+
+        monkeypatch.setattr(SlowQuery, "record", broken)
+        response = Client().post(
+            "/graphql/",
+            data=json.dumps({"query": "{ categories { name } }"}),
+            content_type="application/json",
+        )
+
+        assert response.json() == {"data": {"categories": [{"name": "交通費"}]}}
+
+    def test_records_are_written_outside_the_request_transaction(self, log_every_query):
+        """ロールバックされたトランザクション内の遅いクエリも、後から書き込まれることをテスト"""
+        recorder = SlowQueryRecorder()
+        with (
+            connection.execute_wrapper(recorder),
+            pytest.raises(RuntimeError),
+            transaction.atomic(),
+        ):
+            Category.objects.count()
+            assert not SlowQuery.objects.exists()
+            raise RuntimeError("rollback")
+
+        recorder.flush()
+
+        assert SlowQuery.objects.filter(statement__contains='FROM "api_category"').exists()
+        assert recorder.pending == []
+
+    def test_repeated_statements_are_grouped(self, log_every_query):
+        """同じ形のクエリが1行に集計されることをテスト"""
+        category = Category.objects.create(name="交通費")
+        client = Client()
+        for _ in range(3):
+            client.post(
+                "/graphql/",
+                data=json.dumps(
+                    {
+                        "query": "query($id: ID!) { category(id: $id) { name } }",
+                        "variables": {"id": str(category.id)},
+                    }
+                ),
+                content_type="application/json",
+            )
+
+        recorded = SlowQuery.objects.get(resolver="Query.category")
+        assert recorded.calls == 3
+        assert recorded.total_time_ms >= recorded.max_time_ms
+
+    def test_disabled_below_threshold(self, settings):
+        """しきい値未満のクエリは記録されないことをテスト"""
+        settings.SLOW_QUERY_LOG = {**settings.SLOW_QUERY_LOG, "THRESHOLD_MS": 60_000}
+
+        Client().post(
+            "/graphql/",
+            data=json.dumps({"query": "{ categories { name } }"}),
+            content_type="application/json",
+        )
+
+        assert not SlowQuery.objects.exists()
+
+    def test_command_lists_top_offenders(self, log_every_query):
+        """管理コマンドが合計時間の順に表示することをテスト"""
+        Client().post(
+            "/graphql/",
+            data=json.dumps({"query": "query CategoryList { categories { name } }"}),
+            content_type="application/json",
+        )
+        out = StringIO()
+
+        call_command("slow_queries", "--explain", stdout=out)
+
+        assert "#1 合計" in out.getvalue()
+        assert "CategoryList / Query.categories" in out.getvalue()
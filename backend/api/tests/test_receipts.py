@@ -0,0 +1,273 @@
+import datetime
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+
+from api import receipts
+from api.extraction import EXTRACTOR_VERSION, ExtractionResult, extract, parse_amount, parse_date
+from api.models import Category, Expense, Receipt
+from api.receipt_status import DONE, FAILED, PENDING, UNSUPPORTED
+from api.receipts import process_receipts, receipts_to_process, recheck_mismatches
+
+RECEIPT_TEXT = """ファミリーマート
+2024年５月１日(水) 12:30
+おにぎり ￥150
+小計 ￥280
+合計 ￥302
+お預り ￥1,000
+お釣 ￥698
+"""
+
+
+def write_pdf(path, lines):
+    """Helvetica で lines を書いた1ページのPDFを作る"""
+    text = " ".join(f"({line}) Tj 0 -14 Td" for line in lines)
+    content = f"BT /F1 12 Tf 72 720 Td {text} ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>"
+        ),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+    ]
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(data)
+
+
+def write_jpeg(path, taken_at):
+    image = Image.new("RGB", (16, 16), "white")
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9003] = taken_at
+    image.save(path, exif=exif)
+
+
+@pytest.fixture
+def receipt_root(settings, tmp_path):
+    settings.RECEIPT_EXTRACTION = {
+        **settings.RECEIPT_EXTRACTION,
+        "ROOT": tmp_path,
+        "TESSERACT_CMD": "keihi-no-such-ocr-engine",
+        "BATCH_SIZE": 2,
+    }
+    return tmp_path
+
+
+@pytest.fixture
+def expense():
+    category = Category.objects.create(name="交通費")
+    return Expense.objects.create(
+        date=datetime.date(2024, 5, 1),
+        amount=Decimal("1234.00"),
+        category=category,
+        description="タクシー",
+    )
+
+
+def make_receipt(expense, file_name):
+    return Receipt.objects.create(
+        expense=expense, file_name=file_name, file_path=file_name, file_size=1
+    )
+
+
+class TestParsing:
+    def test_total_line_wins_over_other_amounts(self):
+        """小計・お預りではなく合計の金額と最初の日付を読み取ることをテスト"""
+        assert parse_amount(RECEIPT_TEXT) == Decimal("302.00")
+        assert parse_date(RECEIPT_TEXT) == datetime.date(2024, 5, 1)
+
+    def test_amount_variants(self):
+        """金額が次の行にある場合・「円」表記・件数の行を区別することをテスト"""
+        assert parse_amount("TOTAL\n1,234\n") == Decimal("1234.00")
+        assert parse_amount("合計点数 3点\n合計 3,300円") == Decimal("3300.00")
+        assert parse_amount("ランチ 1,200円\nドリンク 300円") == Decimal("1200.00")
+        assert parse_amount("ありがとうございました") is None
+
+    def test_japanese_era_dates(self):
+        """令和の日付を西暦に変換することをテスト"""
+        assert parse_date("令和6年1月5日") == datetime.date(2024, 1, 5)
+        assert parse_date("令和元年5月1日") == datetime.date(2019, 5, 1)
+        assert parse_date("R6.01.05") == datetime.date(2024, 1, 5)
+
+
+class TestExtract:
+    def test_pdf_text(self, tmp_path):
+        """PDFの埋め込みテキストから日付と金額を読み取ることをテスト"""
+        path = tmp_path / "r.pdf"
+        write_pdf(path, ["Taxi 2024/05/01", "Subtotal 1,000", "Total 1,234"])
+
+        result = extract(path)
+
+        assert result.status == DONE
+        assert result.sources == ["pdf_text"]
+        assert result.date == datetime.date(2024, 5, 1)
+        assert result.amount == Decimal("1234.00")
+
+    def test_image_exif(self, tmp_path):
+        """画像のEXIFから撮影日時を読み取ることをテスト"""
+        path = tmp_path / "r.jpg"
+        write_jpeg(path, "2024:05:02 09:15:00")
+
+        result = extract(path, {"tesseract_cmd": "keihi-no-such-ocr-engine"})
+
+        assert result.status == DONE
+        assert result.captured_at == datetime.datetime(2024, 5, 2, 9, 15)
+        assert result.sources == ["exif"]
+
+    def test_unsupported_and_missing_files(self, tmp_path):
+        """PDFでも画像でもないファイルは対象外、読めないファイルは失敗になることをテスト"""
+        path = tmp_path / "r.txt"
+        path.write_text("not a receipt")
+
+        assert extract(path).status == UNSUPPORTED
+        assert extract(tmp_path / "missing.pdf").status == FAILED
+
+
+@pytest.mark.django_db
+class TestPipeline:
+    def test_stores_results_and_flags_mismatches(self, receipt_root, expense):
+        """抽出結果を保存し、経費と金額・日付が合わないものに印を付けることをテスト"""
+        write_pdf(receipt_root / "match.pdf", ["2024/05/01", "Total 1,234"])
+        write_pdf(receipt_root / "wrong.pdf", ["2024/05/03", "Total 1,243"])
+        write_jpeg(receipt_root / "late.jpg", "2024:06:20 10:00:00")
+        other = Expense.objects.create(
+            date=expense.date, amount=expense.amount, category=expense.category, description="b"
+        )
+        third = Expense.objects.create(
+            date=expense.date, amount=expense.amount, category=expense.category, description="c"
+        )
+        match = make_receipt(expense, "match.pdf")
+        wrong = make_receipt(other, "wrong.pdf")
+        late = make_receipt(third, "late.jpg")
+        missing = make_receipt(None, "missing.pdf")
+
+        summary = process_receipts(Receipt.objects.all(), workers=0)
+
+        assert (summary.processed, summary.done, summary.failed, summary.mismatched) == (4, 3, 1, 2)
+        match.refresh_from_db()
+        assert match.extraction_status == DONE
+        assert match.extractor_version == EXTRACTOR_VERSION
+        assert match.extracted_amount == Decimal("1234.00")
+        assert not match.amount_mismatch and not match.date_mismatch
+        wrong.refresh_from_db()
+        assert wrong.amount_mismatch and wrong.date_mismatch
+        late.refresh_from_db()
+        assert late.date_mismatch and not late.amount_mismatch
+        missing.refresh_from_db()
+        assert missing.extraction_status == FAILED
+        assert missing.extraction_error
+
+    def test_batch_skips_current_results_and_filters_by_year(self, receipt_root, expense):
+        """現在の版で抽出済みの領収書は飛ばし、年で絞り込めることをテスト"""
+        write_pdf(receipt_root / "r.pdf", ["Total 1,234"])
+        receipt = make_receipt(expense, "r.pdf")
+        process_receipts(Receipt.objects.all(), workers=0)
+
+        assert not receipts_to_process().exists()
+        assert receipts_to_process(year=2024, force=True).get() == receipt
+        assert not receipts_to_process(year=2023, force=True).exists()
+
+        Receipt.objects.update(extractor_version=EXTRACTOR_VERSION - 1)
+        assert receipts_to_process().get() == receipt
+
+    def test_recheck_after_expense_edit(self, receipt_root, expense):
+        """経費を直した後に抽出し直さずに不一致を解消できることをテスト"""
+        write_pdf(receipt_root / "r.pdf", ["2024/05/01", "Total 1,300"])
+        receipt = make_receipt(expense, "r.pdf")
+        process_receipts(Receipt.objects.all(), workers=0)
+        Expense.objects.filter(pk=expense.pk).update(amount=Decimal("1300.00"))
+
+        assert recheck_mismatches(Receipt.objects.all()) == 0
+        receipt.refresh_from_db()
+        assert not receipt.amount_mismatch
+
+    def test_process_pool_command(self, receipt_root, expense):
+        """管理コマンドがワーカープロセスで抽出することをテスト"""
+        expenses = [expense] + [
+            Expense.objects.create(
+                date=expense.date,
+                amount=expense.amount,
+                category=expense.category,
+                description=name,
+            )
+            for name in ("b", "c")
+        ]
+        for i, linked in enumerate(expenses):
+            write_pdf(receipt_root / f"r{i}.pdf", ["2024/05/01", "Total 1,234"])
+            make_receipt(linked, f"r{i}.pdf")
+        out = StringIO()
+
+        call_command("extract_receipts", "--year", "2024", "--workers", "2", stdout=out)
+
+        assert "3件を" in out.getvalue()
+        assert Receipt.objects.filter(extraction_status=DONE, amount_mismatch=False).count() == 3
+
+    def test_admin_extract_action(self, admin_client, receipt_root, expense):
+        """管理画面のアクションは再抽出の対象にするだけで、抽出はバッチで行うことをテスト"""
+        write_pdf(receipt_root / "r.pdf", ["2024/05/01", "Total 999"])
+        receipt = make_receipt(expense, "r.pdf")
+        process_receipts(Receipt.objects.all(), workers=0)
+        url = reverse("admin:api_receipt_changelist")
+
+        response = admin_client.post(
+            url, {"action": "extract_metadata", "_selected_action": [str(receipt.id)]}
+        )
+
+        assert response.status_code == 302
+        receipt.refresh_from_db()
+        assert receipt.extraction_status == PENDING
+        assert receipts_to_process().get() == receipt
+
+        call_command("extract_receipts", "--workers", "0", stdout=StringIO())
+        response = admin_client.get(url, {"amount_mismatch__exact": "1"})
+        assert response.context["cl"].result_count == 1
+
+    def test_broken_pool_keeps_completed_results(self, settings, monkeypatch):
+        """ワーカーの異常終了と同時に完了した結果は失敗にせず返すことをテスト"""
+        outcomes = {
+            1: ExtractionResult.failure("正常に完了した結果"),
+            2: BrokenProcessPool(),
+            3: BrokenProcessPool(),
+        }
+
+        class Executor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def submit(self, function, receipt_id, path, options):
+                future = Future()
+                outcome = outcomes[receipt_id]
+                if isinstance(outcome, BaseException):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result((receipt_id, outcome))
+                return future
+
+        monkeypatch.setattr(receipts, "_executor", lambda workers, config: Executor())
+
+        results = dict(receipts._run_in_pool([(i, f"{i}.pdf") for i in outcomes], 1, {}))
+
+        assert results[1].error == "正常に完了した結果"
+        assert results[2].error == results[3].error == "ワーカープロセスが異常終了しました"
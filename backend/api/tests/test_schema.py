@@ -0,0 +1,72 @@
+import json
+
+import pytest
+from django.test import Client
+
+from api.models import Category, PaymentMethod
+
+
+def execute(query, variables=None):
+    response = Client().post(
+        "/graphql/",
+        data=json.dumps({"query": query, "variables": variables or {}}),
+        content_type="application/json",
+    )
+    body = response.json()
+    assert "errors" not in body, body
+    return body["data"]
+
+
+CREATE_EXPENSE = """
+    mutation($input: ExpenseInput!) {
+        createExpense(input: $input) { id payment { code } }
+    }
+"""
+
+UPDATE_EXPENSE = """
+    mutation($id: ID!, $input: ExpenseInput!) {
+        updateExpense(id: $id, input: $input) { id category { name } }
+    }
+"""
+
+CATEGORIES = """
+    query { categories { name expenseCount totalAmount lastUsedOn } }
+"""
+
+
+@pytest.mark.django_db
+class TestExpenseMutations:
+    def test_usage_counters_follow_mutations(self):
+        """createExpense・updateExpenseでカテゴリーのカウンターが更新されることをテスト"""
+        transport = Category.objects.create(name="交通費")
+        meeting = Category.objects.create(name="会議費")
+        cash = PaymentMethod.objects.create(name="現金", code="cash")
+        expense_input = {
+            "date": "2024-12-07",
+            "amount": "1500.00",
+            "categoryId": str(transport.id),
+            "description": "電車代",
+            "paymentId": str(cash.id),
+        }
+
+        created = execute(CREATE_EXPENSE, {"input": expense_input})["createExpense"]
+        assert created["payment"] == {"code": "cash"}
+
+        execute(
+            UPDATE_EXPENSE,
+            {"id": created["id"], "input": {**expense_input, "categoryId": str(meeting.id)}},
+        )
+
+        categories = {c["name"]: c for c in execute(CATEGORIES)["categories"]}
+        assert categories["交通費"] == {
+            "name": "交通費",
+            "expenseCount": 0,
+            "totalAmount": "0.00",
+            "lastUsedOn": None,
+        }
+        assert categories["会議費"] == {
+            "name": "会議費",
+            "expenseCount": 1,
+            "totalAmount": "1500.00",
+            "lastUsedOn": "2024-12-07",
+        }
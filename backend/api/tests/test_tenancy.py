@@ -0,0 +1,231 @@
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+import pytest
+from django.db.models import ForeignKey
+from django.test import Client
+
+from api import analytics
+from api.analytics import get_snapshot, reset_snapshot, snapshot_path
+from api.models import Category, Expense, Organization, PaymentMethod, Team, TenantModel
+from api.tenancy import (
+    DEFAULT_ORGANIZATION_ID,
+    TenantMismatch,
+    TenantRequired,
+    tenant_context,
+)
+
+CATEGORIES = "query { categories { name } }"
+
+CREATE_EXPENSE = """
+    mutation($input: ExpenseInput!) {
+        createExpense(input: $input) { id team { name } }
+    }
+"""
+
+
+def graphql(query, variables=None, organization=None, user=None):
+    headers = {"HTTP_X_ORGANIZATION_ID": str(organization)} if organization else {}
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    return client.post(
+        "/graphql/",
+        data=json.dumps({"query": query, "variables": variables or {}}),
+        content_type="application/json",
+        **headers,
+    )
+
+
+def add_expense(category, amount="1000.00", **fields):
+    return Expense.objects.create(
+        date=fields.pop("date", datetime.date(2024, 5, 1)),
+        amount=Decimal(amount),
+        category=category,
+        description=fields.pop("description", "タクシー"),
+        **fields,
+    )
+
+
+@pytest.fixture
+def other():
+    return Organization.objects.create(name="別の組織")
+
+
+@pytest.mark.django_db
+class TestTenantManager:
+    def test_queries_require_a_tenant(self):
+        """組織が設定されていなければ絞り込みのない問い合わせができないことをテスト"""
+        with tenant_context(None):
+            with pytest.raises(TenantRequired):
+                Expense.objects.count()
+            with pytest.raises(TenantRequired):
+                Category(name="交通費").save()
+            assert Expense.unscoped.count() == 0
+
+    def test_rows_are_isolated_per_tenant(self, other):
+        """他の組織の行は見えず、同じ名前・コードも組織ごとに登録できることをテスト"""
+        mine = Category.objects.create(name="交通費")
+        add_expense(mine)
+        with tenant_context(other):
+            theirs = Category.objects.create(name="交通費")
+            PaymentMethod.objects.create(name="現金", code="cash")
+            add_expense(theirs, "2000.00")
+            assert list(Category.objects.all()) == [theirs]
+            assert not Category.objects.filter(pk=mine.pk).exists()
+            assert Expense.objects.get().amount == Decimal("2000.00")
+
+        assert theirs.organization_id == other.pk
+        assert list(Category.objects.all()) == [mine]
+        assert Expense.objects.get().amount == Decimal("1000.00")
+        assert not PaymentMethod.objects.exists()
+        assert Expense.objects.for_tenant(other).count() == 1
+
+    def test_bulk_create_assigns_the_tenant(self, other):
+        """bulk_create で作る行にも絞り込み中の組織が設定され、別の組織の行は拒否されることをテスト"""
+        category = Category.objects.create(name="交通費")
+        created = Expense.objects.bulk_create(
+            [
+                Expense(date=datetime.date(2024, 5, d), amount=Decimal(10), category=category)
+                for d in (1, 2)
+            ]
+        )
+
+        assert {e.organization_id for e in created} == {DEFAULT_ORGANIZATION_ID}
+        with pytest.raises(TenantMismatch):
+            Expense.objects.for_tenant(other).bulk_create(
+                [
+                    Expense(
+                        organization_id=DEFAULT_ORGANIZATION_ID,
+                        date=datetime.date(2024, 5, 3),
+                        amount=Decimal(10),
+                        category=category,
+                    )
+                ]
+            )
+
+    def test_duplicates_are_detected_within_a_tenant(self, other):
+        """同じ内容の経費でも他の組織のものは重複とみなさないことをテスト"""
+        expense = add_expense(Category.objects.create(name="交通費"))
+        with tenant_context(other):
+            copy = add_expense(Category.objects.create(name="交通費"))
+
+        assert copy.fingerprint == expense.fingerprint
+        assert not expense.find_duplicates().exists()
+        assert not copy.find_duplicates().exists()
+
+    def test_indexes_lead_with_the_tenant(self):
+        """経費の索引は管理画面用の (-date) を除き、組織か組織に属する行への外部キーから始まることをテスト"""
+        for index in Expense._meta.indexes:
+            if index.fields == ["-date"]:
+                continue
+            field = Expense._meta.get_field(index.fields[0].lstrip("-"))
+            assert isinstance(field, ForeignKey), index.fields
+            assert field.name == "organization" or issubclass(field.related_model, TenantModel), (
+                index.fields
+            )
+
+    def test_foreign_keys_use_the_composite_indexes(self):
+        """経費の外部キーには単独の索引を作らず、その外部キーが先頭の複合索引で兼ねることをテスト"""
+        leading = {index.fields[0].lstrip("-") for index in Expense._meta.indexes}
+        for field in Expense._meta.concrete_fields:
+            if isinstance(field, ForeignKey):
+                assert not field.db_index, field.name
+                assert field.name in leading, field.name
+
+
+@pytest.mark.django_db
+class TestTenantMiddleware:
+    @pytest.fixture
+    def member(self, other, django_user_model, settings):
+        settings.TRUST_TENANT_HEADER = True
+        user = django_user_model.objects.create_user(username="member", password="x")
+        other.members.add(user)
+        return user
+
+    def test_header_is_ignored_unless_trusted(self, other):
+        """TRUST_TENANT_HEADER が無効ならヘッダーを無視して既定の組織になることをテスト"""
+        Category.objects.create(name="交通費")
+        with tenant_context(other):
+            Category.objects.create(name="会議費")
+
+        response = graphql(CATEGORIES, organization=other.pk)
+
+        assert response.json()["data"]["categories"] == [{"name": "交通費"}]
+
+    def test_header_selects_the_tenant_for_members(self, other, member):
+        """メンバーは X-Organization-ID ヘッダーの組織のデータだけを受け取ることをテスト"""
+        Category.objects.create(name="交通費")
+        with tenant_context(other):
+            Category.objects.create(name="会議費")
+
+        default = graphql(CATEGORIES, user=member).json()["data"]["categories"]
+        selected = graphql(CATEGORIES, organization=other.pk, user=member).json()
+        assert default == [{"name": "交通費"}]
+        assert selected["data"]["categories"] == [{"name": "会議費"}]
+
+    def test_non_members_and_invalid_tenants_are_rejected(self, other, member, django_user_model):
+        """メンバーでない・未ログイン・存在しない組織は403、不正なIDは400になることをテスト"""
+        outsider = django_user_model.objects.create_user(username="outsider", password="x")
+
+        assert graphql(CATEGORIES, organization=other.pk, user=outsider).status_code == 403
+        assert graphql(CATEGORIES, organization=other.pk).status_code == 403
+        assert graphql(CATEGORIES, organization=uuid.uuid4(), user=member).status_code == 403
+        assert graphql(CATEGORIES, organization="not-a-uuid", user=member).status_code == 400
+
+    def test_mutations_cannot_reference_other_tenants(self, other, member):
+        """他の組織のカテゴリー・チームを指定した経費は登録できないことをテスト"""
+        category = Category.objects.create(name="交通費")
+        team = Team.objects.create(name="営業")
+        expense_input = {
+            "date": "2024-05-01",
+            "amount": "1000.00",
+            "categoryId": str(category.id),
+            "description": "タクシー",
+            "teamId": str(team.id),
+        }
+
+        created = graphql(CREATE_EXPENSE, {"input": expense_input}).json()
+        rejected = graphql(
+            CREATE_EXPENSE, {"input": expense_input}, organization=other.pk, user=member
+        ).json()
+
+        assert created["data"]["createExpense"]["team"] == {"name": "営業"}
+        assert "errors" in rejected
+        assert Expense.objects.for_tenant(other).count() == 0
+
+
+@pytest.mark.django_db
+class TestTenantSnapshots:
+    @pytest.fixture(autouse=True)
+    def snapshot_settings(self, settings, tmp_path):
+        settings.ANALYTICS_SNAPSHOT_PATH = tmp_path / "expense_snapshot.npz"
+        reset_snapshot()
+        yield settings
+        reset_snapshot()
+
+    def test_snapshots_are_per_tenant(self, other):
+        """組織ごとに別のスナップショット・ファイルになることをテスト"""
+        add_expense(Category.objects.create(name="交通費"))
+        with tenant_context(other):
+            category = Category.objects.create(name="交通費")
+            for day in (1, 2, 3):
+                add_expense(category, date=datetime.date(2024, 5, day))
+
+        assert len(get_snapshot()) == 1
+        assert len(get_snapshot(other)) == 3
+        assert snapshot_path(DEFAULT_ORGANIZATION_ID).exists()
+        assert snapshot_path(other).exists()
+        assert snapshot_path(other) != snapshot_path(DEFAULT_ORGANIZATION_ID)
+
+    def test_cache_is_bounded_per_tenant(self, other, snapshot_settings):
+        """保持する組織数を超えると古い組織のスナップショットから破棄することをテスト"""
+        snapshot_settings.ANALYTICS_SNAPSHOT_CACHE_TENANTS = 1
+        mine = get_snapshot()
+
+        get_snapshot(other)
+
+        assert list(analytics._snapshots) == [other.pk]
+        assert get_snapshot() is not mine
@@ -1,3 +1,58 @@
-from django.shortcuts import render
+from dataclasses import dataclass, field
+from typing import Any
 
-# Create your views here.
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from strawberry.django.context import StrawberryDjangoContext
+from strawberry.django.views import GraphQLView
+
+from .db.pool import all_pools
+from .tenancy import get_current_tenant, tenant_cache_key
+
+
+@dataclass
+class KeihiContext(StrawberryDjangoContext):
+    """GraphQLリクエストコンテキスト
+
+    バッチリクエストでは1回のHTTPリクエストにつき1つだけ生成され、
+    配列内の全オペレーションで共有される。
+    """
+
+    loaders: dict[tuple, dict[Any, Any]] = field(default_factory=dict)
+
+    def loader(self, name: str) -> dict[Any, Any]:
+        """名前ごとのリクエストスコープキャッシュを返す（組織ごとに別のキャッシュ）"""
+        return self.loaders.setdefault(tenant_cache_key(get_current_tenant(), name), {})
+
+
+class KeihiGraphQLView(GraphQLView):
+    """オペレーションの配列（バッチ）を受け付けるGraphQLビュー
+
+    バッチ内のオペレーションは同一スレッドで順に実行されるため、
+    ミドルウェア・セッション処理とDB接続は1回分で済む。
+    """
+
+    def get_context(self, request: HttpRequest, response: HttpResponse) -> KeihiContext:
+        return KeihiContext(request=request, response=response)
+
+
+def db_metrics(request: HttpRequest) -> JsonResponse:
+    """このプロセスのDB接続プールの待ち時間と使用率を返す（DEBUG時かスタッフのみ）
+
+    プールはプロセスごとに持つため、gunicorn などの複数ワーカーでは応答したワーカーの値になる。
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    return JsonResponse(
+        {
+            "databases": {
+                alias: {
+                    "vendor": connections[alias].vendor,
+                    "engine": connections[alias].settings_dict["ENGINE"],
+                }
+                for alias in connections
+            },
+            "pools": [pool.stats() for pool in all_pools()],
+        }
+    )
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # Load environment variables from .env file
 load_dotenv()
@@ -51,11 +52,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.querylog.SlowQueryMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.tenancy.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -84,12 +87,55 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.sqlite3'),
-        'NAME': BASE_DIR / os.getenv('DB_NAME', 'db.sqlite3'),
+DB_ENGINE = os.getenv('DB_ENGINE', 'api.db.sqlite3')
+
+if 'postgresql' in DB_ENGINE:
+    # PostgreSQL: DB_POOL_MAX_SIZE が1以上なら api.db.postgresql の接続プールを使う。
+    # プールなしの場合は DB_CONN_MAX_AGE 秒だけスレッドごとに接続を保持する
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '0'))
+    if DB_POOL_MAX_SIZE and DB_ENGINE != 'api.db.postgresql':
+        # 標準のバックエンドは OPTIONS['pool'] をそのまま psycopg2.connect() に渡してしまう
+        raise ImproperlyConfigured(
+            f"DB_POOL_MAX_SIZE を使うには DB_ENGINE を 'api.db.postgresql' にしてください（現在: {DB_ENGINE}）"
+        )
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.getenv('DB_NAME', 'keihi'),
+            'USER': os.getenv('DB_USER', ''),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', ''),
+            'PORT': os.getenv('DB_PORT', ''),
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
     }
-}
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '0')),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '600')),
+            'check_after': float(os.getenv('DB_POOL_CHECK_AFTER', '30')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': BASE_DIR / os.getenv('DB_NAME', 'db.sqlite3'),
+        }
+    }
+    if DB_ENGINE == 'api.db.sqlite3':
+        DATABASES['default']['OPTIONS'] = {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+                'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),
+            },
+        }
 
 
 # Password validation
@@ -136,3 +182,53 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # CORS settings
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:3000,http://localhost:5173').split(',')
 CORS_ALLOW_CREDENTIALS = True
+
+# GraphQL settings
+# 1リクエストにまとめて送信できるオペレーション数の上限（バッチ実行）
+GRAPHQL_BATCH_MAX_OPERATIONS = int(os.getenv('GRAPHQL_BATCH_MAX_OPERATIONS', '10'))
+
+# 重複経費の登録ポリシー（warn: 登録して警告 / reject: 拒否 / merge: 既存の経費を返す）
+EXPENSE_DUPLICATE_POLICY = os.getenv('EXPENSE_DUPLICATE_POLICY', 'warn')
+
+# Slow query log
+# しきい値を超えたSQLを発行元のGraphQLオペレーション・リゾルバーとともに記録し、一定の割合でEXPLAINを取得する
+SLOW_QUERY_LOG = {
+    'ENABLED': os.getenv('SLOW_QUERY_LOG_ENABLED', 'True') == 'True',
+    'THRESHOLD_MS': float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200')),
+    'EXPLAIN_SAMPLE_RATE': float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', '0.1')),
+    # ANALYZE は対象のSQLをもう一度実行するため、SELECTに限って取得する
+    'EXPLAIN_ANALYZE': os.getenv('SLOW_QUERY_EXPLAIN_ANALYZE', 'False') == 'True',
+}
+
+# Receipt metadata extraction
+# 領収書ファイルの保存先（Receipt.file_path が相対パスの場合の基準）と、抽出パイプラインのワーカー設定
+RECEIPT_EXTRACTION = {
+    'ROOT': BASE_DIR / os.getenv('RECEIPT_ROOT', 'var/receipts'),
+    'WORKERS': int(os.getenv('RECEIPT_EXTRACTION_WORKERS', str(os.cpu_count() or 1))),
+    'WORKER_MEMORY_MB': int(os.getenv('RECEIPT_EXTRACTION_WORKER_MEMORY_MB', '1024')),
+    # ワーカーをこの件数ごとに作り直し、メモリの断片化やリークを溜めない
+    'MAX_TASKS_PER_WORKER': int(os.getenv('RECEIPT_EXTRACTION_MAX_TASKS_PER_WORKER', '200')),
+    'BATCH_SIZE': int(os.getenv('RECEIPT_EXTRACTION_BATCH_SIZE', '200')),
+    'MAX_FILE_MB': int(os.getenv('RECEIPT_EXTRACTION_MAX_FILE_MB', '25')),
+    'MAX_PDF_PAGES': int(os.getenv('RECEIPT_EXTRACTION_MAX_PDF_PAGES', '5')),
+    'OCR_LANGUAGES': os.getenv('RECEIPT_OCR_LANGUAGES', 'jpn+eng'),
+    'OCR_TIMEOUT': int(os.getenv('RECEIPT_OCR_TIMEOUT', '60')),
+    'TESSERACT_CMD': os.getenv('TESSERACT_CMD', 'tesseract'),
+}
+
+# Analytics settings
+# 分析用の列指向スナップショット（NumPy .npz）の保存先
+ANALYTICS_SNAPSHOT_PATH = BASE_DIR / os.getenv('ANALYTICS_SNAPSHOT_PATH', 'var/analytics/expense_snapshot.npz')
+# スナップショットは組織ごとに持ち、プロセス内にはこの数の組織分だけ保持する（古いものから破棄）
+ANALYTICS_SNAPSHOT_CACHE_TENANTS = int(os.getenv('ANALYTICS_SNAPSHOT_CACHE_TENANTS', '32'))
+# 分析クエリの中で差分更新するのは、前回の更新からこの秒数が経った場合だけ（保存は refresh_analytics が行う）
+ANALYTICS_SNAPSHOT_REFRESH_SECONDS = int(os.getenv('ANALYTICS_SNAPSHOT_REFRESH_SECONDS', '60'))
+# 経費の削除記録の保持日数。これより長く更新していないスナップショットは全件で突き合わせ直す
+ANALYTICS_DELETION_RETENTION_DAYS = int(os.getenv('ANALYTICS_DELETION_RETENTION_DAYS', '7'))
+
+# Multi-tenancy
+# X-Organization-ID ヘッダーを使わないリクエストの組織（空にすると組織ごとのデータを問い合わせられない）
+DEFAULT_ORGANIZATION_ID = os.getenv('DEFAULT_ORGANIZATION_ID', '00000000-0000-0000-0000-000000000001')
+# X-Organization-ID ヘッダーで組織を選べるようにする（ログインユーザーがその組織のメンバーの場合のみ）。
+# 認証機能が入るまでは無効にしておく
+TRUST_TENANT_HEADER = os.getenv('TRUST_TENANT_HEADER', 'False') == 'True'
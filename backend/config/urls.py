@@ -17,10 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from strawberry.django.views import GraphQLView
 from api.schema import schema
+from api.views import KeihiGraphQLView, db_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(GraphQLView.as_view(schema=schema))),
+    path('graphql/', csrf_exempt(KeihiGraphQLView.as_view(schema=schema))),
+    path('metrics/db/', db_metrics),
 ]
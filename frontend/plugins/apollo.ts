@@ -1,11 +1,15 @@
-import { ApolloClient, InMemoryCache, HttpLink } from '@apollo/client/core'
+import { ApolloClient, InMemoryCache } from '@apollo/client/core'
+import { BatchHttpLink } from '@apollo/client/link/batch-http'
 import { DefaultApolloClient } from '@vue/apollo-composable'
 
 export default defineNuxtPlugin((nuxtApp) => {
   const config = useRuntimeConfig()
 
-  const httpLink = new HttpLink({
+  // 同じtick内のクエリを1回のPOSTにまとめて送信する（バックエンドのバッチ上限に合わせる）
+  const httpLink = new BatchHttpLink({
     uri: config.public.graphqlEndpoint as string,
+    batchMax: 10,
+    batchInterval: 10,
   })
 
   const apolloClient = new ApolloClient({